@@ -16,30 +16,20 @@ do
 				do
 
 					embedding=$(printf \
-					"embeddings/${dataset}/${exp}/alpha=0.${alpha}/seed=%03d/dim=%03d/%05d_embedding.csv" ${seed} ${dim} ${e})
+					"embeddings/${dataset}/${exp}/alpha=0.${alpha}/seed=%03d/dim=%03d/%05d_embedding.json" ${seed} ${dim} ${e})
 
-					if [ -f ${embedding}.gz ]
+					if [ ! -f ${embedding} ]
 					then
-						continue
-					elif [ -f ${embedding} ]
-					then 
-						gzip $embedding 
-					else
 						echo no embedding at ${embedding}
 					fi
 					
 				done
 
-				embedding=$(printf "embeddings/${dataset}/${exp}/alpha=1.00/seed=%03d/dim=%03d/%05d_embedding.csv" ${seed} ${dim} ${e})
+				embedding=$(printf "embeddings/${dataset}/${exp}/alpha=1.00/seed=%03d/dim=%03d/%05d_embedding.json" ${seed} ${dim} ${e})
 
-				if [ -f ${embedding}.gz ]
-					then
-						continue
-					elif [ -f ${embedding} ]
-					then 
-						gzip $embedding 
-					else
-						echo no embedding at ${embedding}
+				if [ ! -f ${embedding} ]
+				then
+					echo no embedding at ${embedding}
 				fi
 			done
 		done
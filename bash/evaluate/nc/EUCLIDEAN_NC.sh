@@ -46,7 +46,8 @@ then
     args=$(echo --edgelist ${edgelist} --labels ${labels} \
         --dist_fn euclidean \
         --embedding ${embedding_dir} --seed ${seed} \
-        --test-results-dir ${test_results})
+        --test-results-dir ${test_results} \
+        --split-cache ${data_dir}/splits)
     echo $args
 
     module purge
@@ -58,7 +58,8 @@ then
     args=$(echo --edgelist ${edgelist} --labels ${labels} \
         --dist_fn hyperboloid \
         --embedding ${embedding_dir} --seed ${seed} \
-        --test-results-dir ${test_results})
+        --test-results-dir ${test_results} \
+        --split-cache ${data_dir}/splits)
     echo $args
 
     python evaluate_nc.py ${args}
@@ -58,7 +58,7 @@ dir=$(printf "${dataset}/${exp}/alpha=${alpha}/seed=%03d" ${seed})
 embedding_dir=$(printf "embeddings/${dir}/dim=%03d" ${dim} )
 walks_dir=walks/${dir}
 
-embedding_f=$(printf "${embedding_dir}/%05d_embedding.csv.gz" ${e})
+embedding_f=$(printf "${embedding_dir}/%05d_embedding.json" ${e})
 if [ ! -f $embedding_f ]
 then
 	module purge
@@ -3,7 +3,7 @@
 #SBATCH --job-name=removeEdges
 #SBATCH --output=removeEdges_%A_%a.out
 #SBATCH --error=removeEdges_%A_%a.err
-#SBATCH --array=0-149
+#SBATCH --array=0-4
 #SBATCH --time=05:00:00
 #SBATCH --ntasks=1
 #SBATCH --mem=20G
@@ -12,27 +12,33 @@ datasets=(cora_ml citeseer ppi pubmed mit)
 seeds=({0..29})
 
 num_datasets=${#datasets[@]}
-num_seeds=${#seeds[@]}
 
-dataset_id=$((SLURM_ARRAY_TASK_ID / num_seeds % num_datasets ))
-seed_id=$((SLURM_ARRAY_TASK_ID % (num_seeds) ))
+dataset_id=$((SLURM_ARRAY_TASK_ID % num_datasets ))
 
 dataset=${datasets[$dataset_id]}
-seed=${seeds[$seed_id]}
 
 edgelist=datasets/${dataset}/edgelist.tsv.gz 
 output=edgelists/${dataset}
 
-edgelist_f=$(printf "${output}/seed=%03d/training_edges/edgelist.tsv" ${seed} )
-
-if [ ! -f $edgelist_f  ]
+# all seeds of a dataset are split in one run, skipping complete ones
+missing_seeds=()
+for seed in ${seeds[@]}
+do
+	edgelist_f=$(printf "${output}/seed=%03d/training_edges/edgelist.tsv" ${seed} )
+	if [ ! -f $edgelist_f  ]
+	then
+		missing_seeds+=(${seed})
+	fi
+done
+
+if [ ${#missing_seeds[@]} -gt 0 ]
 then
 	module purge
 	module load bluebear
 	module load future/0.16.0-foss-2018b-Python-3.6.6
 
 	args=$(echo --edgelist ${edgelist} \
-	--output ${output} --seed $seed)
+	--output ${output} --seed ${missing_seeds[@]})
 
 	python remove_edges.py ${args}
 fi
\ No newline at end of file
@@ -0,0 +1,71 @@
+from __future__ import print_function
+
+import os
+import sys
+import time
+import argparse
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from heat.utils import load_data, determine_positive_and_negative_samples
+from heat.distributed import train_distributed
+from heat.numpy_sgd import NegativeSampler
+
+def parse_args():
+	parser = argparse.ArgumentParser(description="Benchmark shared embedding training throughput")
+
+	parser.add_argument("--edgelist", dest="edgelist", type=str,
+		default="datasets/cora_ml/edgelist.tsv",
+		help="edgelist to load.")
+	parser.add_argument("--workers", dest="workers", type=int, nargs="+",
+		default=[1, 2, 4, 8],
+		help="numbers of workers to benchmark (default is 1 2 4 8).")
+	parser.add_argument("-e", "--num_epochs", dest="num_epochs", type=int, default=1)
+	parser.add_argument("-b", "--batch_size", dest="batch_size", type=int, default=512)
+	parser.add_argument("-d", "--dim", dest="embedding_dim", type=int, default=5)
+
+	args = parser.parse_args()
+
+	args.features = None
+	args.labels = None
+	args.directed = False
+	args.no_walks = True
+	args.all_negs = False
+	args.use_generator = True
+	args.visualise = False
+	args.num_negative_samples = 10
+	args.lr = 1.
+	args.sigma = 1.
+	args.seed = 0
+	args.verbose = False
+	args.embedding_path = None
+	return args
+
+def main():
+
+	args = parse_args()
+
+	graph, features, _ = load_data(args)
+	positive_samples, _, _, counts = determine_positive_and_negative_samples(
+		graph, features, args, return_counts=True, compute_probs=False)
+	sampler = NegativeSampler(counts, positive_samples)
+
+	print ("{:>8s} {:>10s} {:>14s} {:>8s}".format("workers",
+		"time (s)", "samples/s", "speedup"))
+	baseline = None
+	for num_workers in args.workers:
+		args.num_workers = num_workers
+		np.random.seed(args.seed)
+		start_time = time.time()
+		train_distributed(len(graph), positive_samples, sampler, args)
+		elapsed = time.time() - start_time
+		if baseline is None:
+			baseline = elapsed
+		print ("{:>8d} {:>10.2f} {:>14.0f} {:>8.2f}".format(num_workers,
+			elapsed, args.num_epochs * len(positive_samples) / elapsed,
+			baseline / elapsed))
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,95 @@
+from __future__ import print_function
+
+import os
+import sys
+import time
+import argparse
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from heat.nn_index import METRICS, NeighbourIndex
+from heat.geometry import poincare_ball_to_hyperboloid
+
+def parse_args():
+	parser = argparse.ArgumentParser(description="Benchmark recall and latency of the nearest neighbour index against brute force")
+
+	parser.add_argument("--embedding", dest="embedding_directory", type=str,
+		help="directory of embedding to load (default is a synthetic embedding).")
+	parser.add_argument("--dist_fn", dest="dist_fn", type=str,
+		choices=METRICS, default="hyperboloid")
+	parser.add_argument("--num-nodes", dest="num_nodes", type=int, default=100000,
+		help="number of points of the synthetic embedding (default is 100000).")
+	parser.add_argument("-d", "--dim", dest="embedding_dim", type=int, default=5,
+		help="dimension of the synthetic embedding (default is 5).")
+	parser.add_argument("--num-queries", dest="num_queries", type=int, default=1000)
+	parser.add_argument("-k", dest="k", type=int, default=10)
+	parser.add_argument("--leaf-size", dest="leaf_size", type=int, default=64)
+	parser.add_argument("--max-visits", dest="max_visits", type=int, nargs="+",
+		default=[1, 2, 4, 8, 16, 32, 64],
+		help="numbers of leaves scanned per query to benchmark (default is 1 2 4 8 16 32 64).")
+	parser.add_argument("--seed", type=int, default=0)
+
+	return parser.parse_args()
+
+def synthetic_embedding(args, rng):
+	'''
+	points in the Poincare ball with norms concentrated towards the
+	boundary, as in trained embeddings
+	'''
+	X = rng.normal(scale=0.25, size=(args.num_nodes, args.embedding_dim))
+	X /= np.maximum(1, np.linalg.norm(X, axis=-1, keepdims=True) / 0.99)
+	if args.dist_fn == "hyperboloid":
+		return poincare_ball_to_hyperboloid(X)
+	return X
+
+def recall(indices, true_indices):
+	k = true_indices.shape[1]
+	return np.mean([len(np.intersect1d(a, b)) / k
+		for a, b in zip(indices, true_indices)])
+
+def main():
+
+	args = parse_args()
+	rng = np.random.RandomState(args.seed)
+
+	if args.embedding_directory is not None:
+		from evaluation_utils import load_embedding
+		embedding = load_embedding(args.dist_fn, args.embedding_directory)
+	else:
+		embedding = synthetic_embedding(args, rng)
+	queries = embedding[rng.choice(len(embedding),
+		size=min(args.num_queries, len(embedding)), replace=False)]
+
+	start_time = time.time()
+	index = NeighbourIndex(embedding, dist_fn=args.dist_fn,
+		leaf_size=args.leaf_size, seed=args.seed)
+	print ("built index of {} points in {} leaves in {:.2f}s".format(
+		len(index), index.num_leaves, time.time() - start_time))
+	print ()
+
+	# brute force over all points, in the blocks used by the index
+	start_time = time.time()
+	true_indices = np.zeros((len(queries), args.k), dtype=np.int64)
+	true_distances = np.zeros((len(queries), args.k))
+	index.scan_all(index.to_metric_space(queries), np.arange(len(queries)),
+		true_indices, true_distances)
+	brute_force_time = time.time() - start_time
+
+	print ("{:>10s} {:>10s} {:>12s} {:>8s}".format("max visits",
+		"recall@{}".format(args.k), "ms/query", "speedup"))
+	print ("{:>10s} {:>10.4f} {:>12.4f} {:>8.2f}".format("brute", 1.,
+		1000 * brute_force_time / len(queries), 1.))
+	for max_visits in args.max_visits + [None]:
+		start_time = time.time()
+		indices, _ = index.query(queries, k=args.k, max_visits=max_visits)
+		query_time = time.time() - start_time
+		print ("{:>10s} {:>10.4f} {:>12.4f} {:>8.2f}".format(
+			"exact" if max_visits is None else str(max_visits),
+			recall(indices, true_indices),
+			1000 * query_time / len(queries),
+			brute_force_time / query_time))
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,126 @@
+from __future__ import print_function
+
+import os
+import sys
+import time
+import random
+import shutil
+import argparse
+import tempfile
+import subprocess
+
+import numpy as np
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, ROOT)
+
+from heat.utils import load_data
+from evaluation_utils import (load_embedding, evaluate_rank_AUROC_AP,
+	evaluate_mean_average_precision)
+from remove_utils import sample_non_edges
+
+def parse_args():
+	parser = argparse.ArgumentParser(description="Compare the reconstruction of embeddings trained with different numbers of partitions")
+
+	# the defaults finish in under a minute on one core, the full
+	# comparison is --datasets cora_ml pubmed -e 5 --num-walks 10
+	# --walk-length 80
+	parser.add_argument("--datasets", dest="datasets", nargs="+",
+		default=["cora_ml"],
+		help="datasets in datasets/<name>/edgelist.tsv (default is cora_ml).")
+	parser.add_argument("--partitions", dest="partitions", type=int, nargs="+",
+		default=[1, 4],
+		help="values of --num-partitions to train with (default is 1 4).")
+	parser.add_argument("-e", "--num_epochs", dest="num_epochs", type=int, default=1)
+	parser.add_argument("-d", "--dim", dest="embedding_dim", type=int, default=5)
+	parser.add_argument("--num-walks", dest="num_walks", type=int, default=2,
+		help="walks per node (default is 2).")
+	parser.add_argument("--walk-length", dest="walk_length", type=int, default=20,
+		help="length of every walk (default is 20).")
+	parser.add_argument("--no-walks", dest="no_walks", action="store_true",
+		help="train on the edges instead of random walks.")
+	parser.add_argument("--seed", type=int, default=0)
+	parser.add_argument("-v", "--verbose", dest="verbose", action="store_true",
+		help="show the output of main.py.")
+
+	return parser.parse_args()
+
+def train(edgelist, num_partitions, directory, args):
+	'''
+	run main.py with --num-partitions, returns the training time and the
+	embedding directory
+	'''
+	embedding_directory = os.path.join(directory, "embedding")
+	command = [sys.executable, os.path.join(ROOT, "main.py"),
+		"--edgelist", edgelist,
+		"--embedding", embedding_directory,
+		"--walks", os.path.join(directory, "walks"),
+		"--num-partitions", str(num_partitions),
+		"-e", str(args.num_epochs),
+		"-d", str(args.embedding_dim),
+		"--num-walks", str(args.num_walks),
+		"--walk-length", str(args.walk_length),
+		"--seed", str(args.seed)]
+	if args.no_walks:
+		command.append("--no-walks")
+	start_time = time.time()
+	subprocess.run(command, check=True, cwd=ROOT,
+		stdout=None if args.verbose else subprocess.DEVNULL)
+	return time.time() - start_time, embedding_directory
+
+def evaluate(embedding_directory, test_edges, test_non_edges, seed):
+	embedding = load_embedding("hyperboloid", embedding_directory)
+	mean_rank, ap, roc = evaluate_rank_AUROC_AP(embedding,
+		test_edges, test_non_edges, "hyperboloid")
+	random.seed(seed)
+	map_recon, precisions_at_k = evaluate_mean_average_precision(embedding,
+		test_edges, "hyperboloid")
+	results = [("mean_rank_recon", mean_rank),
+		("ap_recon", ap),
+		("roc_recon", roc),
+		("map_recon", map_recon)]
+	results += [("p@{}".format(k), pk)
+		for k, pk in sorted(precisions_at_k.items())]
+	return results
+
+def main():
+
+	args = parse_args()
+
+	tables = []
+	for dataset in args.datasets:
+		edgelist = os.path.join(ROOT, "datasets", dataset, "edgelist.tsv")
+		graph, _, _ = load_data(argparse.Namespace(edgelist=edgelist,
+			features=None, labels=None, directed=False))
+		test_edges = list(graph.edges())
+		test_edges += [(v, u) for u, v in test_edges]
+		test_edges = np.array(test_edges)
+		test_non_edges = sample_non_edges(graph, test_edges,
+			len(test_edges), seed=args.seed)
+
+		columns = []
+		for num_partitions in args.partitions:
+			directory = tempfile.mkdtemp()
+			try:
+				print ("training {} with {} partitions".format(dataset,
+					num_partitions))
+				training_time, embedding_directory = train(edgelist,
+					num_partitions, directory, args)
+				columns.append([("time (s)", training_time)] + evaluate(
+					embedding_directory, test_edges, test_non_edges,
+					args.seed))
+			finally:
+				shutil.rmtree(directory)
+		tables.append((dataset, columns))
+
+	for dataset, columns in tables:
+		print ()
+		print ("{:<16s}".format(dataset) + "".join("{:>12s}".format(
+			"K={}".format(num_partitions))
+			for num_partitions in args.partitions))
+		for i, (metric, _) in enumerate(columns[0]):
+			print ("{:<16s}".format(metric) + "".join("{:>12.4f}".format(
+				column[i][1]) for column in columns))
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,212 @@
+from __future__ import print_function
+
+import os
+import sys
+import shutil
+import argparse
+import tempfile
+import importlib.util
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from heat.checkpoint import (save_checkpoint, write_delta, write_delta_rows,
+	write_snapshot, restore_latest, list_sub_epoch_checkpoints)
+from heat.geometry import poincare_ball_to_hyperboloid
+
+def parse_args():
+	parser = argparse.ArgumentParser(description="Check that restore_latest replays mid-epoch deltas and compactions to the live weights")
+
+	parser.add_argument("--num-nodes", dest="num_nodes", type=int, default=1000)
+	parser.add_argument("-d", "--dim", dest="embedding_dim", type=int, default=5)
+	parser.add_argument("-e", "--num_epochs", dest="num_epochs", type=int, default=3)
+	parser.add_argument("--steps", dest="steps", type=int, default=40,
+		help="batches per epoch (default is 40).")
+	parser.add_argument("--delta-steps", dest="delta_steps", type=int, default=3,
+		help="batches between deltas (default is 3).")
+	parser.add_argument("--deltas-per-snapshot", dest="deltas_per_snapshot",
+		type=int, default=4)
+	parser.add_argument("--seed", type=int, default=0)
+
+	return parser.parse_args()
+
+def random_points(rng, num_points, dim):
+	X = rng.normal(scale=0.25, size=(num_points, dim))
+	X /= np.maximum(1, np.linalg.norm(X, axis=-1, keepdims=True) / 0.99)
+	return poincare_ball_to_hyperboloid(X)
+
+def train_step(embedding, rng, step):
+	'''
+	move a few rows, and most rows every tenth step so that the delta
+	exceeds the compaction fraction
+	'''
+	num_changed = len(embedding) * 3 // 4 if step % 10 == 0 else 20
+	idx = rng.choice(len(embedding), size=num_changed, replace=False)
+	embedding[idx] = random_points(rng, num_changed, embedding.shape[1] - 1)
+	return idx
+
+def check_restore(directory, embedding, epoch, step):
+	restored, restored_epoch, restored_step = restore_latest(directory)
+	assert (restored_epoch, restored_step) == (epoch, step), \
+		"restored epoch {} step {}, expected epoch {} step {}".format(
+			restored_epoch, restored_step, epoch, step)
+	assert np.array_equal(restored, embedding), \
+		"restored weights of epoch {} step {} differ".format(epoch, step)
+
+def check_write_delta(args, directory):
+	'''
+	write deltas and compactions as the Checkpointer does and restore
+	after every one of them
+	'''
+	os.makedirs(directory)
+	rng = np.random.RandomState(args.seed)
+	embedding = random_points(rng, args.num_nodes, args.embedding_dim)
+	save_checkpoint(directory, 0, embedding)
+	num_restores = 0
+	num_snapshots = 0
+
+	for epoch in range(args.num_epochs):
+		base_filename = os.path.join(directory,
+			"{:05d}_embedding.npy".format(epoch))
+		num_deltas = 0
+		for step in range(1, args.steps + 1):
+			train_step(embedding, rng, step)
+			if step % args.delta_steps != 0 or step == args.steps:
+				continue
+			filename = write_delta(directory, epoch, step, embedding,
+				base_filename,
+				force_snapshot=num_deltas >= args.deltas_per_snapshot)
+			if filename == base_filename:
+				num_deltas += 1
+			else:
+				base_filename = filename
+				num_deltas = 0
+				num_snapshots += 1
+			check_restore(directory, embedding, epoch, step)
+			num_restores += 1
+
+		save_checkpoint(directory, epoch + 1, embedding)
+		assert len(list_sub_epoch_checkpoints(directory)) == 0, \
+			"deltas of epoch {} were not removed".format(epoch)
+		check_restore(directory, embedding, epoch + 1, 0)
+		num_restores += 1
+
+	print ("write_delta: {} restores match the live weights "
+		"({} mid-epoch snapshots)".format(num_restores, num_snapshots))
+
+def check_write_delta_rows(args, directory):
+	'''
+	write the rows trained since the previous delta as the Checkpointer
+	does with a generator, and restore after every delta and snapshot
+	'''
+	os.makedirs(directory)
+	rng = np.random.RandomState(args.seed)
+	embedding = random_points(rng, args.num_nodes, args.embedding_dim)
+	save_checkpoint(directory, 0, embedding)
+	num_restores = 0
+	num_snapshots = 0
+
+	for epoch in range(args.num_epochs):
+		base_filename = os.path.join(directory,
+			"{:05d}_embedding.npy".format(epoch))
+		num_deltas = 0
+		trained = []
+		changed = np.zeros(args.num_nodes, dtype=bool)
+		for step in range(1, args.steps + 1):
+			trained.append(train_step(embedding, rng, step))
+			if step % args.delta_steps != 0 or step == args.steps:
+				continue
+			idx = np.unique(np.concatenate(trained))
+			trained = []
+			changed[idx] = True
+			if num_deltas >= args.deltas_per_snapshot or \
+				changed.sum() > 0.5 * args.num_nodes:
+				base_filename = write_snapshot(directory, epoch, step,
+					embedding)
+				num_deltas = 0
+				changed[:] = False
+				num_snapshots += 1
+			else:
+				write_delta_rows(directory, epoch, step, idx, 
+					embedding[idx], base_filename)
+				num_deltas += 1
+			check_restore(directory, embedding, epoch, step)
+			num_restores += 1
+
+		save_checkpoint(directory, epoch + 1, embedding)
+		assert len(list_sub_epoch_checkpoints(directory)) == 0, \
+			"deltas of epoch {} were not removed".format(epoch)
+		check_restore(directory, embedding, epoch + 1, 0)
+		num_restores += 1
+
+	print ("write_delta_rows: {} restores match the live weights "
+		"({} mid-epoch snapshots)".format(num_restores, num_snapshots))
+
+class Model(object):
+
+	def __init__(self, embedding):
+		self.embedding = embedding
+
+	def get_weights(self):
+		return [self.embedding.copy()]
+
+def check_checkpointer(args, directory):
+	'''
+	drive the Checkpointer callback through training and restore after
+	every batch once its writes have finished
+	'''
+	from heat.callbacks import Checkpointer
+
+	os.makedirs(directory)
+	rng = np.random.RandomState(args.seed)
+	model = Model(random_points(rng, args.num_nodes, args.embedding_dim))
+	save_checkpoint(directory, 0, model.embedding)
+
+	checkpointer = Checkpointer(epoch=0,
+		nodes=range(args.num_nodes),
+		embedding_directory=directory,
+		delta_steps=args.delta_steps,
+		deltas_per_snapshot=args.deltas_per_snapshot)
+	checkpointer.set_model(model)
+	checkpointer.set_params({"steps": args.steps})
+
+	checkpointer.on_train_begin()
+	# the weights at the last delta or checkpoint
+	saved = (model.embedding.copy(), 0, 0)
+	for epoch in range(args.num_epochs):
+		for batch in range(args.steps):
+			train_step(model.embedding, rng, batch + 1)
+			checkpointer.on_batch_end(batch)
+			if checkpointer.step % args.delta_steps == 0 \
+				and batch + 1 < args.steps:
+				saved = (model.embedding.copy(), epoch, checkpointer.step)
+			checkpointer.writer.wait()
+			check_restore(directory, *saved)
+		checkpointer.on_epoch_end(epoch)
+		saved = (model.embedding.copy(), epoch + 1, 0)
+		checkpointer.writer.wait()
+		check_restore(directory, *saved)
+	checkpointer.on_train_end()
+
+	print ("Checkpointer: {} epochs of {} batches restore to the live "
+		"weights".format(args.num_epochs, args.steps))
+
+def main():
+
+	args = parse_args()
+
+	directory = tempfile.mkdtemp()
+	try:
+		check_write_delta(args, os.path.join(directory, "write_delta"))
+		check_write_delta_rows(args, os.path.join(directory, 
+			"write_delta_rows"))
+		if importlib.util.find_spec("keras") is None:
+			print ("keras is not installed -- skipping the Checkpointer check")
+		else:
+			check_checkpointer(args, os.path.join(directory, "checkpointer"))
+	finally:
+		shutil.rmtree(directory)
+
+if __name__ == "__main__":
+	main()
@@ -1,8 +1,10 @@
-import pandas as pd 
 import os
+import sys
 import itertools
 
-from pandas.errors import EmptyDataError
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from heat.checkpoint import checkpoint_filenames, load_checkpoint
 
 def main():
 
@@ -24,16 +26,21 @@ def main():
 
         )
 
-        filename = os.path.join(embedding_directory, 
-            "{:05d}_embedding.csv.gz".format(e))
+        filename, metadata_filename, _ = checkpoint_filenames(
+            embedding_directory, e)
 
+        if not os.path.exists(metadata_filename):
+            print (metadata_filename, "does not exist")
+            continue
         try:
-            pd.read_csv(filename, index_col=0)
-        except EmptyDataError:
-            print (filename, "is empty removing it")
-            os.remove(filename)
-        except IOError:
-            print (filename, "does not exist")
+            load_checkpoint(filename)
+        except (IOError, ValueError) as error:
+            # the metadata is removed first so that the checkpoint is
+            # never listed without its embedding
+            print (error, "removing it")
+            os.remove(metadata_filename)
+            if os.path.exists(filename):
+                os.remove(filename)
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,76 @@
+from __future__ import print_function
+
+import os
+import sys
+import json
+import argparse
+import subprocess
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+# modules that must import without loading any of the heavy dependencies
+LIGHTWEIGHT_MODULES = ["heat.utils", "heat.checkpoint", "evaluation_utils",
+	"evaluate_lp", "evaluate_reconstruction", "evaluate_nc", "remove_edges",
+	"main", "sweep", "pipeline"]
+HEAVY_MODULES = ["tensorflow", "keras", "matplotlib"]
+
+PROBE = '''
+import sys, time, json
+start_time = time.time()
+import {module}
+print (json.dumps({{"seconds": time.time() - start_time,
+	"loaded": [m for m in {heavy} if m in sys.modules]}}))
+'''
+
+def parse_args():
+	parser = argparse.ArgumentParser(description="Measure the import time of the command line tools")
+
+	parser.add_argument("--modules", dest="modules", nargs="+",
+		default=LIGHTWEIGHT_MODULES,
+		help="modules to import.")
+	parser.add_argument("--repeats", dest="repeats", type=int, default=3,
+		help="number of fresh interpreters per module, the fastest is reported (default is 3).")
+
+	return parser.parse_args()
+
+def import_time(module):
+	'''
+	import module in a fresh interpreter, returns (seconds, heavy modules
+	loaded) or (None, error) if the import failed
+	'''
+	process = subprocess.run([sys.executable, "-c",
+		PROBE.format(module=module, heavy=HEAVY_MODULES)],
+		cwd=ROOT, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+	if process.returncode != 0:
+		return None, process.stderr.decode().strip().split("\n")[-1]
+	result = json.loads(process.stdout.decode().strip().split("\n")[-1])
+	return result["seconds"], result["loaded"]
+
+def main():
+
+	args = parse_args()
+
+	print ("{:<28s} {:>10s}  {}".format("module", "import (s)", "heavy modules loaded"))
+	heavy = False
+	errors = False
+	for module in args.modules:
+		results = [import_time(module) for _ in range(args.repeats)]
+		seconds = [s for s, _ in results if s is not None]
+		if len(seconds) == 0:
+			print ("{:<28s} {:>10s}  {}".format(module, "error", results[0][1]))
+			errors = True
+			continue
+		loaded = results[0][1]
+		heavy |= len(loaded) > 0
+		print ("{:<28s} {:>10.3f}  {}".format(module, min(seconds),
+			", ".join(loaded) or "-"))
+
+	if heavy:
+		print ("\nheavy dependencies are imported at module level")
+	if errors:
+		print ("\nsome modules could not be imported")
+	if heavy or errors:
+		sys.exit(1)
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,100 @@
+from __future__ import print_function
+
+import os
+import sys
+import time
+import shutil
+import argparse
+import tempfile
+import threading
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from heat.checkpoint import write_checkpoint
+from heat.geometry import poincare_ball_to_hyperboloid
+from evaluation_utils import compute_scores
+from serve_embedding import EmbeddingServer, EmbeddingClient
+
+def parse_args():
+	parser = argparse.ArgumentParser(description="Check the embedding server against compute_scores with a local client")
+
+	parser.add_argument("--num-nodes", dest="num_nodes", type=int, default=10000)
+	parser.add_argument("-d", "--dim", dest="embedding_dim", type=int, default=5)
+	parser.add_argument("--num-requests", dest="num_requests", type=int, default=200)
+	parser.add_argument("-b", "--batch_size", dest="batch_size", type=int, default=64)
+	parser.add_argument("-k", dest="k", type=int, default=10)
+	parser.add_argument("--seed", type=int, default=0)
+
+	return parser.parse_args()
+
+def random_embedding(args, rng):
+	X = rng.normal(scale=0.25, size=(args.num_nodes, args.embedding_dim))
+	X /= np.maximum(1, np.linalg.norm(X, axis=-1, keepdims=True) / 0.99)
+	return poincare_ball_to_hyperboloid(X)
+
+def check_requests(client, embedding, args, rng):
+	for _ in range(args.num_requests):
+		u = rng.choice(args.num_nodes, size=args.batch_size)
+		v = rng.choice(args.num_nodes, size=args.batch_size)
+		assert np.allclose(client.score(u, v),
+			compute_scores(embedding[u], embedding[v], "hyperboloid"))
+
+		indices, scores = client.topk(u[:8], k=args.k)
+		for i, node in enumerate(u[:8]):
+			all_scores = compute_scores(embedding[[node]], embedding,
+				"hyperboloid")
+			all_scores[node] = -np.inf
+			assert np.allclose(scores[i], np.sort(all_scores)[::-1][:args.k])
+			assert np.allclose(all_scores[indices[i]], scores[i])
+
+def main():
+
+	args = parse_args()
+	rng = np.random.RandomState(args.seed)
+
+	directory = tempfile.mkdtemp()
+	address = os.path.join(directory, "server.sock")
+	try:
+		embedding = random_embedding(args, rng)
+		write_checkpoint(directory, 1, embedding)
+
+		server = EmbeddingServer(directory, "hyperboloid", address,
+			poll_interval=0.1)
+		thread = threading.Thread(target=server.serve)
+		thread.start()
+
+		client = EmbeddingClient(address)
+		check_requests(client, embedding, args, rng)
+		print ("scores and neighbours match compute_scores")
+
+		# publish a new epoch and wait for the server to pick it up
+		embedding = random_embedding(args, rng)
+		write_checkpoint(directory, 2, embedding)
+		start_time = time.time()
+		while server.version[0][0] != os.path.join(directory,
+			"00002_embedding.npy"):
+			assert time.time() - start_time < 10, "checkpoint was not reloaded"
+			time.sleep(0.05)
+		print ("reloaded new checkpoint in {:.2f}s".format(
+			time.time() - start_time))
+		check_requests(client, embedding, args, rng)
+		print ("scores and neighbours match the new checkpoint")
+
+		print ()
+		print ("{:>8s} {:>8s} {:>10s} {:>10s} {:>10s} {:>10s}".format(
+			"request", "count", "p50 (ms)", "p90 (ms)", "p99 (ms)", "max (ms)"))
+		for command, stats in sorted(client.stats().items()):
+			print ("{:>8s} {:>8d} {:>10.3f} {:>10.3f} {:>10.3f} {:>10.3f}".format(
+				command, stats["count"], stats["p50"], stats["p90"],
+				stats["p99"], stats["max"]))
+		client.close()
+		server.close()
+		thread.join()
+
+	finally:
+		shutil.rmtree(directory)
+
+if __name__ == "__main__":
+	main()
@@ -7,6 +7,8 @@ import itertools
 
 import pickle as pkl
 
+from heat.results_store import ResultsStore
+
 def make_dir(d):
 	if not os.path.exists(d):
 		print ("making directory", d)
@@ -27,6 +29,13 @@ def parse_args():
 		choices=["reconstruction", "lp", "nc"],
 		help="experiment to evaluate")
 
+	parser.add_argument("--results-db", 
+		dest="results_db", default=None, 
+		help="SQLite database of test results to collate instead of the pickles in --test-results.")
+	parser.add_argument("--import-pickles", 
+		dest="import_pickles", action="store_true", 
+		help="flag to add the pickles in --test-results to --results-db first.")
+
 	parser.add_argument("--output", 
 	dest="output", default="collated_results", 
 		help="path to save collated test results (default is 'collated_results)'.")
@@ -56,6 +65,16 @@ def main():
 
 	critical_value = 0.05
 
+	if args.results_db is not None:
+		store = ResultsStore(args.results_db)
+		if args.import_pickles:
+			store.import_pickles(args.test_results_path)
+		# every result of the experiment in one query
+		all_results_df = store.query(exp=exp, epoch=-1)
+		store.close()
+	else:
+		all_results_df = None
+
 	for dim in dims:
 
 		output_dir_ = os.path.join(output_dir, 
@@ -83,21 +102,28 @@ def main():
 				# results_df = pd.read_csv(results_file, 
 				# 	index_col=0, sep=",")
 
-				results_df = []
-				for seed in range(num_seeds):
-					results_file = os.path.join(args.test_results_path, 
-					dataset,
-					exp,
-					algorithm,
-					dim,
-					"{}.pkl".format(seed))
-					print ("reading results from", results_filename)
-					assert os.path.exists(results_filename)
-					with open(results_filename, "rb") as f:
-						results = pkl.load(f)
-					results_df.append(results)
-
-				results_df = pd.DataFrame(results_df)
+				if all_results_df is not None:
+					results_df = all_results_df.xs(
+						(dataset, algorithm, int(dim[len("dim="):])),
+						level=("dataset", "algorithm", "dim"))
+					results_df = results_df.dropna(axis=1, how="all")
+
+				else:
+					results_df = []
+					for seed in range(num_seeds):
+						results_filename = os.path.join(args.test_results_path, 
+						dataset,
+						exp,
+						algorithm,
+						dim,
+						"{}.pkl".format(seed))
+						print ("reading results from", results_filename)
+						assert os.path.exists(results_filename)
+						with open(results_filename, "rb") as f:
+							results = pkl.load(f)
+						results_df.append(results)
+
+					results_df = pd.DataFrame(results_df)
 
 				assert results_df.shape[0] == num_seeds, \
 					(dataset, dim, algorithm)
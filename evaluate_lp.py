@@ -2,16 +2,16 @@ import os
 
 import numpy as np
 import networkx as nx
-import pandas as pd
-
-import pickle as pkl
 
 import argparse
+import functools
 
 from heat.utils import load_data
-from evaluation_utils import (load_embedding, compute_scores, 
-	evaluate_rank_AUROC_AP, evaluate_mean_average_precision, 
-	read_edgelist)
+from heat.results_store import ResultsStore
+from evaluation_utils import (compute_scores, 
+	evaluate_rank_AUROC_AP, evaluate_rank_AUROC_AP_streaming, 
+	evaluate_mean_average_precision, 
+	read_edgelist, embedding_jobs, group_jobs, evaluate_embeddings)
 
 import random
 
@@ -26,13 +26,19 @@ def parse_args():
 	parser.add_argument("--labels", dest="labels", type=str, 
 		help="path to labels")
 	parser.add_argument("--removed_edges_dir", dest="removed_edges_dir", type=str, 
-		help="path to load removed edges")
+		help="path to load removed edges, formatted with the fields of each embedding path, for example seed={seed:03d}.")
 	
-	parser.add_argument("--embedding", dest="embedding_directory",  
-		help="directory of embedding to load.")
+	parser.add_argument("--embedding", dest="embedding_directory", nargs="+", 
+		help="directories (or glob patterns) of embeddings to load.")
+	parser.add_argument("--all-checkpoints", dest="all_checkpoints", action="store_true",
+		help="flag to evaluate every checkpoint in the embedding directories instead of the latest.")
 
 	parser.add_argument("--test-results-dir", dest="test_results_dir",  
-		help="path to save results.")
+		help="path to save results, formatted with the key=value components of each embedding path, for example dim={dim:03d}.")
+	parser.add_argument("--skip-existing", dest="skip_existing", action="store_true",
+		help="flag to skip embeddings whose results have already been saved.")
+	parser.add_argument("--results-db", dest="results_db", default=None,
+		help="SQLite database to add results to instead of writing a pickle for each embedding.")
 
 	parser.add_argument('--directed', action="store_true", help='flag to train on directed graph')
 
@@ -42,65 +48,48 @@ def parse_args():
 		choices=["poincare", "hyperboloid", "euclidean", 
 		"kle", "klh", "st"])
 
-	return parser.parse_args()
-
-
-def main():
-
-	args = parse_args()
-
-	test_results_dir = args.test_results_dir
-	if not os.path.exists(test_results_dir):
-		os.makedirs(test_results_dir, exist_ok=True)
-	
-	test_results_filename = os.path.join(test_results_dir, 
-		"{}.pkl".format(args.seed))
-
-	# if check_complete(test_results_filename, args.seed):
-	# 	return
-
-	# test_results_lock_filename = os.path.join(test_results_dir, 
-	# 	"test_results.lock")
-	# touch(test_results_lock_filename)
+	parser.add_argument("--processes", dest="processes", type=int, default=1,
+		help="number of processes used to compute mean average precision (default is 1).")
+	parser.add_argument("--workers", dest="workers", type=int, default=1,
+		help="number of embeddings evaluated at once, each in its own process (default is 1).")
+	parser.add_argument("--exact-map", dest="exact_map", action="store_true",
+		help="flag to rank every node against all other nodes instead of 1000 sampled non neighbours.")
+	parser.add_argument("--streaming", dest="streaming", type=str,
+		choices=["exact", "histogram"],
+		help="score test edges in chunks and compute exact metrics by merging sorted runs on disk, or approximate them with score histograms.")
+	parser.add_argument("--chunk-size", dest="chunk_size", type=int, default=2 ** 20,
+		help="number of pairs scored at once with --streaming (default is 2^20).")
 
-	graph, _, _ = load_data(args)
-	assert not nx.is_directed(graph)
-	print ("Loaded dataset")
-	print ()
-
-	seed = args.seed
-	random.seed(seed)
-
-	removed_edges_dir = args.removed_edges_dir
-
-	test_edgelist_fn = os.path.join(removed_edges_dir, 
-		"test_edges.tsv")
-	test_non_edgelist_fn = os.path.join(removed_edges_dir, 
-		"test_non_edges.tsv")
-
-	print ("loading test edges from {}".format(test_edgelist_fn))
-	print ("loading test non-edges from {}".format(test_non_edgelist_fn))
-
-	test_edges = read_edgelist(test_edgelist_fn)
-	test_non_edges = read_edgelist(test_non_edgelist_fn)
+	return parser.parse_args()
 
-	test_edges = np.array(test_edges)
-	test_non_edges = np.array(test_non_edges)
 
-	print ("number of test edges:", len(test_edges))
-	print ("number of test non edges:", len(test_non_edges))
+def evaluate_link_prediction(args, graph_edges, test_edges, 
+	test_non_edges, processes, embedding, fields):
 
-	embedding = load_embedding(args.dist_fn, 
-		args.embedding_directory)
+	random.seed(fields["seed"])
 
 	test_results = dict()
 
-	(mean_rank_lp, ap_lp, 
-		roc_lp) = evaluate_rank_AUROC_AP(
-			embedding,
-			test_edges, 
-			test_non_edges,
-			args.dist_fn)
+	if args.streaming is None:
+		(mean_rank_lp, ap_lp, 
+			roc_lp) = evaluate_rank_AUROC_AP(
+				embedding,
+				test_edges, 
+				test_non_edges,
+				args.dist_fn)
+	else:
+		(mean_rank_lp, ap_lp, 
+			roc_lp), errors = evaluate_rank_AUROC_AP_streaming(
+				embedding,
+				test_edges, 
+				test_non_edges,
+				args.dist_fn,
+				method=args.streaming,
+				chunk_size=args.chunk_size)
+		if args.streaming == "histogram":
+			test_results.update({"max_error_" + name: error 
+				for name, error in zip(("mean_rank_lp", "ap_lp", "roc_lp"), 
+				errors)})
 
 	test_results.update(
 		{"mean_rank_lp": mean_rank_lp, 
@@ -111,7 +100,9 @@ def main():
 		embedding, 
 		test_edges,
 		args.dist_fn, 
-		graph_edges=graph.edges()
+		graph_edges=graph_edges,
+		max_non_neighbours=None if args.exact_map else 1000,
+		processes=processes
 		)
 
 	test_results.update({"map_lp": map_lp})
@@ -121,18 +112,73 @@ def main():
 	test_results.update({"p@{}".format(k): pk
 		for k, pk in precisions_at_k.items()})
 
-	print ("saving test results to {}".format(
-		test_results_filename))
+	return test_results
+
+def main():
+
+	args = parse_args()
+
+	results_store = ResultsStore(args.results_db) \
+		if args.results_db is not None else None
+
+	jobs = embedding_jobs(args.embedding_directory, 
+		args.dist_fn, 
+		args.test_results_dir, 
+		seed=args.seed,
+		all_checkpoints=args.all_checkpoints,
+		skip_existing=args.skip_existing,
+		results_store=results_store)
+	if len(jobs) == 0:
+		return
+
+	graph, _, _ = load_data(args)
+	assert not nx.is_directed(graph)
+	print ("Loaded dataset")
+	print ()
+	graph_edges = list(graph.edges())
+
+	# worker processes cannot start their own pools
+	processes = args.processes if args.workers == 1 else 1
+
+	failed = []
+	# embeddings of the same seed share their removed edges
+	for removed_edges_dir, group in group_jobs(jobs, 
+		lambda fields: args.removed_edges_dir.format(**fields)):
+
+		test_edgelist_fn = os.path.join(removed_edges_dir, 
+			"test_edges.tsv")
+		test_non_edgelist_fn = os.path.join(removed_edges_dir, 
+			"test_non_edges.tsv")
+
+		print ("loading test edges from {}".format(test_edgelist_fn))
+		print ("loading test non-edges from {}".format(test_non_edgelist_fn))
+
+		test_edges = read_edgelist(test_edgelist_fn)
+		test_non_edges = read_edgelist(test_non_edgelist_fn)
+
+		test_edges = np.array(test_edges)
+		test_non_edges = np.array(test_non_edges)
+
+		print ("number of test edges:", len(test_edges))
+		print ("number of test non edges:", len(test_non_edges))
+
+		failed += evaluate_embeddings(functools.partial(
+				evaluate_link_prediction, args, graph_edges, 
+				test_edges, test_non_edges, processes), 
+			group, 
+			workers=args.workers,
+			results_store=results_store)
 
-	# threadsafe_save_test_results(test_results_lock_filename, 
-	# 	test_results_filename, seed, data=test_results )
+	if results_store is not None:
+		results_store.close()
 
-	test_results = pd.Series(test_results)
-	with open(test_results_filename, "wb") as f:
-		pkl.dump(test_results, f, pkl.HIGHEST_PROTOCOL)
+	if len(failed) > 0:
+		raise Exception("could not evaluate {} embeddings: {}".format(
+			len(failed), ", ".join(job["embedding_directory"] 
+				for job, _ in failed)))
 
 	print ("done")
 
 
 if __name__ == "__main__":
-	main()
\ No newline at end of file
+	main()
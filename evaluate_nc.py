@@ -1,10 +1,12 @@
 import os
+import time
+import hashlib
+import shutil
+import tempfile
 
 import numpy as np
-import pandas as pd
 
 
-from sklearn.linear_model import LogisticRegressionCV
 from sklearn.svm import SVC
 from sklearn.model_selection import StratifiedShuffleSplit, StratifiedKFold
 from sklearn.multiclass import OneVsRestClassifier
@@ -16,18 +18,18 @@ from sklearn.preprocessing import LabelBinarizer
 
 from skmultilearn.model_selection import IterativeStratification
 
-from heat.utils import (load_data, hyperboloid_to_klein, 
-	poincare_ball_to_hyperboloid, hyperboloid_to_poincare_ball,
+from heat.utils import load_data
+from heat.geometry import (poincare_ball_to_hyperboloid, 
 	hyperboloid_to_poincare_ball, poincare_ball_to_klein)
-from evaluation_utils import load_embedding
+from evaluation_utils import embedding_jobs, evaluate_embeddings
+from heat import profiling
+from heat.results_store import ResultsStore
 
 import functools
 import fcntl
 
 import argparse
 
-import pickle as pkl
-
 from collections import Counter
 
 def compute_measures( 
@@ -47,49 +49,232 @@ def compute_measures(
 
 	return roc, f1, precision, recall
 
+# number of squared distances or kernel entries computed at once
+DISTANCE_BLOCK_ELEMENTS = 2 ** 24
+
+def squared_distances(embedding, filename=None):
+	'''
+	(N, N) squared hyperbolic distances between points on the hyperboloid,
+	computed in blocks of rows and written to a .npy memmap if filename
+	is given
+	'''
+	from heat.geometry import pairwise_hyperboloid_distance
+
+	N = len(embedding)
+	if filename is None:
+		D = np.empty((N, N))
+	else:
+		D = np.lib.format.open_memmap(filename, mode="w+", 
+			dtype=np.float64, shape=(N, N))
+	block_size = max(1, DISTANCE_BLOCK_ELEMENTS // N)
+	for start in range(0, N, block_size):
+		nodes = np.arange(start, min(start + block_size, N))
+		D[nodes] = pairwise_hyperboloid_distance(embedding[nodes], 
+			embedding) ** 2
+	return D
+
+def rbf_kernel_matrix(embedding, filename=None):
+	'''
+	(N, N) rbf kernel exp(-gamma |x - y|^2) between all points, with gamma
+	sklearn's "auto" (1 / n_features), computed in blocks of rows and
+	written to a .npy memmap if filename is given
+	'''
+	from sklearn.metrics.pairwise import rbf_kernel
+
+	N = len(embedding)
+	gamma = 1. / embedding.shape[1]
+	if filename is None:
+		K = np.empty((N, N))
+	else:
+		K = np.lib.format.open_memmap(filename, mode="w+", 
+			dtype=np.float64, shape=(N, N))
+	block_size = max(1, DISTANCE_BLOCK_ELEMENTS // N)
+	for start in range(0, N, block_size):
+		nodes = np.arange(start, min(start + block_size, N))
+		K[nodes] = rbf_kernel(embedding[nodes], embedding, gamma=gamma)
+	return K
+
+_nc_features = None
+
+def _initialise_nc_worker(features):
+	global _nc_features
+	if isinstance(features, str):
+		features = np.load(features, mmap_mode="r")
+	_nc_features = features
+
+def _fit_and_evaluate(task):
+	'''
+	fit an SVC on the training nodes with a precomputed kernel. for the
+	rbf kernel the features are the kernel matrix, gamma is sklearn's
+	"auto" and does not depend on the split. for the hyperbolic kernel
+	they are squared distances and the kernel exp(-gamma d^2), with gamma
+	2 / mean(d^2) of the training nodes, is built for every fit
+	'''
+	(split_train, split_test, labels_train, labels_test, 
+		kernel, probability) = task
+	start_time = time.time()
+
+	if kernel == "hyperbolic":
+		D_train = np.asarray(_nc_features[np.ix_(split_train, split_train)])
+		gamma = 2. / D_train.mean()
+		X_train = np.exp(-gamma * D_train)
+		del D_train
+		X_test = np.exp(-gamma * np.asarray(
+			_nc_features[np.ix_(split_test, split_train)]))
+	else:
+		X_train = np.asarray(_nc_features[np.ix_(split_train, split_train)])
+		X_test = np.asarray(_nc_features[np.ix_(split_test, split_train)])
+	model = SVC(kernel="precomputed", probability=probability)
+	if len(labels_train.shape) > 1:
+		model = OneVsRestClassifier(model)
+	model.fit(X_train, labels_train)
+
+	if probability:
+		measures = compute_measures(labels_test, 
+			model.predict_proba(X_test))
+	else:
+		predictions = model.predict(X_test)
+		measures = (f1_score(labels_test, predictions, average="micro"),
+			f1_score(labels_test, predictions, average="macro"))
+	return measures, time.time() - start_time
+
+def run_tasks(tasks, features, processes=1):
+	'''
+	results of _fit_and_evaluate for every task, in order. features is the
+	rbf kernel matrix, the matrix of squared distances or the filename of
+	its .npy
+	'''
+	if processes > 1:
+		from multiprocessing import Pool
+		pool = Pool(processes, initializer=_initialise_nc_worker,
+			initargs=(features, ))
+		try:
+			results = list(pool.imap(_fit_and_evaluate, tasks))
+		finally:
+			pool.close()
+			pool.join()
+	else:
+		_initialise_nc_worker(features)
+		results = [_fit_and_evaluate(task) for task in tasks]
+	for _, fit_time in results:
+		profiling.record("nc_fit", fit_time, items=1)
+	return [measures for measures, _ in results]
+
+def save_atomic(filename, array):
+	tmp_filename = "{}.{}.tmp".format(filename, os.getpid())
+	with open(tmp_filename, "wb") as f:
+		np.save(f, array)
+	os.replace(tmp_filename, filename)
+
+def labels_hash(labels):
+	'''
+	hash of the dtype, shape and values of labels
+	'''
+	labels = np.ascontiguousarray(labels)
+	h = hashlib.sha1(str((labels.dtype.str, labels.shape)).encode())
+	h.update(labels.tobytes())
+	return h.hexdigest()[:16]
+
+class SplitCache(object):
+	'''
+	train and test indices of splits of labels, stored as .npy files in
+	directory/<labels hash> and memory mapped. splits are only computed
+	by the first job to need them, other jobs wait for the lock
+	'''
+
+	def __init__(self, directory, labels):
+		self.directory = os.path.join(directory, labels_hash(labels))
+		os.makedirs(self.directory, exist_ok=True)
+		self.lock_filename = os.path.join(self.directory, "splits.lock")
+
+	def load(self, name):
+		prefix = os.path.join(self.directory, name)
+		# written last, so the splits are complete if it exists
+		count_filename = prefix + "_count.npy"
+		if not os.path.exists(count_filename):
+			return None
+		return [(np.load("{}_{}_train.npy".format(prefix, i), mmap_mode="r"),
+			np.load("{}_{}_test.npy".format(prefix, i), mmap_mode="r"))
+			for i in range(int(np.load(count_filename)))]
+
+	def save(self, name, splits):
+		prefix = os.path.join(self.directory, name)
+		for i, (split_train, split_test) in enumerate(splits):
+			save_atomic("{}_{}_train.npy".format(prefix, i), split_train)
+			save_atomic("{}_{}_test.npy".format(prefix, i), split_test)
+		save_atomic(prefix + "_count.npy", np.array(len(splits)))
+
+	def splits(self, name, make_splits):
+		'''
+		list of (train, test) of the splits called name, make_splits()
+		computes them if they are not in the cache
+		'''
+		splits = self.load(name)
+		if splits is not None:
+			return splits
+		with open(self.lock_filename, "a") as f:
+			fcntl.lockf(f, fcntl.LOCK_EX)
+			try:
+				# another job may have saved them while we waited
+				splits = self.load(name)
+				if splits is None:
+					print ("computing splits", name)
+					self.save(name, list(make_splits()))
+					splits = self.load(name)
+			finally:
+				fcntl.lockf(f, fcntl.LOCK_UN)
+		return splits
+
+def get_splits(split_cache, name, make_splits):
+	if split_cache is None:
+		return list(make_splits())
+	return split_cache.splits(name, make_splits)
+
 def evaluate_kfold_label_classification(
 	embedding, 
 	labels, 
-	k=10):
+	k=10,
+	precomputed=None,
+	kernel="rbf",
+	processes=1,
+	split_cache=None):
+	'''
+	precomputed is the rbf kernel matrix or the squared distances of the
+	hyperbolic kernel, or the filename of its .npy. the rbf kernel is
+	computed here if it is not given
+	'''
 	assert len(labels.shape) == 2
-	
-	# model = LogisticRegressionCV(
-	# 	max_iter=1000, 
-	# 	n_jobs=-1)
-	model = SVC(probability=True)
+	assert kernel == "rbf" or precomputed is not None, \
+		"the hyperbolic kernel needs squared distances"
+	if precomputed is None:
+		precomputed = rbf_kernel_matrix(embedding)
 
 	if labels.shape[1] == 1:
 		print ("single label clasification")
 		labels = labels.flatten()
+		name = "stratified_kfold_k={}".format(k)
 		sss = StratifiedKFold(n_splits=k, 
 			shuffle=True, 
 			random_state=0)
 
 	else:
 		print ("multi-label classification")
+		name = "iterative_kfold_k={}".format(k)
 		sss = IterativeStratification(n_splits=k, 
 			order=1)
-		model = OneVsRestClassifier(model, )
-			
-	k_fold_rocs = np.zeros(k)
-	k_fold_f1s = np.zeros(k)
-	k_fold_precisions = np.zeros(k)
-	k_fold_recalls = np.zeros(k)
-
-	for i, (split_train, split_test) in enumerate(\
-		sss.split(embedding, labels, )):
-		print ("Fold", i+1, "fitting model")
-		model.fit(embedding[split_train], labels[split_train])	
-		probs = model.predict_proba(embedding[split_test])
-
-		(k_fold_rocs[i], 
-			k_fold_f1s[i], 
-			k_fold_precisions[i], 
-			k_fold_recalls[i]) = compute_measures(
-				labels[split_test],
-				probs,)
-
-		print ("Completed {}/{} folds".format(i+1, k))
+
+	splits = get_splits(split_cache, name, 
+		lambda: sss.split(embedding, labels, ))
+
+	# probabilities are needed for the roc
+	tasks = [(split_train, split_test, labels[split_train], 
+		labels[split_test], kernel, True)
+		for split_train, split_test in splits]
+	print ("fitting {} folds".format(len(tasks)))
+
+	measures = np.array(run_tasks(tasks, precomputed, 
+		processes=processes))
+	k_fold_rocs, k_fold_f1s, k_fold_precisions, k_fold_recalls = measures.T
 
 	return (np.mean(k_fold_rocs), np.mean(k_fold_f1s),
 		np.mean(k_fold_precisions), np.mean(k_fold_recalls))
@@ -98,69 +283,64 @@ def evaluate_node_classification(
 	embedding, 
 	labels,
 	label_percentages=np.arange(0.02, 0.11, 0.01), 
-	n_repeats=10):
+	n_repeats=10,
+	precomputed=None,
+	kernel="rbf",
+	processes=1,
+	split_cache=None):
+	'''
+	precomputed is as in evaluate_kfold_label_classification
+	'''
 
 	print ("Evaluating node classification")
+	assert kernel == "rbf" or precomputed is not None, \
+		"the hyperbolic kernel needs squared distances"
+	if precomputed is None:
+		precomputed = rbf_kernel_matrix(embedding)
 
-	f1_micros = np.zeros((n_repeats, len(label_percentages)))
-	f1_macros = np.zeros((n_repeats, len(label_percentages)))
-	
-	# model = LogisticRegressionCV(max_iter=1000,
-	# 	n_jobs=-1)
-	model = SVC(probability=True)
-
+	tasks = []
 	if labels.shape[1] == 1:
 		print ("single label clasification")
 		labels = labels.flatten()
 
 		split = StratifiedShuffleSplit
 		for seed in range(n_repeats):
-		
-			for i, label_percentage in enumerate(label_percentages):
-				print ("processing label percentage", i, 
-					":", "{:.02f}".format(label_percentage))
+			for label_percentage in label_percentages:
 				sss = split(n_splits=1, 
 					test_size=1-label_percentage, 
 					random_state=seed)
-				split_train, split_test = next(sss.split(embedding, 
-					labels))
-				
-				model.fit(embedding[split_train], labels[split_train])
-				predictions = model.predict(embedding[split_test])
-
-				f1_micro = f1_score(labels[split_test], predictions, 
-					average="micro")
-				f1_macro = f1_score(labels[split_test], predictions, 
-					average="macro")
-				print ("{:.02f}".format(label_percentage), 
-					f1_micro, f1_macro)
-
-				f1_micros[seed, i] = f1_micro
-				f1_macros[seed, i] = f1_macro
-			print ("completed repeat {}".format(seed+1))
+				name = "stratified_shuffle_{:.2f}_seed={:03d}".format(
+					label_percentage, seed)
+				tasks.extend(get_splits(split_cache, name,
+					lambda: sss.split(embedding, labels)))
 
 	else: # multilabel classification
 		print ("multilabel classification")
-		model = OneVsRestClassifier(model)
 		split = IterativeStratification
 
 		for seed in range(n_repeats):
-		
-			for i, label_percentage in enumerate(label_percentages):
-				print ("processing label percentage", i, 
-					":", "{:.02f}".format(label_percentage))
+			for label_percentage in label_percentages:
 				sss = split(n_splits=2, order=1, #random_state=seed,
 					sample_distribution_per_fold=[1.0-label_percentage, label_percentage])
-				split_train, split_test = next(sss.split(embedding, labels))
-				model.fit(embedding[split_train], labels[split_train])
-				predictions = model.predict(embedding[split_test])
-				f1_micro = f1_score(labels[split_test], predictions, 
-					average="micro")
-				f1_macro = f1_score(labels[split_test], predictions, 
-					average="macro")
-				f1_micros[seed,i] = f1_micro
-				f1_macros[seed,i] = f1_macro
-			print ("completed repeat {}".format(seed+1))
+				name = "iterative_{:.2f}_seed={:03d}".format(
+					label_percentage, seed)
+				tasks.extend(get_splits(split_cache, name,
+					lambda: [next(sss.split(embedding, labels))]))
+
+	# only predictions are needed for the f1 scores
+	tasks = [(split_train, split_test, labels[split_train], 
+		labels[split_test], kernel, False) 
+		for split_train, split_test in tasks]
+	print ("fitting {} repeats of {} label percentages".format(
+		n_repeats, len(label_percentages)))
+
+	measures = np.array(run_tasks(tasks, precomputed, 
+		processes=processes)).reshape(n_repeats, len(label_percentages), 2)
+	f1_micros = measures[..., 0]
+	f1_macros = measures[..., 1]
+	for label_percentage, f1_micro, f1_macro in zip(label_percentages, 
+		f1_micros.mean(axis=0), f1_macros.mean(axis=0)):
+		print ("{:.02f}".format(label_percentage), f1_micro, f1_macro)
 
 	return label_percentages, f1_micros.mean(axis=0), f1_macros.mean(axis=0)
 
@@ -177,56 +357,49 @@ def parse_args():
 
 	parser.add_argument('--directed', action="store_true", help='flag to train on directed graph')
 
-	parser.add_argument("--embedding", dest="embedding_directory",  
-		help="path of embedding to load.")
+	parser.add_argument("--embedding", dest="embedding_directory", nargs="+", 
+		help="directories (or glob patterns) of embeddings to load.")
+	parser.add_argument("--all-checkpoints", dest="all_checkpoints", action="store_true",
+		help="flag to evaluate every checkpoint in the embedding directories instead of the latest.")
 
 	parser.add_argument("--test-results-dir", dest="test_results_dir",  
-		help="path to save results.")
+		help="path to save results, formatted with the key=value components of each embedding path, for example dim={dim:03d}.")
+	parser.add_argument("--skip-existing", dest="skip_existing", action="store_true",
+		help="flag to skip embeddings whose results have already been saved.")
+	parser.add_argument("--results-db", dest="results_db", default=None,
+		help="SQLite database to add results to instead of writing a pickle for each embedding.")
 
 	parser.add_argument("--seed", type=int, default=0)
 
 	parser.add_argument("--dist_fn", dest="dist_fn", type=str,
 	choices=["poincare", "hyperboloid", "euclidean"])
 
-	return parser.parse_args()
-
-def main():
-
-	args = parse_args()
-
-	test_results_dir = args.test_results_dir
-	if not os.path.exists(test_results_dir):
-		os.makedirs(test_results_dir, exist_ok=True)
-	
-	test_results_filename = os.path.join(test_results_dir, 
-		"{}.pkl".format(args.seed))
-
-	# if check_complete(test_results_filename, args.seed):
-	# 	return
+	parser.add_argument("--kernel", dest="kernel", type=str, default="rbf",
+		choices=["rbf", "hyperbolic"],
+		help="SVC kernel, rbf on the klein coordinates or exp(-gamma d^2) of the hyperbolic distance d. "
+		"Both are precomputed once per embedding, the rbf kernel from all N^2 pairs and the hyperbolic one "
+		"from all N^2 squared distances, from which every fit builds the kernel of its training nodes (default is rbf).")
+	parser.add_argument("--processes", dest="processes", type=int, default=1,
+		help="number of processes to fit classifiers in (default is 1).")
+	parser.add_argument("--workers", dest="workers", type=int, default=1,
+		help="number of embeddings evaluated at once, each in its own process (default is 1).")
+	parser.add_argument("--profile", dest="profile_path", default=None,
+		help="path of a JSON lines file to write stage timings to.")
+	parser.add_argument("--split-cache", dest="split_cache", default=None,
+		help="directory to store train and test splits of the labels in, to be reused by every embedding evaluated against them.")
 
-	# test_results_lock_filename = os.path.join(test_results_dir, 
-	# 	"test_results.lock")
-	# touch(test_results_lock_filename)
+	return parser.parse_args()
 
-	_, _, node_labels = load_data(args)
-	print ("Loaded dataset")
+def evaluate_embedding(args, mask, node_labels, split_cache, processes,
+	temporary_directory, embedding, fields):
 
-	embedding = load_embedding(args.dist_fn, args.embedding_directory)
+	embedding = embedding[mask]
 
-	min_count = 10
-	if node_labels.shape[1] == 1: # remove any node belonging to an under-represented class
-		label_counts = Counter(node_labels.flatten())
-		mask = np.array([label_counts[l] >= min_count
-			for l in node_labels.flatten()])
-		embedding = embedding[mask]
-		node_labels = node_labels[mask]
-	else:
-		assert node_labels.shape[1] > 1
-		idx = node_labels.sum(0) >= min_count
-		node_labels = node_labels[:, idx]
-		idx = node_labels.any(-1)
-		embedding = embedding[idx]
-		node_labels = node_labels[idx]
+	if args.kernel == "hyperbolic":
+		assert args.dist_fn in ("hyperboloid", "poincare"), \
+			"the hyperbolic kernel needs a hyperbolic embedding"
+		hyperboloid_embedding = embedding if args.dist_fn == "hyperboloid" \
+			else poincare_ball_to_hyperboloid(embedding)
 
 	if args.dist_fn == "hyperboloid":
 		print ("loaded a hyperboloid embedding")
@@ -245,21 +418,48 @@ def main():
 		print ("projecting from poincare to klein")
 		embedding = poincare_ball_to_klein(embedding)
 
-	test_results = {}
-	
-	label_percentages, f1_micros, f1_macros = \
-		evaluate_node_classification(embedding, node_labels)
-
-	for label_percentage, f1_micro, f1_macro in zip(label_percentages, f1_micros, f1_macros):
-		print ("{:.2f}".format(label_percentage), 
-			"micro = {:.2f}".format(f1_micro), 
-			"macro = {:.2f}".format(f1_macro) )
-		test_results.update({"{:.2f}_micro".format(label_percentage): f1_micro})
-		test_results.update({"{:.2f}_macro".format(label_percentage): f1_macro})
-
-	k = 10
-	k_fold_roc, k_fold_f1, k_fold_precision, k_fold_recall = \
-		evaluate_kfold_label_classification(embedding, node_labels, k=k)
+	# the rbf kernel or the squared distances of the hyperbolic kernel are
+	# computed once and shared by every fit, workers memory map them
+	temporary_directory = tempfile.mkdtemp(dir=temporary_directory)
+	try:
+		precomputed_filename = os.path.join(temporary_directory, 
+			"precomputed.npy") if processes > 1 else None
+		if args.kernel == "hyperbolic":
+			with profiling.stage("nc_squared_distances", items=len(embedding)):
+				precomputed = squared_distances(hyperboloid_embedding, 
+					filename=precomputed_filename)
+		else:
+			with profiling.stage("nc_rbf_kernel", items=len(embedding)):
+				precomputed = rbf_kernel_matrix(embedding, 
+					filename=precomputed_filename)
+		if precomputed_filename is not None:
+			del precomputed
+			precomputed = precomputed_filename
+
+		test_results = {}
+		
+		with profiling.stage("nc_label_percentages"):
+			label_percentages, f1_micros, f1_macros = \
+				evaluate_node_classification(embedding, node_labels, 
+					precomputed=precomputed, kernel=args.kernel, 
+					processes=processes, split_cache=split_cache)
+
+		for label_percentage, f1_micro, f1_macro in zip(label_percentages, f1_micros, f1_macros):
+			print ("{:.2f}".format(label_percentage), 
+				"micro = {:.2f}".format(f1_micro), 
+				"macro = {:.2f}".format(f1_macro) )
+			test_results.update({"{:.2f}_micro".format(label_percentage): f1_micro})
+			test_results.update({"{:.2f}_macro".format(label_percentage): f1_macro})
+
+		k = 10
+		with profiling.stage("nc_kfold"):
+			k_fold_roc, k_fold_f1, k_fold_precision, k_fold_recall = \
+				evaluate_kfold_label_classification(embedding, node_labels, k=k,
+					precomputed=precomputed, kernel=args.kernel, 
+					processes=processes, split_cache=split_cache)
+
+	finally:
+		shutil.rmtree(temporary_directory)
 
 	test_results.update({
 		"{}-fold-roc".format(k): k_fold_roc, 
@@ -268,15 +468,79 @@ def main():
 		"{}-fold-recall".format(k): k_fold_recall,
 		})
 
-	print ("saving test results to {}".format(test_results_filename))
-	
-	test_results = pd.Series(test_results)
-	with open(test_results_filename, "wb") as f:
-		pkl.dump(test_results, f, pkl.HIGHEST_PROTOCOL)
+	return test_results
+
+def main():
+
+	args = parse_args()
+
+	# the timings are always summarised, and written if --profile is given
+	profiling.enable_profiling(args.profile_path)
+
+	results_store = ResultsStore(args.results_db) \
+		if args.results_db is not None else None
+
+	jobs = embedding_jobs(args.embedding_directory, 
+		args.dist_fn, 
+		args.test_results_dir, 
+		seed=args.seed,
+		all_checkpoints=args.all_checkpoints,
+		skip_existing=args.skip_existing,
+		results_store=results_store)
+	if len(jobs) == 0:
+		return
+
+	_, _, node_labels = load_data(args)
+	print ("Loaded dataset")
+
+	min_count = 10
+	if node_labels.shape[1] == 1: # remove any node belonging to an under-represented class
+		label_counts = Counter(node_labels.flatten())
+		mask = np.array([label_counts[l] >= min_count
+			for l in node_labels.flatten()])
+		node_labels = node_labels[mask]
+	else:
+		assert node_labels.shape[1] > 1
+		idx = node_labels.sum(0) >= min_count
+		node_labels = node_labels[:, idx]
+		mask = node_labels.any(-1)
+		node_labels = node_labels[mask]
+
+	# kernels (and splits without --split-cache) are written next to
+	# the results while they are needed
+	results_directory = os.path.dirname(jobs[0]["test_results_filename"])
+	os.makedirs(results_directory, exist_ok=True)
+	temporary_directory = tempfile.mkdtemp(dir=results_directory)
+	try:
+		# splits are shared by every embedding, through a temporary cache
+		# if none is given
+		split_cache = SplitCache(args.split_cache or temporary_directory, 
+			node_labels) if args.split_cache is not None or len(jobs) > 1 \
+			else None
+
+		# worker processes cannot start their own pools
+		processes = args.processes if args.workers == 1 else 1
+
+		failed = evaluate_embeddings(functools.partial(evaluate_embedding, 
+				args, mask, node_labels, split_cache, processes, 
+				temporary_directory), 
+			jobs, 
+			workers=args.workers,
+			results_store=results_store)
+	finally:
+		shutil.rmtree(temporary_directory)
+
+	profiling.get_profiler().write_summary()
+
+	if results_store is not None:
+		results_store.close()
+
+	if len(failed) > 0:
+		raise Exception("could not evaluate {} embeddings: {}".format(
+			len(failed), ", ".join(job["embedding_directory"] 
+				for job, _ in failed)))
 
 	print ("done")
-	
-	# threadsafe_save_test_results(test_results_lock_filename, test_results_filename, args.seed, data=test_results )
-	
+
 if __name__ == "__main__":
-	main()
\ No newline at end of file
+	main()
@@ -1,16 +1,14 @@
-import os
-
 import random
 import numpy as np
 import networkx as nx
-import pandas as pd
 
 import argparse
-
-import pickle as pkl
+import functools
 
 from heat.utils import load_data
-from evaluation_utils import check_complete, load_embedding, compute_scores, evaluate_rank_AUROC_AP, evaluate_mean_average_precision, touch, threadsafe_save_test_results
+from heat.results_store import ResultsStore
+from evaluation_utils import compute_scores, evaluate_rank_AUROC_AP, evaluate_rank_AUROC_AP_streaming, evaluate_mean_average_precision
+from evaluation_utils import embedding_jobs, group_jobs, evaluate_embeddings
 from remove_utils import sample_non_edges
 
 def parse_args():
@@ -26,11 +24,17 @@ def parse_args():
 
 	parser.add_argument('--directed', action="store_true", help='flag to train on directed graph')
 
-	parser.add_argument("--embedding", dest="embedding_directory",  
-		help="directory of embedding to load.")
+	parser.add_argument("--embedding", dest="embedding_directory", nargs="+", 
+		help="directories (or glob patterns) of embeddings to load.")
+	parser.add_argument("--all-checkpoints", dest="all_checkpoints", action="store_true",
+		help="flag to evaluate every checkpoint in the embedding directories instead of the latest.")
 
 	parser.add_argument("--test-results-dir", dest="test_results_dir",  
-		help="path to save results.")
+		help="path to save results, formatted with the key=value components of each embedding path, for example dim={dim:03d}.")
+	parser.add_argument("--skip-existing", dest="skip_existing", action="store_true",
+		help="flag to skip embeddings whose results have already been saved.")
+	parser.add_argument("--results-db", dest="results_db", default=None,
+		help="SQLite database to add results to instead of writing a pickle for each embedding.")
 
 	parser.add_argument("--seed", type=int, default=0)
 	
@@ -38,25 +42,83 @@ def parse_args():
 		choices=["poincare", "hyperboloid", "euclidean", 
 			"kle", "klh", "st"])
 
+	parser.add_argument("--processes", dest="processes", type=int, default=1,
+		help="number of processes used to compute mean average precision (default is 1).")
+	parser.add_argument("--workers", dest="workers", type=int, default=1,
+		help="number of embeddings evaluated at once, each in its own process (default is 1).")
+	parser.add_argument("--exact-map", dest="exact_map", action="store_true",
+		help="flag to rank every node against all other nodes instead of 1000 sampled non neighbours.")
+	parser.add_argument("--streaming", dest="streaming", type=str,
+		choices=["exact", "histogram"],
+		help="score test edges in chunks and compute exact metrics by merging sorted runs on disk, or approximate them with score histograms.")
+	parser.add_argument("--chunk-size", dest="chunk_size", type=int, default=2 ** 20,
+		help="number of pairs scored at once with --streaming (default is 2^20).")
+
 	return parser.parse_args()
 
+def evaluate_reconstruction(args, test_edges, test_non_edges, processes,
+	embedding, fields):
+
+	random.seed(fields["seed"])
+
+	test_results = dict()
+
+	if args.streaming is None:
+		(mean_rank_recon, ap_recon, 
+			roc_recon) = evaluate_rank_AUROC_AP(
+				embedding,
+				test_edges, 
+				test_non_edges,
+				args.dist_fn)
+	else:
+		(mean_rank_recon, ap_recon, 
+			roc_recon), errors = evaluate_rank_AUROC_AP_streaming(
+				embedding,
+				test_edges, 
+				test_non_edges,
+				args.dist_fn,
+				method=args.streaming,
+				chunk_size=args.chunk_size)
+		if args.streaming == "histogram":
+			test_results.update({"max_error_" + name: error 
+				for name, error in zip(("mean_rank_recon", "ap_recon", "roc_recon"), 
+				errors)})
+
+	test_results.update({"mean_rank_recon": mean_rank_recon, 
+		"ap_recon": ap_recon,
+		"roc_recon": roc_recon})
+
+	map_recon, precisions_at_k = evaluate_mean_average_precision(
+		embedding, 
+		test_edges,
+		args.dist_fn,
+		max_non_neighbours=None if args.exact_map else 1000,
+		processes=processes)
+	test_results.update({"map_recon": map_recon})
+
+	for k, pk in precisions_at_k.items():
+		print ("precision at", k, pk)
+	test_results.update({"p@{}".format(k): pk
+		for k, pk in precisions_at_k.items()})
+
+	return test_results
+
 def main():
 
 	args = parse_args()
 
-	test_results_dir = args.test_results_dir
-	if not os.path.exists(test_results_dir):
-		os.makedirs(test_results_dir, exist_ok=True)
-	
-	test_results_filename = os.path.join(test_results_dir, 
-		"{}.pkl".format(args.seed))
-
-	# if check_complete(test_results_filename, args.seed):
-	# 	return
+	results_store = ResultsStore(args.results_db) \
+		if args.results_db is not None else None
 
-	# test_results_lock_filename = os.path.join(test_results_dir, 
-	# 	"test_results.lock")
-	# touch(test_results_lock_filename)
+	jobs = embedding_jobs(args.embedding_directory, 
+		args.dist_fn, 
+		args.test_results_dir, 
+		seed=args.seed,
+		all_checkpoints=args.all_checkpoints,
+		skip_existing=args.skip_existing,
+		results_store=results_store)
+	if len(jobs) == 0:
+		return
 
 	graph, _, _ = load_data(args)
 	assert not args.directed 
@@ -64,65 +126,47 @@ def main():
 	print ("Loaded dataset")
 	print ()
 
-	random.seed(args.seed)
-	
 	test_edges = list(graph.edges())
 
 	test_edges += [(v, u) for u, v in test_edges]
 
 	num_edges = len(test_edges)
 
-	test_non_edges = sample_non_edges(graph, 
-		set(test_edges),
-		num_edges)
-
 	test_edges = np.array(test_edges)
-	test_non_edges = np.array(test_non_edges)
-
 
 	print ("number of test edges:", len(test_edges))
-	print ("number of test non edges:", len(test_non_edges))
 
+	# worker processes cannot start their own pools
+	processes = args.processes if args.workers == 1 else 1
 
-	embedding = load_embedding(args.dist_fn, 
-		args.embedding_directory)
-	
-	test_results = dict()
+	failed = []
+	# non edges are sampled once for each seed
+	for seed, group in group_jobs(jobs, lambda fields: fields["seed"]):
 
-	(mean_rank_recon, ap_recon, 
-		roc_recon) = evaluate_rank_AUROC_AP(
-			embedding,
-			test_edges, 
-			test_non_edges,
-			args.dist_fn)
+		test_non_edges = sample_non_edges(graph, 
+			test_edges,
+			num_edges,
+			seed=seed)
 
-	test_results.update({"mean_rank_recon": mean_rank_recon, 
-		"ap_recon": ap_recon,
-		"roc_recon": roc_recon})
-
-	map_recon, precisions_at_k = evaluate_mean_average_precision(
-		embedding, 
-		test_edges,
-		args.dist_fn)
-	test_results.update({"map_recon": map_recon})
-
-	for k, pk in precisions_at_k.items():
-		print ("precision at", k, pk)
-	test_results.update({"p@{}".format(k): pk
-		for k, pk in precisions_at_k.items()})
+		print ("number of test non edges:", len(test_non_edges))
 
-	print ("saving test results to {}".format(
-		test_results_filename))
+		failed += evaluate_embeddings(functools.partial(
+				evaluate_reconstruction, args, test_edges, 
+				test_non_edges, processes), 
+			group, 
+			workers=args.workers,
+			results_store=results_store)
 
-	test_results = pd.Series(test_results)
-	with open(test_results_filename, "wb") as f:
-		pkl.dump(test_results, f, pkl.HIGHEST_PROTOCOL)
+	if results_store is not None:
+		results_store.close()
 
-	# threadsafe_save_test_results(test_results_lock_filename, 
-	# 	test_results_filename, args.seed, data=test_results )
+	if len(failed) > 0:
+		raise Exception("could not evaluate {} embeddings: {}".format(
+			len(failed), ", ".join(job["embedding_directory"] 
+				for job, _ in failed)))
 
 	print ("done")
 
 
 if __name__ == "__main__":
-	main()
\ No newline at end of file
+	main()
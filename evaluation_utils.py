@@ -4,64 +4,41 @@ import numpy as np
 import pandas as pd
 
 import glob
+import pickle as pkl
 
-from sklearn.metrics import average_precision_score, roc_auc_score, roc_curve
+from collections import Counter
+
+from sklearn.metrics import average_precision_score, roc_auc_score
 
 import functools
 import fcntl
 
+from heat.checkpoint import latest_checkpoint, load_checkpoint
+from heat.geometry import (logarithmic_map,
+	parallel_transport, hyperboloid_distance as hyperbolic_distance_hyperboloid,
+	poincare_distance as hyperbolic_distance_poincare,
+	pairwise_hyperboloid_distance, pairwise_poincare_distance)
+from heat.nn_index import METRICS, NeighbourIndex, load_neighbour_index
+from heat.results_store import results_key
+
 import random
+import platform
+
+# the sampled mean average precision relies on the iteration order of
+# CPython sets of small ints, see evaluate_mean_average_precision
+SORTED_INT_SETS = platform.python_implementation() == "CPython"
 
 def euclidean_distance(u, v):
 	assert len(u.shape) == len(v.shape) 
 	return np.linalg.norm(u - v, axis=-1)
 
-def minkowski_dot(x, y):
-	assert len(x.shape) == len(y.shape) 
-	return np.sum(x[...,:-1] * y[...,:-1], 
-		axis=-1, keepdims=True) - x[...,-1:] * y[...,-1:]
-
-def hyperbolic_distance_hyperboloid(u, v):
-	assert len(u.shape) == len(v.shape)
-	mink_dp = -minkowski_dot(u, v)
-	mink_dp = np.maximum(mink_dp, 1 + 1e-15)
-	return np.squeeze(np.arccosh(mink_dp), axis=-1)
-
-def hyperbolic_distance_poincare(u, v):
-	assert len(u.shape) == len(v.shape)
-	norm_u = np.linalg.norm(u, keepdims=False, axis=-1)
-	norm_u = np.minimum(norm_u, np.nextafter(1,0, ))
-	norm_v = np.linalg.norm(v, keepdims=False, axis=-1)
-	norm_v = np.minimum(norm_v, np.nextafter(1,0, ))
-	uu = np.linalg.norm(u - v, keepdims=False, axis=-1, ) ** 2
-	dd = (1 - norm_u**2) * (1 - norm_v**2)
-	return np.arccosh(1 + 2 * uu / dd)
-
-def logarithmic_map(p, x):
-
-	alpha = -minkowski_dot(p, x)
-
-	alpha = np.maximum(alpha, 1+1e-15)
-
-	return np.arccosh(alpha) * (x - alpha * p) / \
-		np.sqrt(alpha ** 2 - 1) 
-		
-
-def parallel_transport(p, q, x):
-
-	assert len(p.shape) == len(q.shape) == len(x.shape)
-	alpha = -minkowski_dot(p, q)
-	return x + minkowski_dot(q - alpha * p, x) * (p + q) / \
-		(alpha + 1) 
-
-
 def kullback_leibler_divergence_euclidean(
 	source_mus,
 	source_sigmas,
 	target_mus,
 	target_sigmas):
 
-	dim = source_mus.shape[1] 
+	dim = source_mus.shape[-1]
 
 	# project to tangent space
 
@@ -88,7 +65,7 @@ def kullback_leibler_divergence_hyperboloid(source_mus,
 	target_mus,
 	target_sigmas):
 
-	dim = source_mus.shape[1] - 1
+	dim = source_mus.shape[-1] - 1
 
 	to_tangent_space = logarithmic_map(source_mus, 
 		target_mus)
@@ -131,28 +108,36 @@ def load_file(filename, header="infer", sep=","):
 	print ("embedding shape is", df.shape)
 	return df.values
 
+def embedding_filename(dist_fn, embedding_directory):
+	if dist_fn == "hyperboloid":
+		_, filename = latest_checkpoint(embedding_directory)
+	elif dist_fn == "poincare":
+		_, filename = latest_checkpoint(embedding_directory, 
+			csv_pattern="*embedding.csv.gz")
+	else:
+		assert dist_fn == "euclidean"
+		files = sorted(glob.iglob(os.path.join(embedding_directory, 
+			"*.csv.gz")))
+		filename = files[-1] if files else None
+	assert filename is not None, \
+		"no embedding found in {}".format(embedding_directory)
+	return filename
+
 def load_hyperboloid(embedding_directory):
-	files = sorted(glob.iglob(os.path.join(embedding_directory, 
-		"*_embedding.csv.gz")))
-	embedding_filename = files[-1]
-	embedding = load_file(embedding_filename)
+	embedding = load_checkpoint(embedding_filename("hyperboloid",
+		embedding_directory))
 
 	return embedding
 
 def load_poincare(embedding_directory):
-	files = sorted(glob.iglob(os.path.join(embedding_directory, 
-		"*embedding.csv.gz")))
-	embedding_filename = files[-1]
-	embedding = load_file(embedding_filename)
+	embedding = load_checkpoint(embedding_filename("poincare",
+		embedding_directory))
 
 	return embedding
 
 def load_euclidean(embedding_directory):
-	files = sorted(glob.iglob(os.path.join(embedding_directory, 
-		"*.csv.gz")))
-	embedding_filename = files[-1]
-	embedding = load_file(embedding_filename, 
-		header=None, sep=" ")
+	embedding = load_file(embedding_filename("euclidean", 
+		embedding_directory), header=None, sep=" ")
 	return embedding
 
 def load_klh(embedding_directory):
@@ -208,6 +193,32 @@ def load_embedding(dist_fn, embedding_directory):
 		source, target = load_st(embedding_directory)
 		return source, target
 
+def load_index(dist_fn, embedding_directory, leaf_size=64, rebuild=False):
+	'''
+	nearest neighbour index over the embedding in embedding_directory,
+	cached next to it and rebuilt when the embedding file changes
+	'''
+	assert dist_fn in METRICS, \
+		"no nearest neighbour index for {}".format(dist_fn)
+	filename = embedding_filename(dist_fn, embedding_directory)
+	stat = os.stat(filename)
+	source = {"source": os.path.basename(filename), 
+		"source_size": stat.st_size, 
+		"source_mtime": stat.st_mtime_ns, 
+		"leaf_size": leaf_size}
+	index_filename = os.path.join(embedding_directory, 
+		"{}_neighbour_index.npz".format(dist_fn))
+	if not rebuild and os.path.exists(index_filename):
+		index, metadata = load_neighbour_index(index_filename)
+		if metadata == {key: str(value) for key, value in source.items()}:
+			print ("loaded nearest neighbour index from", index_filename)
+			return index
+	index = NeighbourIndex(load_embedding(dist_fn, embedding_directory), 
+		dist_fn=dist_fn, leaf_size=leaf_size)
+	print ("saving nearest neighbour index to", index_filename)
+	index.save(index_filename, **source)
+	return index
+
 def compute_scores(u, v, dist_fn):
 
 	if dist_fn == "hyperboloid":
@@ -234,21 +245,261 @@ def compute_scores(u, v, dist_fn):
 	return scores
 
 
+def ranking_metrics(segments, scores, labels, num_segments, ks=()):
+	'''
+	average precision and precision at k of every segment of a
+	concatenation of rankings. segments (sorted) gives the segment of
+	every score. Tied scores are handled as by average_precision_score.
+	returns an array of average precisions and a dict of arrays of
+	precisions at k
+	'''
+	order = np.lexsort((-scores, segments))
+	segments = segments[order]
+	scores = scores[order]
+	labels = labels[order]
+
+	counts = np.bincount(segments, minlength=num_segments)
+	starts = np.cumsum(counts) - counts
+	rank = np.arange(len(scores)) - starts[segments]
+
+	true_positives = np.cumsum(labels)
+	positives_before = true_positives[starts] - labels[starts]
+	true_positives = true_positives - positives_before[segments]
+	num_positives = np.bincount(segments, weights=labels,
+		minlength=num_segments)
+
+	# precision and recall are evaluated once per distinct score
+	last = np.ones(len(scores), dtype=bool)
+	last[:-1] = (segments[1:] != segments[:-1]) | \
+		(scores[1:] != scores[:-1])
+	true_positives_at_threshold = true_positives[last]
+	segments_at_threshold = segments[last]
+	precision = true_positives_at_threshold / (rank[last] + 1.)
+	recall_gain = true_positives_at_threshold.copy()
+	recall_gain[1:] -= true_positives_at_threshold[:-1]
+	first = np.ones(len(recall_gain), dtype=bool)
+	first[1:] = segments_at_threshold[1:] != segments_at_threshold[:-1]
+	recall_gain[first] = true_positives_at_threshold[first]
+	average_precisions = np.bincount(segments_at_threshold,
+		weights=recall_gain * precision,
+		minlength=num_segments) / num_positives
+
+	pks = {k: np.bincount(segments, weights=labels * (rank < k),
+			minlength=num_segments) / np.minimum(counts, k)
+		for k in ks}
+
+	return average_precisions, pks
+
+def candidate_nodes(ranks, excluded):
+	'''
+	the nodes with the given ranks among the nodes not in excluded
+	(sorted), in increasing order of node id
+	'''
+	excluded = excluded - np.arange(len(excluded))
+	return ranks + np.searchsorted(excluded, ranks, side="right")
+
+_map_embedding = None
+
+def _initialise_map_worker(embedding):
+	global _map_embedding
+	_map_embedding = embedding
+
+def _mean_average_precision_block(task):
+	(nodes, true_neighbours, num_true, excluded, num_excluded,
+		samples, dist_fn, ks) = task
+	num_nodes = len(nodes)
+
+	true_offsets = np.cumsum(num_true) - num_true
+	excluded_offsets = np.cumsum(num_excluded) - num_excluded
+	neighbours = []
+	for i, (kind, sample) in enumerate(samples):
+		neighbours.append(true_neighbours[true_offsets[i]:
+			true_offsets[i] + num_true[i]])
+		if kind == "nodes":
+			neighbours.append(sample)
+		else:
+			neighbours.append(candidate_nodes(sample,
+				excluded[excluded_offsets[i]:
+					excluded_offsets[i] + num_excluded[i]]))
+	num_neighbours = np.array([len(n) for n in neighbours[1::2]]) + num_true
+	neighbours = np.concatenate(neighbours).astype(np.int64)
+	segments = np.repeat(np.arange(num_nodes), num_neighbours)
+	sources = nodes[segments]
+
+	scores = get_scores(_map_embedding,
+		np.stack([sources, neighbours], axis=-1), dist_fn)
+	assert len(scores.shape) == 1
+	labels = (np.arange(len(neighbours)) -
+		(np.cumsum(num_neighbours) - num_neighbours)[segments] <
+		num_true[segments]).astype(np.float64)
+
+	return ranking_metrics(segments, scores, labels, num_nodes, ks)
+
+# number of scores held per block by the exact evaluation
+EXACT_BLOCK_ELEMENTS = 2 ** 24
+
+def pairwise_scores(embedding, nodes, dist_fn):
+	'''
+	(len(nodes), N) scores of nodes against every node, as one matrix
+	product where the distance allows it
+	'''
+	if dist_fn == "hyperboloid":
+		return -pairwise_hyperboloid_distance(embedding[nodes], embedding)
+	elif dist_fn == "poincare":
+		return -pairwise_poincare_distance(embedding[nodes], embedding)
+	elif dist_fn in ("euclidean", "st"):
+		if dist_fn == "st":
+			source, target = embedding
+		else:
+			source = target = embedding
+		X = source[nodes]
+		sq_dist = np.sum(X ** 2, axis=-1, keepdims=True) + \
+			np.sum(target ** 2, axis=-1) - \
+			2 * X.dot(np.ascontiguousarray(target.T))
+		return -np.sqrt(np.maximum(sq_dist, 0, out=sq_dist), out=sq_dist)
+	else:
+		N = len(embedding[0])
+		edges = np.stack([np.repeat(nodes, N), 
+			np.tile(np.arange(N), len(nodes))], axis=-1)
+		return get_scores(embedding, edges, dist_fn).reshape(len(nodes), N)
+
+def top_k(scores, k):
+	'''
+	columns of the k highest scores of every row and the scores,
+	sorted by decreasing score
+	'''
+	top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+	top_scores = np.take_along_axis(scores, top, axis=1)
+	order = np.argsort(-top_scores, axis=1, kind="mergesort")
+	return (np.take_along_axis(top, order, axis=1),
+		np.take_along_axis(top_scores, order, axis=1))
+
+def top_k_neighbours(embedding, dist_fn, k, indices_out=None, 
+	scores_out=None, exclude_self=True, threads=1, 
+	block_size=None):
+	'''
+	exact k highest scoring nodes of every node, in blocks of rows of
+	pairwise scores. indices_out and scores_out are (N, k) arrays (or
+	memmaps) that rows are written to as blocks finish. returns
+	(indices, scores), sorted by decreasing score
+	'''
+	N = len(embedding[0]) if dist_fn in ("kle", "klh", "st") \
+		else len(embedding)
+	k = min(k, N - 1 if exclude_self else N)
+	if indices_out is None:
+		indices_out = np.empty((N, k), dtype=np.int64)
+	if scores_out is None:
+		scores_out = np.empty((N, k))
+	if block_size is None:
+		block_size = max(1, EXACT_BLOCK_ELEMENTS // N)
+
+	def top_k_block(start):
+		nodes = np.arange(start, min(start + block_size, N))
+		scores = pairwise_scores(embedding, nodes, dist_fn)
+		if exclude_self:
+			scores[np.arange(len(nodes)), nodes] = -np.inf
+		indices_out[nodes], scores_out[nodes] = top_k(scores, k)
+
+	starts = range(0, N, block_size)
+	if threads > 1:
+		# matrix products and partitions release the GIL
+		from concurrent.futures import ThreadPoolExecutor
+		with ThreadPoolExecutor(threads) as executor:
+			for _ in executor.map(top_k_block, starts):
+				pass
+	else:
+		for start in starts:
+			top_k_block(start)
+
+	return indices_out, scores_out
+
+def _exact_mean_average_precision_block(task):
+	nodes, true_neighbours, num_true, masked, num_masked, dist_fn, ks = task
+	num_nodes = len(nodes)
+
+	scores = pairwise_scores(_map_embedding, nodes, dist_fn)
+	N = scores.shape[1]
+	rows = np.repeat(np.arange(num_nodes), num_true)
+	positive_scores = scores[rows, true_neighbours]
+	scores[np.repeat(np.arange(num_nodes), num_masked), masked] = -np.inf
+	num_candidates = N - num_masked
+
+	# for every positive, the candidates and positives scoring at least
+	# as high: with the positives of a row sorted, searchsorted gives
+	# the number of positives each candidate outscores
+	ranked_above = np.empty(len(rows))
+	positives_above = np.empty(len(rows))
+	offsets = np.cumsum(num_true) - num_true
+	for i in range(num_nodes):
+		positives = slice(offsets[i], offsets[i] + num_true[i])
+		order = np.argsort(positive_scores[positives], kind="mergesort")
+		sorted_scores = positive_scores[positives][order]
+		outscored = np.bincount(np.searchsorted(sorted_scores, scores[i], 
+			side="right"), minlength=num_true[i] + 1)
+		# ties: every positive counts the positives sharing its score
+		first = np.searchsorted(sorted_scores, sorted_scores, side="left")
+		ranked_above[offsets[i] + order] = np.cumsum(
+			outscored[::-1])[::-1][first + 1]
+		positives_above[offsets[i] + order] = num_true[i] - first
+
+	average_precisions = np.bincount(rows, 
+		weights=positives_above / ranked_above,
+		minlength=num_nodes) / num_true
+
+	k_max = min(max(ks), N) if len(ks) > 0 else 0
+	pks = {}
+	if k_max > 0:
+		top_scores = -np.partition(scores, N - k_max, 
+			axis=-1)[:, N - k_max:]
+		top_scores.sort(axis=-1)
+		top_scores = -top_scores
+		for k in ks:
+			# positives win ties with the k-th highest score, as in
+			# ranking_metrics
+			threshold = top_scores[:, min(k, k_max) - 1]
+			num_above = np.sum(top_scores[:, :k] > threshold[:, None], 
+				axis=-1)
+			positives_above = np.bincount(rows, 
+				weights=positive_scores > threshold[rows],
+				minlength=num_nodes)
+			positives_tied = np.bincount(rows, 
+				weights=positive_scores == threshold[rows],
+				minlength=num_nodes)
+			pks[k] = (positives_above + np.minimum(positives_tied, 
+				k - num_above)) / np.minimum(num_candidates, k)
+
+	return average_precisions, pks
+
 def evaluate_mean_average_precision(
 	embedding, 
 	edgelist, 
 	dist_fn,
 	graph_edges=None,
 	ks=(1,3,5,10),
-	max_non_neighbours=1000
+	max_non_neighbours=1000,
+	processes=1,
+	block_size=256,
 	):
+	'''
+	rank the neighbours of every source node of edgelist against the
+	nodes that are neither neighbours in edgelist nor in graph_edges, at
+	most max_non_neighbours of them sampled with the random module.
+	Nodes are scored block_size at a time, spread over processes workers.
+	Samples are drawn in the main process as the former per node loop
+	drew them. On CPython, where the order of the sets it sampled from is
+	known, a given random.seed gives the same result.
+
+	If max_non_neighbours is None, every node is ranked against all other
+	nodes, scoring blocks of nodes against the whole embedding with one
+	matrix product. Blocks are limited to EXACT_BLOCK_ELEMENTS scores
+	'''
 
 	if isinstance(embedding, tuple):
 		N, _  = embedding[0].shape
 	else:
 		N, _  = embedding.shape
 
-	all_nodes = set(range(N))
+	all_nodes = None
 
 	edgelist_dict = {}
 	for u, v in edgelist:
@@ -256,76 +507,105 @@ def evaluate_mean_average_precision(
 			edgelist_dict.update({u: set()})
 		edgelist_dict[u].add(v)
 
+	graph_edgelist_dict = {}
 	if graph_edges:
-		graph_edgelist_dict = {}
 		for u, v in graph_edges:
 			if u not in graph_edgelist_dict:
 				graph_edgelist_dict.update({u: set()})
 			if u in edgelist_dict and v not in edgelist_dict[u]:
 				graph_edgelist_dict[u].add(v)
 
+	def make_sampled_task(nodes):
+		nonlocal all_nodes
+		true_neighbours = []
+		excluded = []
+		samples = []
+		for u in nodes:
+			neighbours = edgelist_dict[u]
+			excluded_u = neighbours | {u} | graph_edgelist_dict.get(u, set())
+			num_non_neighbours = N - len(excluded_u)
+			true_neighbours.append(list(neighbours))
+			excluded.append(sorted(excluded_u))
+
+			if num_non_neighbours <= max_non_neighbours:
+				samples.append(("ranks", np.arange(num_non_neighbours)))
+			elif SORTED_INT_SETS and N >= 8 and \
+				(N - 1) >> 2 > len(neighbours):
+				# CPython stores the ints of set(range(N)) in increasing
+				# order, and a difference with a set less than a quarter
+				# of its size copies it and removes elements, so 
+				# all_nodes - {u} - neighbours iterates in increasing 
+				# order and sampling positions is sampling nodes
+				samples.append(("ranks", np.array(random.sample(
+					range(num_non_neighbours), k=max_non_neighbours))))
+			else:
+				# set difference with a large set builds a new set, 
+				# its iteration order is not sorted
+				if all_nodes is None:
+					all_nodes = set(range(N))
+				non_neighbours = all_nodes - {u} - neighbours
+				if u in graph_edgelist_dict:
+					non_neighbours -= graph_edgelist_dict[u]
+				samples.append(("nodes", np.array(random.sample(
+					list(non_neighbours), k=max_non_neighbours))))
+
+		return (np.array(nodes, dtype=np.int64),
+			np.concatenate(true_neighbours).astype(np.int64),
+			np.array([len(n) for n in true_neighbours]),
+			np.concatenate(excluded).astype(np.int64),
+			np.array([len(e) for e in excluded]),
+			samples, dist_fn, ks)
+
+	def make_exact_task(nodes):
+		true_neighbours = [list(edgelist_dict[u]) for u in nodes]
+		masked = [sorted(({u} | graph_edgelist_dict.get(u, set())) - 
+			edgelist_dict[u]) for u in nodes]
+		return (np.array(nodes, dtype=np.int64),
+			np.concatenate(true_neighbours).astype(np.int64),
+			np.array([len(n) for n in true_neighbours]),
+			np.concatenate(masked).astype(np.int64),
+			np.array([len(m) for m in masked]),
+			dist_fn, ks)
+
+	if max_non_neighbours is None:
+		block_size = max(1, min(block_size, EXACT_BLOCK_ELEMENTS // N))
+		make_task = make_exact_task
+		evaluate_block = _exact_mean_average_precision_block
+	else:
+		make_task = make_sampled_task
+		evaluate_block = _mean_average_precision_block
+
+	sources = list(edgelist_dict)
+	tasks = (make_task(sources[start:start + block_size])
+		for start in range(0, len(sources), block_size))
+
+	if processes > 1:
+		from multiprocessing import Pool
+		pool = Pool(processes, initializer=_initialise_map_worker,
+			initargs=(embedding, ))
+		results = pool.imap(evaluate_block, tasks)
+	else:
+		pool = None
+		_initialise_map_worker(embedding)
+		results = map(evaluate_block, tasks)
+
 	precisions = []
 	pks = {k: [] for k in ks}
-	for i, u in enumerate(edgelist_dict):
-
-		true_neighbours = edgelist_dict[u]
-		non_neighbours = all_nodes - {u} - true_neighbours
-		if graph_edges and u in graph_edgelist_dict:
-			non_neighbours -= graph_edgelist_dict[u]
-		
-		true_neighbours = list(true_neighbours)
-		non_neighbours = list(non_neighbours)
-
-		if len(non_neighbours) > max_non_neighbours:
-			non_neighbours = random.sample(non_neighbours, 
-				k=max_non_neighbours,)
-
-		neighbours = true_neighbours + non_neighbours
-
-		if dist_fn in ("kle", "klh"):
-			assert isinstance(embedding, tuple)
-			means, variances = embedding
-			scores = compute_scores(
-				(means[u:u+1], variances[u:u+1]), 
-				(means[neighbours], 
-					variances[neighbours]), 
-				dist_fn)
-		elif dist_fn == "st":
-			assert isinstance(embedding, tuple)
-			source, target = embedding
-			scores = compute_scores(
-				source[u:u+1], 
-				target[neighbours],  
-				dist_fn)
-		else:
-			scores = compute_scores(
-				embedding[u:u+1], 
-				embedding[neighbours],
-				dist_fn)
-		assert len(scores.shape) == 1
-
-		labels = np.append(np.ones_like(true_neighbours),
-			np.zeros_like(non_neighbours))
-
-		s = average_precision_score(labels, scores)
-		precisions.append(s)
-
-		nodes_sorted = scores.argsort()
-
+	for i, (average_precisions, block_pks) in enumerate(results):
+		precisions.append(average_precisions)
 		for k in ks:
-			nodes_sorted_ = nodes_sorted[-k:]
-			s = np.mean([neighbours[u] in true_neighbours 
-				for u in nodes_sorted_])
-			pks[k].append(s)
+			pks[k].append(block_pks[k])
+		print ("completed", min((i + 1) * block_size, len(sources)),
+			"/", len(sources))
 
-		if i % 1000 == 0:
-			print ("completed", i, "/", len(edgelist_dict))
+	if pool is not None:
+		pool.close()
+		pool.join()
 
-
-	mAP = np.mean(precisions)
+	mAP = np.mean(np.concatenate(precisions))
 	print ("mAP", mAP)
 
-	pks = {k: (np.mean(v) if len(v) > 0 else 0)
+	pks = {k: (np.mean(np.concatenate(v)) if len(v) > 0 else 0)
 			for k, v in pks.items()}
 
 	return mAP, pks
@@ -366,6 +646,212 @@ def evaluate_rank_AUROC_AP(
 
 	return ranks, ap_score, auc_score
 
+# number of pairs scored at once by the streaming evaluation
+STREAMING_CHUNK_SIZE = 2 ** 20
+
+def score_chunks(embedding, edges, dist_fn, chunk_size=STREAMING_CHUNK_SIZE):
+	'''
+	scores of edges (an array or memmap) in chunks of chunk_size pairs
+	'''
+	for start in range(0, len(edges), chunk_size):
+		yield get_scores(embedding, 
+			np.asarray(edges[start:start + chunk_size]), dist_fn)
+
+class RankingAccumulator(object):
+	'''
+	mean rank, AP and AUROC from groups of tied scores fed in decreasing
+	order of score, as counts of positives and negatives per group. Ties
+	are treated as in sklearn
+	'''
+
+	def __init__(self):
+		self.num_positives = 0
+		self.num_negatives = 0
+		self.precision_sum = 0.
+		# number of negatives scored above a positive, ties count half
+		self.misordered_pairs = 0.
+		self.rank_sum = 0.
+
+	def add(self, positives, negatives):
+		positives = positives.astype(np.float64)
+		negatives = negatives.astype(np.float64)
+		true_positives = self.num_positives + np.cumsum(positives)
+		false_positives = self.num_negatives + np.cumsum(negatives)
+		has_positives = positives > 0
+		self.precision_sum += np.sum(positives[has_positives] *
+			true_positives[has_positives] / (true_positives[has_positives] + 
+			false_positives[has_positives]))
+		negatives_above = false_positives - negatives
+		self.misordered_pairs += np.sum(positives * 
+			(negatives_above + 0.5 * negatives))
+		self.rank_sum += np.sum(positives * negatives_above)
+		self.num_positives = true_positives[-1]
+		self.num_negatives = false_positives[-1]
+
+	def metrics(self):
+		'''
+		returns (mean_rank, ap, auroc)
+		'''
+		return (1 + self.rank_sum / self.num_positives,
+			self.precision_sum / self.num_positives,
+			1 - self.misordered_pairs / 
+				(self.num_positives * self.num_negatives))
+
+def merge_sorted_runs(keys, runs, block_size):
+	'''
+	merge sorted runs (start, end, label) of keys (a memmap) in blocks.
+	yields (keys, labels) sorted by key, every block holds all copies of
+	the keys in it
+	'''
+	cursors = [start for start, _, _ in runs]
+	while True:
+		remaining = [i for i, (_, end, _) in enumerate(runs) 
+			if cursors[i] < end]
+		if len(remaining) == 0:
+			break
+		# everything up to the smallest block end of any run is final
+		cutoff = min(keys[min(cursors[i] + block_size, runs[i][1]) - 1] 
+			for i in remaining)
+		block_keys = []
+		block_labels = []
+		for i in remaining:
+			start, end, label = runs[i]
+			stop = cursors[i] + np.searchsorted(keys[cursors[i]:end], 
+				cutoff, side="right")
+			block_keys.append(np.asarray(keys[cursors[i]:stop]))
+			block_labels.append(np.full(stop - cursors[i], label, 
+				dtype=np.int8))
+			cursors[i] = stop
+		block_keys = np.concatenate(block_keys)
+		order = np.argsort(block_keys, kind="mergesort")
+		yield block_keys[order], np.concatenate(block_labels)[order]
+
+def ordered_bins(scores, mantissa_bits):
+	'''
+	histogram bins of float64 scores that keep their order: the sign,
+	exponent and leading mantissa_bits bits of the mantissa, so every bin
+	spans a relative width of 2^-mantissa_bits
+	'''
+	bits = np.ascontiguousarray(scores, dtype=np.float64).view(np.uint64)
+	negative = bits >> np.uint64(63) == 1
+	bits = np.where(negative, ~bits, bits | np.uint64(1 << 63))
+	return (bits >> np.uint64(52 - mantissa_bits)).astype(np.int64)
+
+def harmonic_difference(x, n):
+	'''
+	sum of 1 / (x + i) for i = 1 .. n
+	'''
+	from scipy.special import digamma
+	return digamma(x + n + 1) - digamma(x + 1)
+
+def histogram_ranking_metrics(positive_counts, negative_counts):
+	'''
+	metrics from histograms of positive and negative scores in ordered
+	bins, with scores in a bin treated as ties. returns (mean_rank, ap,
+	auroc) and the largest possible absolute error of each
+	'''
+	bins = np.nonzero(positive_counts + negative_counts)[0][::-1]
+	positives = positive_counts[bins].astype(np.float64)
+	negatives = negative_counts[bins].astype(np.float64)
+	accumulator = RankingAccumulator()
+	accumulator.add(positives, negatives)
+	mean_rank, ap, auroc = accumulator.metrics()
+
+	# the order within a bin decides the pairs of a positive and a
+	# negative in the same bin, and the precision of its positives
+	P = accumulator.num_positives
+	N = accumulator.num_negatives
+	tied_pairs = np.sum(positives * negatives)
+	T = np.cumsum(positives) - positives
+	F = np.cumsum(negatives) - negatives
+	# positives first / negatives first within every bin
+	ap_high = np.sum(positives - F * 
+		harmonic_difference(T + F, positives)) / P
+	ap_low = np.sum(positives - (F + negatives) * 
+		harmonic_difference(T + F + negatives, positives)) / P
+
+	# the mean rank counts the negatives above a positive, half of those
+	# in its bin are expected to be
+	mean_rank += 0.5 * tied_pairs / P
+	errors = (0.5 * tied_pairs / P, 
+		max(ap_high - ap, ap - ap_low),
+		0.5 * tied_pairs / (P * N))
+	return (mean_rank, ap, auroc), errors
+
+def evaluate_rank_AUROC_AP_streaming(
+	embedding,
+	test_edges,
+	test_non_edges,
+	dist_fn,
+	method="exact",
+	chunk_size=STREAMING_CHUNK_SIZE,
+	temporary_directory=None,
+	mantissa_bits=8,
+	):
+	'''
+	evaluate_rank_AUROC_AP for edge sets too large to score at once.
+	edges are scored in chunks of chunk_size pairs. method "exact" writes
+	every chunk as a sorted run to a memmap in temporary_directory and
+	merges the runs; "histogram" counts scores in ordered bins of relative
+	width 2^-mantissa_bits. returns (mean_rank, ap, auroc) and the largest
+	absolute error of each (zeros for "exact")
+	'''
+	assert method in ("exact", "histogram")
+
+	if method == "histogram":
+		num_bins = 2 ** (12 + mantissa_bits)
+		counts = []
+		for edges in (test_edges, test_non_edges):
+			count = np.zeros(num_bins, dtype=np.int64)
+			for scores in score_chunks(embedding, edges, dist_fn, 
+				chunk_size=chunk_size):
+				assert len(scores.shape) == 1
+				count += np.bincount(ordered_bins(scores, mantissa_bits), 
+					minlength=num_bins)
+			counts.append(count)
+		(mean_rank, ap_score, auc_score), errors = \
+			histogram_ranking_metrics(*counts)
+
+	else:
+		import shutil
+		import tempfile
+		directory = tempfile.mkdtemp(dir=temporary_directory)
+		try:
+			# negated scores, so runs sort in decreasing order of score
+			keys = np.memmap(os.path.join(directory, "scores.dat"), 
+				dtype=np.float64, mode="w+", 
+				shape=(len(test_edges) + len(test_non_edges), ))
+			runs = []
+			for label, edges in ((1, test_edges), (0, test_non_edges)):
+				for scores in score_chunks(embedding, edges, dist_fn,
+					chunk_size=chunk_size):
+					assert len(scores.shape) == 1
+					start = runs[-1][1] if runs else 0
+					keys[start:start + len(scores)] = np.sort(-scores)
+					runs.append((start, start + len(scores), label))
+
+			accumulator = RankingAccumulator()
+			for block_keys, labels in merge_sorted_runs(keys, runs, 
+				max(1, chunk_size // len(runs))):
+				group_starts = np.flatnonzero(np.append(True, 
+					block_keys[1:] != block_keys[:-1]))
+				positives = np.add.reduceat(labels.astype(np.int64), 
+					group_starts)
+				sizes = np.diff(np.append(group_starts, len(block_keys)))
+				accumulator.add(positives, sizes - positives)
+			mean_rank, ap_score, auc_score = accumulator.metrics()
+			errors = (0., 0., 0.)
+			del keys
+		finally:
+			shutil.rmtree(directory)
+
+	print ("MEAN RANK =", mean_rank, "AP =", ap_score, 
+		"AUROC =", auc_score)
+	if method == "histogram":
+		print ("maximum errors: MEAN RANK {} AP {} AUROC {}".format(*errors))
+
+	return (mean_rank, ap_score, auc_score), errors
+
 def get_scores(embedding, edges, dist_fn):
 	if dist_fn in ("kle", "klh"):
 		means, variances = embedding
@@ -410,15 +896,13 @@ def lock_method(lock_filename):
 			# Hold program if it is already running 
 			# Snippet based on
 			# http://linux.byexamples.com/archives/494/how-can-i-avoid-running-a-python-script-multiple-times-implement-file-locking/
-			fp = open(lock_filename, 'r+')
-			done = False
-			while not done:
+			# lockf blocks until the lock is released, without polling
+			with open(lock_filename, 'a') as fp:
+				fcntl.lockf(fp, fcntl.LOCK_EX)
 				try:
-					fcntl.lockf(fp, fcntl.LOCK_EX | fcntl.LOCK_NB)
-					done = True
-				except IOError:
-					pass
-			return func(*args, **kwargs)
+					return func(*args, **kwargs)
+				finally:
+					fcntl.lockf(fp, fcntl.LOCK_UN)
 
 		return lock_and_run_method
 
@@ -446,4 +930,149 @@ def check_complete(test_results_filename, seed):
 			print (test_results_filename, ": seed=", seed, "complete --terminating")
 			return True 
 	return False
-	
\ No newline at end of file
+	
+def path_fields(path):
+	'''
+	key=value components of path as a dict, integer values as ints
+	'''
+	fields = {}
+	for component in os.path.normpath(path).split(os.sep):
+		key, sep, value = component.partition("=")
+		if sep:
+			fields[key] = int(value) if value.lstrip("-").isdigit() else value
+	return fields
+
+def embedding_jobs(patterns, dist_fn, test_results_dir, seed=0,
+	all_checkpoints=False, skip_existing=False, results_store=None):
+	'''
+	one job for every embedding directory matching the glob patterns, or
+	for every checkpoint in them with all_checkpoints. fields of a job are
+	the key=value components of its directory, its seed (--seed unless
+	there is a seed= component) and epoch. test_results_dir is formatted
+	with the fields to give the usual <test_results_dir>/<seed>.pkl,
+	jobs with results already written (to results_store if it is given)
+	are left out with skip_existing
+	'''
+	from heat.checkpoint import list_checkpoints
+
+	jobs = []
+	for pattern in patterns:
+		directories = sorted(directory for directory in glob.glob(pattern)
+			if os.path.isdir(directory))
+		if len(directories) == 0:
+			print ("no embedding directories match", pattern)
+		for directory in directories:
+			fields = {"seed": seed}
+			fields.update(path_fields(directory))
+			if all_checkpoints:
+				assert dist_fn in ("hyperboloid", "poincare")
+				checkpoints = list_checkpoints(directory, 
+					csv_pattern="*_embedding.csv.gz" if dist_fn == "hyperboloid"
+						else "*embedding.csv.gz")
+			else:
+				checkpoints = [(None, None)]
+			for epoch, filename in checkpoints:
+				job_fields = dict(fields, epoch=epoch)
+				results_dir = test_results_dir.format(**job_fields)
+				if all_checkpoints and "{epoch" not in test_results_dir:
+					results_dir = os.path.join(results_dir, 
+						"epoch={:05d}".format(epoch))
+				jobs.append({"dist_fn": dist_fn, 
+					"embedding_directory": directory,
+					"filename": filename,
+					"fields": job_fields,
+					"test_results_filename": os.path.join(results_dir, 
+						"{}.pkl".format(job_fields["seed"]))})
+
+	results_filenames = Counter(job["test_results_filename"] for job in jobs)
+	for filename, count in results_filenames.items():
+		assert count == 1, "results of {} embeddings would be written to {}, "\
+			"add the fields that tell them apart to --test-results-dir".format(
+				count, filename)
+	if skip_existing and results_store is not None:
+		jobs = [job for job in jobs if not results_store.contains(
+			results_key(job["test_results_filename"]))]
+	elif skip_existing:
+		jobs = [job for job in jobs 
+			if not os.path.exists(job["test_results_filename"])]
+	print ("found {} embeddings to evaluate".format(len(jobs)))
+	return jobs
+
+def group_jobs(jobs, key):
+	'''
+	jobs grouped by key(fields), in order of first appearance, so data
+	they share is loaded once per group
+	'''
+	groups = {}
+	for job in jobs:
+		groups.setdefault(key(job["fields"]), []).append(job)
+	return list(groups.items())
+
+def write_test_results(filename, test_results):
+	directory = os.path.dirname(filename)
+	if directory:
+		os.makedirs(directory, exist_ok=True)
+	print ("saving test results to {}".format(filename))
+	tmp_filename = "{}.{}.tmp".format(filename, os.getpid())
+	with open(tmp_filename, "wb") as f:
+		pkl.dump(pd.Series(test_results), f, pkl.HIGHEST_PROTOCOL)
+	os.replace(tmp_filename, filename)
+
+_batch_evaluate = None
+
+def _initialise_batch_worker(evaluate):
+	global _batch_evaluate
+	_batch_evaluate = evaluate
+
+def _evaluate_job(job):
+	try:
+		if job["filename"] is None:
+			embedding = load_embedding(job["dist_fn"], 
+				job["embedding_directory"])
+		else:
+			embedding = load_checkpoint(job["filename"])
+		return job, _batch_evaluate(embedding, job["fields"]), None
+	except Exception as e:
+		import traceback
+		traceback.print_exc()
+		print ("could not evaluate {}: {!r}".format(
+			job["filename"] or job["embedding_directory"], e))
+		return job, None, repr(e)
+
+def evaluate_embeddings(evaluate, jobs, workers=1, results_store=None):
+	'''
+	call evaluate(embedding, fields) for every job, workers at a time.
+	the returned dict of results is written to the test results filename
+	of the job, or added to results_store under the key of that filename.
+	returns the jobs that failed and their errors
+	'''
+	if workers > 1 and len(jobs) > 1:
+		from multiprocessing import Pool
+		pool = Pool(min(workers, len(jobs)), 
+			initializer=_initialise_batch_worker,
+			initargs=(evaluate, ))
+		results = pool.imap_unordered(_evaluate_job, jobs)
+	else:
+		pool = None
+		_initialise_batch_worker(evaluate)
+		results = map(_evaluate_job, jobs)
+
+	failed = []
+	try:
+		# results are written by this process only
+		for job, test_results, error in results:
+			if error is not None:
+				failed.append((job, error))
+			elif results_store is not None:
+				results_store.add(results_key(job["test_results_filename"]),
+					test_results)
+			else:
+				write_test_results(job["test_results_filename"], test_results)
+	finally:
+		if pool is not None:
+			pool.close()
+			pool.join()
+		if results_store is not None:
+			results_store.flush()
+
+	return failed
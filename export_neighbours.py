@@ -0,0 +1,81 @@
+import os
+
+import numpy as np
+
+import argparse
+
+from evaluation_utils import load_embedding, top_k_neighbours
+
+def parse_args():
+
+	parser = argparse.ArgumentParser(description='Load Embeddings and export the k nearest neighbours of every node')
+
+	parser.add_argument("--embedding", dest="embedding_directory",
+		help="directory of embedding to load.")
+
+	parser.add_argument("--dist_fn", dest="dist_fn", type=str,
+		choices=["poincare", "hyperboloid", "euclidean",
+			"kle", "klh", "st"])
+
+	parser.add_argument("-k", dest="k", type=int, default=10,
+		help="number of neighbours to export (default is 10).")
+	parser.add_argument("--output", dest="output_directory",
+		help="directory to save neighbours to (default is the embedding directory).")
+
+	parser.add_argument("--threads", dest="threads", type=int, default=1,
+		help="number of threads used to compute neighbours (default is 1).")
+	parser.add_argument("--block-size", dest="block_size", type=int,
+		help="number of nodes scored against all nodes at once (default is 2^24 / N).")
+	parser.add_argument("--include-self", dest="include_self", action="store_true",
+		help="flag to allow a node to be its own neighbour.")
+
+	return parser.parse_args()
+
+def main():
+
+	args = parse_args()
+
+	output_directory = args.output_directory
+	if output_directory is None:
+		output_directory = args.embedding_directory
+	if not os.path.exists(output_directory):
+		os.makedirs(output_directory, exist_ok=True)
+
+	embedding = load_embedding(args.dist_fn,
+		args.embedding_directory)
+	N = len(embedding[0]) if args.dist_fn in ("kle", "klh", "st") \
+		else len(embedding)
+	k = min(args.k, N if args.include_self else N - 1)
+
+	prefix = os.path.join(output_directory,
+		"{}_top{}".format(args.dist_fn, k))
+	indices_filename = prefix + "_indices.npy"
+	scores_filename = prefix + "_scores.npy"
+
+	# write to temporary files and rename once complete, so a partially
+	# written export is never read
+	indices = np.lib.format.open_memmap(indices_filename + ".tmp",
+		mode="w+", dtype=np.int64, shape=(N, k))
+	scores = np.lib.format.open_memmap(scores_filename + ".tmp",
+		mode="w+", dtype=np.float64, shape=(N, k))
+
+	print ("computing {} nearest neighbours of {} nodes".format(k, N))
+	top_k_neighbours(embedding, args.dist_fn, k,
+		indices_out=indices, scores_out=scores,
+		exclude_self=not args.include_self,
+		threads=args.threads, block_size=args.block_size)
+
+	indices.flush()
+	scores.flush()
+	del indices, scores
+	os.replace(indices_filename + ".tmp", indices_filename)
+	os.replace(scores_filename + ".tmp", scores_filename)
+
+	print ("saved neighbours to {} and scores to {}".format(
+		indices_filename, scores_filename))
+
+	print ("done")
+
+
+if __name__ == "__main__":
+	main()
@@ -1,59 +1,285 @@
 from __future__ import print_function
 
-import re
-import sys
+import time
+
 import os
-import glob
+
 import numpy as np
-import pandas as pd
 
-from .utils import hyperboloid_to_poincare_ball
+from .checkpoint import (AsyncCheckpointWriter, save_checkpoint,
+	write_delta, write_delta_rows, write_snapshot, checkpoint_filenames)
+from . import profiling
 
+from keras import backend as K
 from keras.callbacks import Callback
 
-def minkowski_dot(u):
-	return ((u[...,:-1] ** 2).sum(axis=-1, keepdims=True) 
-		- u[...,-1:] ** 2)
-
 class Checkpointer(Callback):
+	'''
+	Save the embedding at the end of every epoch. The weights are pulled
+	from the model on the training thread and written to disk in the
+	background, see heat.checkpoint.
+
+	If delta_steps > 0, the rows changed since the last full snapshot are
+	also saved every delta_steps batches, and a full snapshot is written
+	instead after deltas_per_snapshot deltas.
+
+	With a TrainingDataGenerator, only the rows of the nodes in the
+	batches trained since the last delta are read from the model and
+	written, and a full snapshot is written instead once more than
+	compaction_fraction of the rows have changed since the last one.
+	Without one, the whole embedding is compared with the last snapshot.
+	'''
 
 	def __init__(self, 
 		epoch,
 		nodes,
 		embedding_directory,
 		history=1,
+		export_csv=False,
+		delta_steps=0,
+		deltas_per_snapshot=10,
+		step=0,
+		generator=None,
+		compaction_fraction=0.5,
 		):
 		self.epoch = epoch
 		self.nodes = nodes
 		self.embedding_directory = embedding_directory
 		self.history = history
+		self.export_csv = export_csv
+		self.delta_steps = delta_steps
+		self.deltas_per_snapshot = deltas_per_snapshot
+		self.step = step
+		self.generator = generator
+		self.compaction_fraction = compaction_fraction
+		self.writer = AsyncCheckpointWriter()
+		self.gather_rows = None
+		if generator is not None and delta_steps > 0:
+			generator.track_nodes = True
+
+	def on_train_begin(self, logs={}):
+		# a resumed partial epoch writes a new snapshot first
+		filename, metadata_filename, _ = checkpoint_filenames(
+			self.embedding_directory, self.epoch)
+		self.base_filename = filename if self.step == 0 \
+			and os.path.exists(metadata_filename) else None
+		self.reset_trained_rows()
+
+	def reset_trained_rows(self):
+		'''
+		called whenever a full snapshot is written
+		'''
+		self.num_deltas = 0
+		self.trained_nodes = []
+		self.changed = None
+		self.trained_rows_known = True
+
+	def on_batch_end(self, batch, logs={}):
+		self.step += 1
+		if self.generator is not None and self.delta_steps > 0:
+			batch_nodes = self.generator.pop_batch_nodes(self.epoch, batch)
+			if batch_nodes is None:
+				self.trained_rows_known = False
+			else:
+				self.trained_nodes.append(batch_nodes)
+		# the last batch of an epoch is followed by a full checkpoint
+		if self.delta_steps > 0 and self.step % self.delta_steps == 0 \
+			and batch + 1 < (self.params.get("steps") or float("inf")):
+			if self.generator is None:
+				self.save_delta()
+			else:
+				self.save_trained_rows()
+
+	def on_epoch_end(self, batch, logs={}):
+		self.epoch += 1
+		self.step = 0
+		print ("\nEpoch {} complete".format(self.epoch)) 
+		self.save_model()
+
+	def on_train_end(self, logs={}):
+		self.writer.wait()
+
+	def save_model(self):
+		embedding = self.model.get_weights()[0]
+		self.writer.submit(save_checkpoint, 
+			self.embedding_directory,
+			self.epoch,
+			embedding,
+			nodes=self.nodes,
+			history=self.history,
+			export_csv=self.export_csv)
+		self.base_filename = checkpoint_filenames(
+			self.embedding_directory, self.epoch)[0]
+		self.reset_trained_rows()
+
+	def read_rows(self, idx):
+		'''
+		rows idx of the embedding, without copying the whole variable
+		'''
+		if self.gather_rows is None:
+			rows = K.placeholder(shape=(None, ), dtype="int64")
+			self.gather_rows = K.function([rows], 
+				[K.gather(self.model.layers[1].embedding, rows)])
+		return self.gather_rows([idx])[0]
+
+	def save_trained_rows(self):
+		'''
+		write the rows trained since the last delta, or a full snapshot
+		when there is no base, after deltas_per_snapshot deltas, when too
+		many rows have changed since the base or when a batch was not kept
+		by the generator
+		'''
+		if len(self.trained_nodes) > 0:
+			idx = np.unique(np.concatenate(self.trained_nodes))
+		else:
+			idx = np.zeros(0, dtype=np.int64)
+		self.trained_nodes = []
+		num_nodes = len(self.nodes)
+		if self.changed is None:
+			self.changed = np.zeros(num_nodes, dtype=bool)
+		self.changed[idx] = True
+
+		if self.base_filename is None or not self.trained_rows_known \
+			or self.num_deltas >= self.deltas_per_snapshot \
+			or self.changed.sum() > self.compaction_fraction * num_nodes:
+			embedding = self.model.get_weights()[0]
+			self.writer.submit(write_snapshot,
+				self.embedding_directory,
+				self.epoch,
+				self.step,
+				embedding,
+				nodes=self.nodes)
+			self.base_filename = checkpoint_filenames(
+				self.embedding_directory, self.epoch, step=self.step)[0]
+			self.reset_trained_rows()
+		else:
+			self.writer.submit(write_delta_rows,
+				self.embedding_directory,
+				self.epoch,
+				self.step,
+				idx,
+				self.read_rows(idx),
+				self.base_filename)
+			self.num_deltas += 1
+
+	def save_delta(self):
+		embedding = self.model.get_weights()[0]
+		self.writer.submit(self.write_delta, 
+			self.epoch,
+			self.step,
+			embedding)
+
+	def write_delta(self, epoch, step, embedding):
+		# runs on the writer thread, after any earlier checkpoint is written
+		base_filename = write_delta(self.embedding_directory,
+			epoch,
+			step,
+			embedding,
+			self.base_filename,
+			nodes=self.nodes,
+			force_snapshot=self.num_deltas >= self.deltas_per_snapshot)
+		if base_filename == self.base_filename:
+			self.num_deltas += 1
+		else:
+			self.base_filename = base_filename
+			self.num_deltas = 0
+
+class StackedCheckpointer(Callback):
+	'''
+	Save every replica of a stacked embedding to its own directory at the
+	end of every epoch, replica r is rows r * num_nodes to 
+	(r + 1) * num_nodes.
+	'''
+
+	def __init__(self, 
+		epoch,
+		nodes,
+		embedding_directories,
+		history=1,
+		export_csv=False,
+		):
+		self.epoch = epoch
+		self.nodes = nodes
+		self.embedding_directories = embedding_directories
+		self.history = history
+		self.export_csv = export_csv
+		self.writer = AsyncCheckpointWriter()
 
 	def on_epoch_end(self, batch, logs={}):
 		self.epoch += 1
 		print ("\nEpoch {} complete".format(self.epoch)) 
-		self.remove_old_models()
 		self.save_model()
 
-	def remove_old_models(self):
-		embedding_directory = self.embedding_directory
-		history = self.history
-		old_model_paths = sorted(filter(
-			re.compile("[0-9]+\_embedding\.csv\.gz").match, 
-			os.listdir(embedding_directory)))
-		if history > 0:
-			old_model_paths = old_model_paths[:-history]
-		for old_model_path in old_model_paths:
-			print ("removing model: {}".format(old_model_path))
-			os.remove(os.path.join(embedding_directory, 
-				old_model_path))
+	def on_train_end(self, logs={}):
+		self.writer.wait()
 
 	def save_model(self):
-		filename = os.path.join(self.embedding_directory, 
-			"{:05d}_embedding.csv.gz".format(self.epoch))
 		embedding = self.model.get_weights()[0]
-		print ("saving current embedding to {}".format(filename))
+		self.writer.submit(self.save_replicas, self.epoch, embedding)
+
+	def save_replicas(self, epoch, embedding):
+		num_nodes = len(self.nodes)
+		for replica, embedding_directory in enumerate(
+			self.embedding_directories):
+			save_checkpoint(embedding_directory,
+				epoch,
+				embedding[replica * num_nodes : (replica + 1) * num_nodes],
+				nodes=self.nodes,
+				history=self.history,
+				export_csv=self.export_csv)
+
+class ThroughputLogger(Callback):
+	'''
+	Record per-epoch samples/sec and split the epoch into time spent
+	waiting for the generator and time spent in the train step.
+	'''
+
+	def __init__(self, 
+		generator=None,
+		):
+		self.generator = generator
+
+	def on_epoch_begin(self, epoch, logs={}):
+		self.epoch_start_time = time.time()
+		self.last_batch_end_time = self.epoch_start_time
+		self.generator_wait_time = 0.
+		self.train_step_time = 0.
+		self.num_samples = 0
+		self.num_steps = 0
+		if self.generator is not None:
+			self.generator.reset_timing()
+
+	def on_batch_begin(self, batch, logs={}):
+		self.batch_start_time = time.time()
+		self.generator_wait_time += \
+			self.batch_start_time - self.last_batch_end_time
 
-		assert np.allclose(minkowski_dot(embedding,), -1, )
+	def on_batch_end(self, batch, logs={}):
+		self.last_batch_end_time = time.time()
+		self.train_step_time += \
+			self.last_batch_end_time - self.batch_start_time
+		self.num_samples += logs.get("size", 0)
+		self.num_steps += 1
 
-		embedding_df = pd.DataFrame(embedding, index=self.nodes)
-		embedding_df.to_csv(filename, compression="gzip")
\ No newline at end of file
+	def on_epoch_end(self, epoch, logs={}):
+		epoch_time = time.time() - self.epoch_start_time
+		record = {"epoch": epoch + 1, 
+			"steps": self.num_steps,
+			"generator_wait_time": self.generator_wait_time,
+			"train_step_time": self.train_step_time,
+			"loss": float(logs["loss"]) if "loss" in logs else None}
+		if self.generator is not None:
+			record.update({"generator_batch_time": self.generator.batch_time,
+				"generator_batches": self.generator.num_batches})
+		print ("\nEpoch {}: {:.1f} samples/s, generator wait {:.2f}s, train step {:.2f}s".format(
+			epoch + 1, self.num_samples / max(epoch_time, 1e-15), 
+			self.generator_wait_time, self.train_step_time))
+		profiling.record("epoch", epoch_time, 
+			items=self.num_samples, **record)
+		profiling.record("train_step", self.train_step_time, 
+			items=self.num_steps)
+		profiling.record("generator_wait", self.generator_wait_time, 
+			items=self.num_steps)
+		if self.generator is not None:
+			profiling.record("generator_batch", self.generator.batch_time, 
+				items=self.generator.num_batches)
\ No newline at end of file
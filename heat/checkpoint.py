@@ -0,0 +1,357 @@
+'''
+Binary embedding checkpoints.
+
+A checkpoint for epoch e is {e:05d}_embedding.npy plus {e:05d}_embedding.json
+holding the epoch, shape, node order and a hash of the array. Both are
+written to temporary files and renamed into place, the .npy first and the
+.json last, so a checkpoint is only visible to readers once it is complete.
+The gzipped csv format of earlier versions is still read, and can still be
+written as an optional export.
+
+Within an epoch, delta checkpoints {e:05d}_{step:08d}_delta.npz store only
+the rows that differ from the last full snapshot, either the checkpoint of
+epoch e or a mid-epoch compaction {e:05d}_{step:08d}_snapshot.npy. A delta
+written by write_delta holds every row changed since the snapshot, one
+written by write_delta_rows only the rows trained since the previous delta.
+restore_latest replays them in order.
+'''
+
+from __future__ import print_function
+
+import os
+import re
+import glob
+import json
+import time
+import hashlib
+import threading
+
+import numpy as np
+
+from . import profiling
+from .geometry import minkowski_norm_squared
+
+CHECKPOINT_PATTERN = re.compile(r"([0-9]+)_embedding\.(npy|csv\.gz)$")
+SNAPSHOT_PATTERN = re.compile(r"([0-9]+)_([0-9]+)_snapshot\.npy$")
+DELTA_PATTERN = re.compile(r"([0-9]+)_([0-9]+)_delta\.npz$")
+
+def checkpoint_filenames(directory, epoch, step=None):
+	'''
+	step is None for the checkpoint at the end of an epoch
+	'''
+	if step is None:
+		prefix = os.path.join(directory, "{:05d}_embedding".format(epoch))
+	else:
+		prefix = os.path.join(directory, 
+			"{:05d}_{:08d}_snapshot".format(epoch, step))
+	return prefix + ".npy", prefix + ".json", prefix + ".csv.gz"
+
+def delta_filename(directory, epoch, step):
+	return os.path.join(directory, 
+		"{:05d}_{:08d}_delta.npz".format(epoch, step))
+
+def array_hash(array, chunk_size=1000000):
+	h = hashlib.sha1()
+	array = array.reshape(len(array), -1)
+	rows_per_chunk = max(1, chunk_size // max(array.shape[1], 1))
+	for start in range(0, len(array), rows_per_chunk):
+		h.update(np.ascontiguousarray(array[start:start+rows_per_chunk]).tobytes())
+	return h.hexdigest()
+
+def is_identity_order(nodes, num_nodes):
+	return nodes is None or \
+		np.array_equal(np.asarray(nodes), np.arange(num_nodes))
+
+def publish_checkpoint(directory, epoch, temporary_filename, nodes=None,
+	step=None):
+	'''
+	rename a completely written .npy into place and write its metadata
+	'''
+	filename, metadata_filename, _ = checkpoint_filenames(directory, 
+		epoch, step=step)
+	embedding = np.load(temporary_filename, mmap_mode="r")
+	metadata = {"epoch": epoch,
+		"step": step,
+		"num_nodes": embedding.shape[0],
+		"dim": embedding.shape[1],
+		"dtype": str(embedding.dtype),
+		"nodes": None if is_identity_order(nodes, embedding.shape[0])
+			else [int(u) for u in nodes],
+		"sha1": array_hash(embedding)}
+	del embedding
+	os.replace(temporary_filename, filename)
+	with open(metadata_filename + ".tmp", "w") as f:
+		json.dump(metadata, f)
+	os.replace(metadata_filename + ".tmp", metadata_filename)
+	return filename
+
+def write_checkpoint(directory, epoch, embedding, nodes=None,
+	export_csv=False, check_hyperboloid=True, step=None):
+	filename, _, csv_filename = checkpoint_filenames(directory, 
+		epoch, step=step)
+	print ("saving current embedding to {}".format(filename))
+
+	with profiling.stage("checkpoint_write", items=len(embedding)):
+		if check_hyperboloid:
+			assert np.allclose(minkowski_norm_squared(embedding), -1, )
+		temporary_filename = filename + ".tmp"
+		with open(temporary_filename, "wb") as f:
+			np.save(f, embedding)
+		publish_checkpoint(directory, epoch, temporary_filename, 
+			nodes=nodes, step=step)
+
+	if export_csv:
+		export_csv_checkpoint(filename, csv_filename)
+	return filename
+
+def export_csv_checkpoint(filename, csv_filename=None):
+	'''
+	write a binary checkpoint in the gzipped csv format
+	'''
+	import pandas as pd
+
+	if csv_filename is None:
+		csv_filename = filename.replace(".npy", ".csv.gz")
+	embedding = np.load(filename, mmap_mode="r")
+	nodes = read_metadata(filename)["nodes"]
+	if nodes is None:
+		nodes = range(len(embedding))
+	print ("exporting {} to {}".format(filename, csv_filename))
+	with profiling.stage("checkpoint_export_csv", items=len(embedding)):
+		embedding_df = pd.DataFrame(np.asarray(embedding), index=nodes)
+		embedding_df.to_csv(csv_filename + ".tmp", compression="gzip")
+		os.replace(csv_filename + ".tmp", csv_filename)
+	return csv_filename
+
+def read_metadata(filename):
+	metadata_filename = re.sub(r"\.npy$", ".json", filename)
+	with open(metadata_filename, "r") as f:
+		return json.load(f)
+
+def list_checkpoints(directory, csv_pattern="*_embedding.csv.gz"):
+	'''
+	returns sorted (epoch, filename) of all published checkpoints,
+	binary checkpoints are preferred over csv ones of the same epoch
+	'''
+	checkpoints = {}
+	# csv checkpoints without an epoch all map to -1, the last in sorted
+	# order is kept as before
+	for filename in sorted(glob.iglob(os.path.join(directory, csv_pattern))):
+		match = re.match("([0-9]+)", os.path.basename(filename))
+		epoch = int(match.group(1)) if match else -1
+		checkpoints[epoch] = filename
+	for filename in glob.iglob(os.path.join(directory, "*_embedding.npy")):
+		if os.path.exists(re.sub(r"\.npy$", ".json", filename)):
+			epoch = int(CHECKPOINT_PATTERN.search(filename).group(1))
+			checkpoints[epoch] = filename
+	return sorted(checkpoints.items())
+
+def latest_checkpoint(directory, csv_pattern="*_embedding.csv.gz"):
+	checkpoints = list_checkpoints(directory, csv_pattern=csv_pattern)
+	if len(checkpoints) == 0:
+		return 0, None
+	return checkpoints[-1]
+
+def load_checkpoint(filename, mmap_mode="r"):
+	'''
+	returns the embedding with rows in sorted node order, raises IOError
+	if a binary checkpoint does not match the sha1 in its metadata
+	'''
+	print ("reading from", filename)
+	if filename.endswith(".npy"):
+		embedding = np.load(filename, mmap_mode=mmap_mode)
+		metadata = read_metadata(filename)
+		if "sha1" in metadata and array_hash(embedding) != metadata["sha1"]:
+			raise IOError("{} does not match the sha1 in its metadata".format(
+				filename))
+		nodes = metadata["nodes"]
+		if nodes is not None:
+			embedding = embedding[np.argsort(nodes)]
+	else:
+		import pandas as pd
+		embedding_df = pd.read_csv(filename, index_col=0)
+		embedding = embedding_df.reindex(sorted(embedding_df.index)).values
+	print ("embedding shape is", embedding.shape)
+	return embedding
+
+def remove_old_checkpoints(directory, history=1):
+	'''
+	keep the most recent history + 1 checkpoints
+	'''
+	checkpoints = list_checkpoints(directory)
+	for epoch, _ in checkpoints[:-(history + 1)]:
+		for filename in checkpoint_filenames(directory, epoch):
+			if os.path.exists(filename):
+				print ("removing model: {}".format(filename))
+				os.remove(filename)
+
+class AsyncCheckpointWriter(object):
+	'''
+	write checkpoints on a background thread, at most one at a time
+	'''
+
+	def __init__(self):
+		self.thread = None
+		self.error = None
+
+	def run(self, fn, args, kwargs):
+		try:
+			fn(*args, **kwargs)
+		except Exception as e:
+			self.error = e
+
+	def submit(self, fn, *args, **kwargs):
+		self.wait()
+		self.thread = threading.Thread(target=self.run,
+			args=(fn, args, kwargs))
+		self.thread.daemon = False
+		self.thread.start()
+
+	def wait(self):
+		if self.thread is not None:
+			start_time = time.time()
+			self.thread.join()
+			self.thread = None
+			profiling.record("checkpoint_wait", time.time() - start_time)
+		if self.error is not None:
+			error, self.error = self.error, None
+			raise error
+
+def save_checkpoint(directory, epoch, embedding, nodes=None,
+	history=1, export_csv=False):
+	filename = write_checkpoint(directory, epoch, embedding, nodes=nodes,
+		export_csv=export_csv)
+	remove_sub_epoch_checkpoints(directory, epoch)
+	remove_old_checkpoints(directory, history=history)
+	return filename
+
+def list_sub_epoch_checkpoints(directory):
+	'''
+	returns sorted ((epoch, step), filename) of mid-epoch snapshots and
+	deltas, a snapshot sorts before a delta of the same step
+	'''
+	checkpoints = []
+	for filename in glob.iglob(os.path.join(directory, "*_snapshot.npy")):
+		if os.path.exists(re.sub(r"\.npy$", ".json", filename)):
+			epoch, step = map(int, SNAPSHOT_PATTERN.search(filename).groups())
+			checkpoints.append(((epoch, step, 0), filename))
+	for filename in glob.iglob(os.path.join(directory, "*_delta.npz")):
+		epoch, step = map(int, DELTA_PATTERN.search(filename).groups())
+		checkpoints.append(((epoch, step, 1), filename))
+	return [((epoch, step), filename) 
+		for (epoch, step, _), filename in sorted(checkpoints)]
+
+def remove_sub_epoch_checkpoints(directory, epoch, step=None):
+	'''
+	remove snapshots and deltas superseded by a full snapshot at
+	(epoch, step), step is None for the checkpoint at the end of epoch
+	'''
+	for (e, s), filename in list_sub_epoch_checkpoints(directory):
+		if e < epoch or (e == epoch and step is not None and s < step):
+			os.remove(filename)
+			if filename.endswith(".npy"):
+				os.remove(re.sub(r"\.npy$", ".json", filename))
+
+def write_delta(directory, epoch, step, embedding, base_filename,
+	nodes=None, compaction_fraction=0.5, force_snapshot=False):
+	'''
+	write the rows of embedding that differ from the full snapshot in
+	base_filename, or a new full snapshot when there is no base, when
+	more than compaction_fraction of the rows have changed or when
+	force_snapshot is set. returns the filename of the current base
+	'''
+	if base_filename is not None and not force_snapshot:
+		base = np.load(base_filename, mmap_mode="r")
+		changed = np.flatnonzero((embedding != base).any(axis=-1))
+		del base
+		if len(changed) <= compaction_fraction * len(embedding):
+			filename = delta_filename(directory, epoch, step)
+			print ("saving {} changed rows to {}".format(len(changed), 
+				filename))
+			with profiling.stage("delta_checkpoint_write", 
+				items=len(changed)):
+				with open(filename + ".tmp", "wb") as f:
+					np.savez(f, idx=changed, rows=embedding[changed],
+						base=os.path.basename(base_filename),
+						epoch=epoch, step=step)
+				os.replace(filename + ".tmp", filename)
+			# each delta holds every row changed since the base
+			for (e, s), f in list_sub_epoch_checkpoints(directory):
+				if f.endswith(".npz") and (e, s) < (epoch, step):
+					os.remove(f)
+			return base_filename
+
+	return write_snapshot(directory, epoch, step, embedding, nodes=nodes)
+
+def write_snapshot(directory, epoch, step, embedding, nodes=None):
+	'''
+	a full mid-epoch snapshot, removes the snapshots and deltas before it.
+	returns its filename
+	'''
+	filename = write_checkpoint(directory, epoch, embedding, 
+		nodes=nodes, step=step)
+	remove_sub_epoch_checkpoints(directory, epoch, step=step)
+	return filename
+
+def write_delta_rows(directory, epoch, step, idx, rows, base_filename):
+	'''
+	write rows, the rows idx of the embedding, as a delta on top of
+	base_filename and the deltas written since. idx must hold every row
+	changed since the previous delta, there is no comparison with the base
+	'''
+	filename = delta_filename(directory, epoch, step)
+	print ("saving {} trained rows to {}".format(len(idx), filename))
+	with profiling.stage("delta_checkpoint_write", items=len(idx)):
+		with open(filename + ".tmp", "wb") as f:
+			np.savez(f, idx=idx, rows=rows,
+				base=os.path.basename(base_filename),
+				epoch=epoch, step=step)
+		os.replace(filename + ".tmp", filename)
+	return filename
+
+def save_training_state(directory, state):
+	'''
+	the options a checkpoint at (epoch, step) can be resumed under
+	'''
+	filename = os.path.join(directory, "training_state.json")
+	with open(filename + ".tmp", "w") as f:
+		json.dump(state, f, sort_keys=True)
+	os.replace(filename + ".tmp", filename)
+
+def load_training_state(directory):
+	filename = os.path.join(directory, "training_state.json")
+	if not os.path.exists(filename):
+		return None
+	with open(filename, "r") as f:
+		return json.load(f)
+
+def restore_latest(directory):
+	'''
+	replay the latest full snapshot and the deltas written since
+	returns (embedding, epoch, step) where epoch is the number of completed
+	epochs and step the number of steps completed in the next epoch
+	or (None, 0, 0) if there is nothing to restore
+	'''
+	epoch, filename = latest_checkpoint(directory)
+	step = 0
+	embedding = None
+	if filename is not None:
+		embedding = load_checkpoint(filename, mmap_mode=None)
+
+	for (e, s), f in list_sub_epoch_checkpoints(directory):
+		if (e, s) < (epoch, step):
+			continue
+		if f.endswith(".npy"):
+			embedding = load_checkpoint(f, mmap_mode=None)
+		else:
+			delta = np.load(f)
+			base_filename = os.path.join(directory, str(delta["base"]))
+			if embedding is None or not os.path.exists(base_filename):
+				print ("base of {} not found -- skipping".format(f))
+				continue
+			print ("replaying {} rows from {}".format(len(delta["idx"]), f))
+			embedding = np.array(embedding)
+			embedding[delta["idx"]] = delta["rows"]
+		epoch, step = e, s
+
+	return embedding, epoch, step
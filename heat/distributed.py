@@ -0,0 +1,160 @@
+'''
+Data-parallel training on a shared embedding table.
+
+The embedding lives in shared memory. Each of the K worker processes trains
+on its own shard of the positive samples with heat.numpy_sgd: it reads the
+rows of a batch, computes the gradient of the hyperbolic softmax loss and
+writes the Riemannian update of the touched rows straight back into the
+table, without locks (Hogwild). A batch touches a few thousand of the N
+rows, so concurrent updates of the same row are rare, and when they happen
+one of them is lost rather than the row being corrupted beyond that step.
+Negative samples are drawn by heat.numpy_sgd.NegativeSampler, without the
+N x N table of negative sampling probabilities.
+
+At the end of every epoch the workers wait while the parent copies the
+table, and the copy is written as a checkpoint in the background while the
+next epoch trains. Every process must be on the same machine.
+'''
+
+from __future__ import print_function
+
+import time
+
+import numpy as np
+
+from multiprocessing import Process, RawArray, Queue, Semaphore
+from queue import Empty
+
+from . import profiling
+from .numpy_sgd import initialise_embedding, sgd_step
+from .checkpoint import AsyncCheckpointWriter, save_checkpoint
+
+def shared_embedding(embedding):
+	'''
+	a copy of embedding in shared memory, returns the buffer to pass to
+	workers and the array
+	'''
+	buffer = RawArray("d", embedding.size)
+	shared = np.frombuffer(buffer, dtype=np.float64).reshape(embedding.shape)
+	shared[:] = embedding
+	return buffer, shared
+
+def run_worker(buffer,
+	shape,
+	worker_id,
+	num_workers,
+	positive_samples,
+	sampler,
+	args,
+	initial_epoch,
+	epoch_ends,
+	resume):
+	'''
+	train on every num_workers-th positive sample, starting at worker_id,
+	reporting the loss of every epoch to epoch_ends and waiting for resume
+	before the next one
+	'''
+	np.random.seed(args.seed + 1 + worker_id)
+
+	embedding = np.frombuffer(buffer, dtype=np.float64).reshape(shape)
+	positive_samples = positive_samples[worker_id::num_workers]
+	num_positive_samples = len(positive_samples)
+	batch_size = args.batch_size
+
+	for epoch in range(initial_epoch, args.num_epochs):
+		epoch_loss = 0.
+		num_batches = 0
+
+		idx = np.random.permutation(num_positive_samples)
+		for start in range(0, num_positive_samples, batch_size):
+			batch_positive_samples = positive_samples[idx[start:start+batch_size]]
+			batch_negative_samples = sampler.sample(
+				batch_positive_samples[:,0], args.num_negative_samples)
+			batch_nodes = np.concatenate(
+				[batch_positive_samples, batch_negative_samples],
+				axis=1)
+			loss, _ = sgd_step(embedding, batch_nodes,
+				lr=args.lr, sigma=args.sigma)
+			epoch_loss += loss
+			num_batches += 1
+
+		epoch_ends.put((worker_id, epoch_loss, num_batches))
+		resume.acquire()
+
+def wait_for_workers(epoch_ends, workers):
+	'''
+	the (worker_id, loss, num_batches) of every worker at the end of an
+	epoch, raises if a worker has died
+	'''
+	results = []
+	while len(results) < len(workers):
+		try:
+			results.append(epoch_ends.get(timeout=1.))
+		except Empty:
+			for worker in workers:
+				assert worker.is_alive(), "worker failed"
+	return results
+
+def train_distributed(num_nodes,
+	positive_samples,
+	sampler,
+	args,
+	embedding=None,
+	initial_epoch=0):
+	'''
+	train args.num_workers workers on a shared copy of embedding, starting
+	at initial_epoch, and write a checkpoint to args.embedding_path at the
+	end of every epoch. returns the trained embedding
+	'''
+	num_workers = args.num_workers
+
+	if embedding is None:
+		embedding = initialise_embedding(num_nodes, args.embedding_dim)
+	buffer, embedding = shared_embedding(np.asarray(embedding,
+		dtype=np.float64))
+
+	epoch_ends = Queue()
+	resume = Semaphore(0)
+	workers = [Process(target=run_worker,
+		args=(buffer, embedding.shape, worker_id, num_workers,
+			positive_samples, sampler, args, initial_epoch,
+			epoch_ends, resume))
+		for worker_id in range(num_workers)]
+	for worker in workers:
+		worker.daemon = True
+		worker.start()
+
+	writer = AsyncCheckpointWriter()
+	try:
+		for epoch in range(initial_epoch, args.num_epochs):
+			epoch_start_time = time.time()
+			results = wait_for_workers(epoch_ends, workers)
+			# the workers are paused until they are released
+			checkpoint = embedding.copy()
+			for _ in workers:
+				resume.release()
+
+			epoch_loss = sum(loss for _, loss, _ in results)
+			num_batches = sum(n for _, _, n in results)
+			print ("\nEpoch {} complete -- loss={} ({:.2f}s)".format(epoch + 1,
+				epoch_loss / max(num_batches, 1),
+				time.time() - epoch_start_time))
+			profiling.record("epoch", time.time() - epoch_start_time,
+				items=len(positive_samples), epoch=epoch + 1,
+				steps=num_batches, loss=epoch_loss / max(num_batches, 1))
+
+			if args.embedding_path is not None:
+				writer.submit(save_checkpoint,
+					args.embedding_path,
+					epoch + 1,
+					checkpoint,
+					nodes=range(num_nodes),
+					export_csv=getattr(args, "export_csv", False))
+
+		for worker in workers:
+			worker.join()
+			assert worker.exitcode == 0, "worker failed"
+	finally:
+		writer.wait()
+
+	return np.array(embedding)
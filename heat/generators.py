@@ -1,35 +1,67 @@
+import time
+import threading
+
 import numpy as np
 
 from keras.utils import Sequence
 
-import os
-
 class TrainingDataGenerator(Sequence):
+	'''
+	The order of the positive samples in an epoch and the negative samples
+	of a batch are drawn from random streams seeded by (seed, epoch) and
+	(seed, epoch, batch), so training resumed at any (epoch, step) sees
+	exactly the batches the interrupted run would have seen. For a resumed
+	partial epoch the first step batches are skipped and len() is the
+	number of remaining batches; fit_generator must be called with
+	shuffle=False. Negative samples are drawn by a
+	heat.numpy_sgd.NegativeSampler.
+
+	With track_nodes set, the nodes of every batch are kept until
+	pop_batch_nodes is called for it, so that a Checkpointer can write
+	only the rows trained since its last delta.
+	'''
 
 	def __init__(self, 
 		positive_samples, 
-		probs, 
+		sampler, 
 		model,
 		graph, 
-		args):
+		args,
+		epoch=0,
+		step=0):
 		assert isinstance(positive_samples, np.ndarray)
 		self.num_positive_samples = len(positive_samples)
-		idx = np.random.permutation(self.num_positive_samples)
-		self.positive_samples = positive_samples[idx]
-		self.probs = probs
+		self.positive_samples = positive_samples
+		self.sampler = sampler
 		self.batch_size = args.batch_size
 		self.num_negative_samples = args.num_negative_samples
 		self.model = model
+		self.seed = args.seed
+		self.epoch = epoch
+		self.step = step
+		self.idx = self.permutation(epoch)
+		self.timing_lock = threading.Lock()
+		self.reset_timing()
+		self.track_nodes = False
+		self.batch_nodes = {}
 
-	def get_training_sample(self, batch_positive_samples):
-		num_negative_samples = self.num_negative_samples
-		probs = self.probs
+	def permutation(self, epoch):
+		return np.random.RandomState([self.seed, epoch]).permutation(
+			self.num_positive_samples)
 
-		batch_negative_samples = np.array([
-			np.searchsorted(probs[u], 
-				np.random.rand(num_negative_samples))
-			for u, v in batch_positive_samples
-		], dtype=np.int64)
+	def reset_timing(self):
+		'''
+		time spent producing batches, summed over all worker threads
+		'''
+		with self.timing_lock:
+			self.batch_time = 0.
+			self.num_batches = 0
+
+	def get_training_sample(self, batch_positive_samples, random_state):
+		batch_negative_samples = self.sampler.sample(
+			batch_positive_samples[:,0], 
+			self.num_negative_samples,
+			random_state=random_state)
 
 		batch_nodes = np.concatenate(
 			[batch_positive_samples, batch_negative_samples], 
@@ -37,25 +69,101 @@ class TrainingDataGenerator(Sequence):
 
 		return batch_nodes
 
-	def __len__(self):
+	def num_batches_per_epoch(self):
 		return int(np.ceil(self.num_positive_samples / \
 			float(self.batch_size)))
 
+	def __len__(self):
+		return self.num_batches_per_epoch() - self.step
+
+	def pop_batch_nodes(self, epoch, batch_idx):
+		'''
+		the nodes of batch batch_idx of epoch, or None if they were not
+		kept. batch_idx counts from the first batch of a resumed epoch
+		'''
+		with self.timing_lock:
+			return self.batch_nodes.pop((epoch, batch_idx), None)
+
 	def __getitem__(self, batch_idx):
+		start_time = time.time()
+		key = (self.epoch, batch_idx)
+		batch_idx += self.step
 		batch_size = self.batch_size
-		positive_samples = self.positive_samples
-		batch_positive_samples = positive_samples[
-			batch_idx * batch_size : 
-			(batch_idx + 1) * batch_size]
+		batch_positive_samples = self.positive_samples[
+			np.sort(self.idx[batch_idx * batch_size : 
+			(batch_idx + 1) * batch_size])]
+		random_state = np.random.RandomState([self.seed, 
+			self.epoch, batch_idx])
 		training_sample = self.get_training_sample(
-			batch_positive_samples)
+			batch_positive_samples, random_state)
 
 		target = np.zeros((training_sample.shape[0], 1, 1), 
 			dtype=np.int64)
+
+		batch_nodes = np.unique(training_sample) if self.track_nodes \
+			else None
+
+		with self.timing_lock:
+			self.batch_time += time.time() - start_time
+			self.num_batches += 1
+			if batch_nodes is not None:
+				self.batch_nodes[key] = batch_nodes
 		
 		return training_sample, target
 
+	def set_position(self, epoch, step=0):
+		self.epoch = epoch
+		self.step = step
+		self.idx = self.permutation(epoch)
+
+	def on_epoch_end(self):
+		self.set_position(self.epoch + 1)
+
+class StackedTrainingDataGenerator(Sequence):
+	'''
+	Concatenate the batches of one TrainingDataGenerator per replica,
+	shifting the nodes of replica r by r * num_nodes into the stacked
+	embedding. Replicas with fewer batches in an epoch contribute nothing
+	to the final steps.
+	'''
+
+	def __init__(self, 
+		generators,
+		num_nodes):
+		self.generators = generators
+		self.num_nodes = num_nodes
+
+	def reset_timing(self):
+		for generator in self.generators:
+			generator.reset_timing()
+
+	@property
+	def batch_time(self):
+		return sum(generator.batch_time for generator in self.generators)
+
+	@property
+	def num_batches(self):
+		return max(generator.num_batches for generator in self.generators)
+
+	def __len__(self):
+		return max(len(generator) for generator in self.generators)
+
+	def __getitem__(self, batch_idx):
+		training_samples = []
+		targets = []
+		for replica, generator in enumerate(self.generators):
+			if batch_idx >= len(generator):
+				continue
+			training_sample, target = generator[batch_idx]
+			training_samples.append(training_sample + 
+				replica * self.num_nodes)
+			targets.append(target)
+		return np.concatenate(training_samples), np.concatenate(targets)
+
+	def set_position(self, epoch, step=0):
+		for generator in self.generators:
+			generator.set_position(epoch, step)
+
 	def on_epoch_end(self):
-		positive_samples = self.positive_samples
-		idx = np.random.permutation(self.num_positive_samples)
-		self.positive_samples = positive_samples[idx]
+		for generator in self.generators:
+			generator.on_epoch_end()
@@ -0,0 +1,277 @@
+'''
+NumPy kernels for the hyperboloid model and its conversions to the
+Poincare ball and Klein models. heat.geometry_tf provides the same
+functions for TF tensors.
+
+Points are stored along the last axis with the time coordinate last, as
+in the embedding. Every kernel keeps float32 inputs in float32, accepts
+out= to write into an existing array (or memmap), and processes the
+leading axis in blocks of chunk_size rows so that no temporary larger
+than one block is allocated.
+'''
+
+import numpy as np
+
+EPSILON = 1e-15
+CHUNK_SIZE = 2 ** 16
+
+def float_dtype(*arrays):
+	return np.result_type(*arrays, np.float32)
+
+def chunked(kernel, arrays, out_shape, out=None, chunk_size=CHUNK_SIZE):
+	'''
+	call kernel(*arrays, out=out) on blocks of rows. Arrays with the
+	full number of dimensions are sliced along the first axis, the rest
+	are broadcast
+	'''
+	if out is None:
+		out = np.empty(out_shape, dtype=float_dtype(*arrays))
+	assert out.shape == tuple(out_shape), "out has shape {}, expected {}".format(
+		out.shape, tuple(out_shape))
+	ndim = max(array.ndim for array in arrays)
+	if ndim < 2 or len(out_shape) == 0 or out_shape[0] <= chunk_size:
+		kernel(*arrays, out=out)
+		return out
+	n = out_shape[0]
+	for start in range(0, n, chunk_size):
+		rows = slice(start, min(start + chunk_size, n))
+		kernel(*[array[rows] if array.ndim == ndim and array.shape[0] == n
+			else array for array in arrays], out=out[rows])
+	return out
+
+def _broadcast_shape(*arrays, **kwargs):
+	'''
+	shape of the result of combining points, with the last axis
+	replaced by kwargs["last"] (removed if None)
+	'''
+	shape = np.broadcast(*[np.empty(array.shape[:-1] + (0,), dtype=bool)
+		for array in arrays]).shape[:-1]
+	last = kwargs.get("last")
+	return shape if last is None else shape + (last,)
+
+def _einsum(x, y, out):
+	if out is None:
+		return np.einsum("...i,...i->...", x, y)
+	return np.einsum("...i,...i->...", x, y, out=out, casting="same_kind")
+
+def _squared_norm(x, out):
+	return _einsum(x, x, out)
+
+def _minkowski_dot(x, y, out):
+	out = _einsum(x[...,:-1], y[...,:-1], out)
+	out -= x[...,-1] * y[...,-1]
+	return out
+
+def minkowski_dot(x, y, keepdims=True, out=None, chunk_size=CHUNK_SIZE):
+	assert len(x.shape) == len(y.shape)
+	shape = _broadcast_shape(x, y)
+	if out is not None and keepdims:
+		out = out[...,0]
+	result = chunked(_minkowski_dot, (x, y), shape, out=out,
+		chunk_size=chunk_size)
+	return result[...,None] if keepdims else result
+
+def minkowski_norm_squared(x, keepdims=True, out=None,
+	chunk_size=CHUNK_SIZE):
+	return minkowski_dot(x, x, keepdims=keepdims, out=out,
+		chunk_size=chunk_size)
+
+def _hyperboloid_distance(u, v, out):
+	_minkowski_dot(u, v, out)
+	np.negative(out, out=out)
+	np.maximum(out, 1 + EPSILON, out=out)
+	return np.arccosh(out, out=out)
+
+def hyperboloid_distance(u, v, out=None, chunk_size=CHUNK_SIZE):
+	assert len(u.shape) == len(v.shape)
+	return chunked(_hyperboloid_distance, (u, v), _broadcast_shape(u, v),
+		out=out, chunk_size=chunk_size)
+
+def _poincare_distance(u, v, out):
+	dtype = out.dtype.type
+	max_norm = np.nextafter(dtype(1), dtype(0))
+	norm_u = 1 - np.minimum(_squared_norm(u, None), max_norm)
+	norm_v = 1 - np.minimum(_squared_norm(v, None), max_norm)
+	_squared_norm(u - v, out)
+	out *= 2
+	out /= norm_u * norm_v
+	out += 1
+	return np.arccosh(out, out=out)
+
+def poincare_distance(u, v, out=None, chunk_size=CHUNK_SIZE):
+	assert len(u.shape) == len(v.shape)
+	return chunked(_poincare_distance, (u, v), _broadcast_shape(u, v),
+		out=out, chunk_size=chunk_size)
+
+def _minkowski_metric(X, dtype):
+	X = X.astype(dtype, copy=True)
+	X[...,-1] *= -1
+	return X
+
+def pairwise_minkowski_dot(X, Y, out=None, chunk_size=CHUNK_SIZE):
+	'''
+	(n, m) matrix of minkowski products between the rows of X (n, d+1)
+	and Y (m, d+1), as one matrix product per block of rows of X
+	'''
+	dtype = float_dtype(X, Y)
+	Y = np.ascontiguousarray(Y.T, dtype=dtype)
+	def kernel(X, out):
+		return np.dot(_minkowski_metric(X, dtype), Y, out=out)
+	return chunked(kernel, (X, ), (len(X), Y.shape[1]), out=out,
+		chunk_size=chunk_size)
+
+def pairwise_hyperboloid_distance(X, Y, out=None, chunk_size=CHUNK_SIZE):
+	dtype = float_dtype(X, Y)
+	Y = np.ascontiguousarray(Y.T, dtype=dtype)
+	def kernel(X, out):
+		np.dot(_minkowski_metric(X, dtype), Y, out=out)
+		np.negative(out, out=out)
+		np.maximum(out, 1 + EPSILON, out=out)
+		return np.arccosh(out, out=out)
+	return chunked(kernel, (X, ), (len(X), Y.shape[1]), out=out,
+		chunk_size=chunk_size)
+
+def pairwise_poincare_distance(X, Y, out=None, chunk_size=CHUNK_SIZE):
+	dtype = float_dtype(X, Y)
+	max_norm = np.nextafter(dtype.type(1), dtype.type(0))
+	norm_Y = _squared_norm(Y.astype(dtype, copy=False), None)
+	Y = np.ascontiguousarray(Y.T, dtype=dtype)
+	def kernel(X, out):
+		X = X.astype(dtype, copy=False)
+		norm_X = _squared_norm(X, None)
+		# |x - y|^2 = |x|^2 + |y|^2 - 2 x.y
+		np.dot(X, Y, out=out)
+		out *= -2
+		out += norm_X[:,None]
+		out += norm_Y
+		np.maximum(out, 0, out=out)
+		out *= 2
+		out /= (1 - np.minimum(norm_X, max_norm))[:,None]
+		out /= 1 - np.minimum(norm_Y, max_norm)
+		out += 1
+		return np.arccosh(out, out=out)
+	return chunked(kernel, (X, ), (len(X), Y.shape[1]), out=out,
+		chunk_size=chunk_size)
+
+def _project_onto_tangent_space(p, x, out):
+	np.multiply(_minkowski_dot(p, x, None)[...,None], p, out=out)
+	out += x
+	return out
+
+def project_onto_tangent_space(p, x, out=None, chunk_size=CHUNK_SIZE):
+	'''
+	project the ambient vector x onto the tangent space at p
+	'''
+	return chunked(_project_onto_tangent_space, (p, x),
+		_broadcast_shape(p, x, last=x.shape[-1]), out=out,
+		chunk_size=chunk_size)
+
+def _normalise_to_hyperboloid(x, out):
+	norm = np.sqrt(np.abs(_minkowski_dot(x, x, None)))
+	return np.divide(x, norm[...,None], out=out)
+
+def normalise_to_hyperboloid(x, out=None, chunk_size=CHUNK_SIZE):
+	return chunked(_normalise_to_hyperboloid, (x, ), x.shape, out=out,
+		chunk_size=chunk_size)
+
+def _exponential_map(p, x, out):
+	r = np.sqrt(np.maximum(_minkowski_dot(x, x, None), 0))[...,None]
+	non_zero_norm = r > 0
+	scale = np.sinh(r, where=non_zero_norm, out=np.zeros_like(r))
+	np.divide(scale, r, where=non_zero_norm, out=scale)
+	np.multiply(np.cosh(r), p, out=out)
+	out += scale * x
+	# account for floating point imprecision
+	return _normalise_to_hyperboloid(out, out)
+
+def exponential_map(p, x, out=None, chunk_size=CHUNK_SIZE):
+	'''
+	map the tangent vector x at p onto the hyperboloid
+	'''
+	return chunked(_exponential_map, (p, x),
+		_broadcast_shape(p, x, last=x.shape[-1]), out=out,
+		chunk_size=chunk_size)
+
+def _logarithmic_map(p, x, out):
+	alpha = np.maximum(-_minkowski_dot(p, x, None), 1 + EPSILON)[...,None]
+	np.multiply(alpha, p, out=out)
+	np.subtract(x, out, out=out)
+	out *= np.arccosh(alpha) / np.sqrt(alpha ** 2 - 1)
+	return out
+
+def logarithmic_map(p, x, out=None, chunk_size=CHUNK_SIZE):
+	'''
+	tangent vector at p pointing to x
+	'''
+	return chunked(_logarithmic_map, (p, x),
+		_broadcast_shape(p, x, last=x.shape[-1]), out=out,
+		chunk_size=chunk_size)
+
+def _parallel_transport(p, q, x, out):
+	alpha = -_minkowski_dot(p, q, None)[...,None]
+	scale = _minkowski_dot(q - alpha * p, x, None)[...,None] / (alpha + 1)
+	np.add(p, q, out=out)
+	out *= scale
+	out += x
+	return out
+
+def parallel_transport(p, q, x, out=None, chunk_size=CHUNK_SIZE):
+	'''
+	transport the tangent vector x at p to the tangent space at q
+	'''
+	assert len(p.shape) == len(q.shape) == len(x.shape)
+	return chunked(_parallel_transport, (p, q, x),
+		_broadcast_shape(p, q, x, last=x.shape[-1]), out=out,
+		chunk_size=chunk_size)
+
+def _hyperboloid_to_poincare_ball(X, out):
+	return np.divide(X[...,:-1], 1 + X[...,-1:], out=out)
+
+def hyperboloid_to_poincare_ball(X, out=None, chunk_size=CHUNK_SIZE):
+	return chunked(_hyperboloid_to_poincare_ball, (X, ),
+		X.shape[:-1] + (X.shape[-1] - 1, ), out=out, chunk_size=chunk_size)
+
+def _hyperboloid_to_klein(X, out):
+	return np.divide(X[...,:-1], X[...,-1:], out=out)
+
+def hyperboloid_to_klein(X, out=None, chunk_size=CHUNK_SIZE):
+	return chunked(_hyperboloid_to_klein, (X, ),
+		X.shape[:-1] + (X.shape[-1] - 1, ), out=out, chunk_size=chunk_size)
+
+def _poincare_ball_to_klein(X, out):
+	norm = _squared_norm(X, None)[...,None]
+	return np.multiply(2 / (1 + norm), X, out=out)
+
+def poincare_ball_to_klein(X, out=None, chunk_size=CHUNK_SIZE):
+	return chunked(_poincare_ball_to_klein, (X, ), X.shape, out=out,
+		chunk_size=chunk_size)
+
+def _klein_to_poincare_ball(X, out):
+	norm = _squared_norm(X, None)[...,None]
+	return np.divide(X, 1 + np.sqrt(np.maximum(1 - norm, 0)), out=out)
+
+def klein_to_poincare_ball(X, out=None, chunk_size=CHUNK_SIZE):
+	return chunked(_klein_to_poincare_ball, (X, ), X.shape, out=out,
+		chunk_size=chunk_size)
+
+def _poincare_ball_to_hyperboloid(X, out):
+	norm = _squared_norm(X, None)[...,None]
+	np.multiply(2, X, out=out[...,:-1])
+	np.add(1, norm, out=out[...,-1:])
+	out /= 1 - norm
+	return out
+
+def poincare_ball_to_hyperboloid(X, out=None, chunk_size=CHUNK_SIZE):
+	return chunked(_poincare_ball_to_hyperboloid, (X, ),
+		X.shape[:-1] + (X.shape[-1] + 1, ), out=out, chunk_size=chunk_size)
+
+def _klein_to_hyperboloid(X, out):
+	norm = _squared_norm(X, None)[...,None]
+	out[...,:-1] = X
+	out[...,-1:] = 1
+	out /= np.sqrt(1 - norm)
+	return out
+
+def klein_to_hyperboloid(X, out=None, chunk_size=CHUNK_SIZE):
+	return chunked(_klein_to_hyperboloid, (X, ),
+		X.shape[:-1] + (X.shape[-1] + 1, ), out=out, chunk_size=chunk_size)
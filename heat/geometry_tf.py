@@ -0,0 +1,92 @@
+'''
+TF counterparts of the kernels in heat.geometry, with the same names and
+arguments (out= and chunk_size= are not needed for tensors and are not
+accepted).
+'''
+
+import tensorflow as tf
+import keras.backend as K
+
+def minkowski_dot(x, y, keepdims=True):
+	assert len(x.shape) == len(y.shape)
+	return K.sum(x[...,:-1] * y[...,:-1], axis=-1, keepdims=keepdims) - \
+		(x[...,-1:] * y[...,-1:] if keepdims else x[...,-1] * y[...,-1])
+
+def minkowski_norm_squared(x, keepdims=True):
+	return minkowski_dot(x, x, keepdims=keepdims)
+
+def hyperboloid_distance(u, v):
+	mink_dp = -minkowski_dot(u, v, keepdims=False)
+	return tf.acosh(K.maximum(mink_dp, 1. + K.epsilon()))
+
+def poincare_distance(u, v):
+	max_norm = 1. - K.epsilon()
+	norm_u = 1. - K.minimum(K.sum(K.square(u), axis=-1), max_norm)
+	norm_v = 1. - K.minimum(K.sum(K.square(v), axis=-1), max_norm)
+	uu = K.sum(K.square(u - v), axis=-1)
+	return tf.acosh(1. + 2. * uu / (norm_u * norm_v))
+
+def minkowski_metric(X):
+	return K.concatenate([X[...,:-1], -X[...,-1:]], axis=-1)
+
+def pairwise_minkowski_dot(X, Y):
+	return K.dot(minkowski_metric(X), K.transpose(Y))
+
+def pairwise_hyperboloid_distance(X, Y):
+	return tf.acosh(K.maximum(-pairwise_minkowski_dot(X, Y),
+		1. + K.epsilon()))
+
+def pairwise_poincare_distance(X, Y):
+	max_norm = 1. - K.epsilon()
+	norm_X = K.sum(K.square(X), axis=-1, keepdims=True)
+	norm_Y = K.sum(K.square(Y), axis=-1, keepdims=True)
+	uu = K.relu(norm_X + K.transpose(norm_Y) - 2. * K.dot(X, K.transpose(Y)))
+	return tf.acosh(1. + 2. * uu / ((1. - K.minimum(norm_X, max_norm)) *
+		K.transpose(1. - K.minimum(norm_Y, max_norm))))
+
+def project_onto_tangent_space(p, x):
+	return x + minkowski_dot(p, x) * p
+
+def normalise_to_hyperboloid(x):
+	return x / K.sqrt(K.abs(minkowski_dot(x, x)))
+
+def exponential_map(p, x):
+	r = K.sqrt(K.relu(minkowski_dot(x, x)))
+	non_zero_norm = r > 0.
+	# avoid 0 / 0 where x is zero, the sinh term vanishes there
+	safe_r = tf.where(non_zero_norm, r, K.ones_like(r))
+	scale = tf.where(non_zero_norm, tf.sinh(safe_r) / safe_r,
+		K.zeros_like(r))
+	exp_map = tf.cosh(r) * p + scale * x
+	# account for floating point imprecision
+	return normalise_to_hyperboloid(exp_map)
+
+def logarithmic_map(p, x):
+	alpha = K.maximum(-minkowski_dot(p, x), 1. + K.epsilon())
+	return tf.acosh(alpha) * (x - alpha * p) / K.sqrt(alpha ** 2 - 1.)
+
+def parallel_transport(p, q, x):
+	alpha = -minkowski_dot(p, q)
+	return x + minkowski_dot(q - alpha * p, x) * (p + q) / (alpha + 1.)
+
+def hyperboloid_to_poincare_ball(X):
+	return X[...,:-1] / (1. + X[...,-1:])
+
+def hyperboloid_to_klein(X):
+	return X[...,:-1] / X[...,-1:]
+
+def poincare_ball_to_klein(X):
+	return 2. / (1. + K.sum(K.square(X), axis=-1, keepdims=True)) * X
+
+def klein_to_poincare_ball(X):
+	norm = K.sum(K.square(X), axis=-1, keepdims=True)
+	return X / (1. + K.sqrt(K.relu(1. - norm)))
+
+def poincare_ball_to_hyperboloid(X):
+	norm = K.sum(K.square(X), axis=-1, keepdims=True)
+	return K.concatenate([2. * X, 1. + norm], axis=-1) / (1. - norm)
+
+def klein_to_hyperboloid(X):
+	norm = K.sum(K.square(X), axis=-1, keepdims=True)
+	return K.concatenate([X, K.ones_like(X[...,:1])], axis=-1) / \
+		K.sqrt(1. - norm)
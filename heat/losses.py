@@ -1,16 +1,14 @@
-import numpy as np
 import tensorflow as tf 
 import keras.backend as K
 
-def minkowski_dot(x, y):
-    assert len(x.shape) == len(y.shape)
-    return K.sum(x[..., :-1] * y[..., :-1], axis=-1) \
-        -  x[..., -1] * y[..., -1]
-    # axes = len(x.shape) - 1, len(y.shape) -1
-    # return K.batch_dot(x[...,:-1], y[...,:-1], axes=axes) \
-    #     - K.batch_dot(x[...,-1:], y[...,-1:], axes=axes)
+from heat.geometry_tf import minkowski_dot
 
-def hyperbolic_softmax_loss(sigma=1.):
+def hyperbolic_softmax_loss(sigma=1., num_replicas=1):
+    '''
+    a batch of num_replicas stacked embeddings holds a batch of every
+    replica, scaling the mean by num_replicas gives every replica the
+    gradient it would have if trained on its own
+    '''
 
     def loss(y_true, y_pred, sigma=sigma):
 
@@ -19,13 +17,14 @@ def hyperbolic_softmax_loss(sigma=1.):
         
         inner_uv = - minkowski_dot(
             source_node_embedding, 
-            target_nodes_embedding) 
+            target_nodes_embedding,
+            keepdims=False) 
         inner_uv = K.maximum(inner_uv, 1. + K.epsilon())
 
         d_uv = tf.acosh(inner_uv) 
         minus_d_uv_sq = - 0.5 * K.square(d_uv / sigma)
 
-        return K.mean(
+        return num_replicas * K.mean(
             tf.nn.sparse_softmax_cross_entropy_with_logits(
                 labels=y_true[:,0,0], 
                 logits=minus_d_uv_sq)) 
@@ -1,6 +1,3 @@
-import os
-import glob
-
 import tensorflow as tf
 
 from keras.layers import Input, Layer
@@ -8,18 +5,12 @@ from keras.models import Model
 
 import keras.backend as K
 
-from heat.utils import load_embedding
+from heat.checkpoint import restore_latest
+from heat.geometry_tf import poincare_ball_to_hyperboloid
 
 
 def hyperboloid_initializer(shape, r_max=1e-3, dtype=K.floatx()):
 
-	def poincare_ball_to_hyperboloid(X, append_t=True):
-		x = 2 * X
-		t = 1. + K.sum(K.square(X), axis=-1, keepdims=True)
-		if append_t:
-			x = K.concatenate([x, t], axis=-1)
-		return 1 / (1. - K.sum(K.square(X), axis=-1, keepdims=True)) * x
-
 	w = tf.random_uniform(shape=shape, minval=-r_max, 
 		maxval=r_max, dtype=dtype)
 	return poincare_ball_to_hyperboloid(w)
@@ -71,17 +62,13 @@ def build_model(num_nodes, args):
 
 def load_weights(model, args):
 
-	previous_models = sorted(glob.iglob(
-		os.path.join(args.embedding_path, "*.csv.gz")))
-	if len(previous_models) > 0:
-		model_file = previous_models[-1]
-		initial_epoch = int(model_file.split("/")[-1].split("_")[0])
-		print ("previous models found in directory -- loading from file {} and resuming from epoch {}".format(model_file, initial_epoch))
-		embedding_df = load_embedding(model_file)
-		embedding = embedding_df.reindex(sorted(embedding_df.index)).values
+	embedding, initial_epoch, initial_step = restore_latest(args.embedding_path)
+	if embedding is not None:
+		print ("previous models found in directory -- resuming from epoch {} step {}".format(initial_epoch, initial_step))
 		model.layers[1].set_weights([embedding])
 	else:
 		print ("no previous model found in {}".format(args.embedding_path))
 		initial_epoch = 0
+		initial_step = 0
 
-	return model, initial_epoch
+	return model, initial_epoch, initial_step
@@ -0,0 +1,279 @@
+'''
+Nearest neighbour index over an embedding.
+
+The points are split recursively into leaves of at most leaf_size points,
+every split sending half of the points to the closer of two distant
+pivots. Every leaf keeps a centre and the distance from it to its
+furthest point, so by the triangle inequality no point of the leaf is
+closer to a query q than d(q, centre) - radius. Any metric works:
+hyperboloid and Poincare ball embeddings use the exact hyperbolic
+distance (Poincare ball points are mapped onto the hyperboloid, which
+preserves distances) and euclidean embeddings the euclidean distance.
+
+Queries are answered in batches. Every query scans its leaves in order
+of distance to their centre, all queries at once in rounds of doubling
+numbers of leaves, skipping leaves whose bound exceeds the distance of
+its current k-th neighbour and stopping once every remaining leaf does,
+so results are exact. Queries that are still open after scanning an
+eighth of the leaves (the bounds prune little in high dimensions) are
+finished by comparing against every point. With max_visits a query scans
+at most that many leaves, trading recall for time.
+'''
+
+from __future__ import print_function
+
+import os
+
+import numpy as np
+
+from .geometry import (poincare_ball_to_hyperboloid, normalise_to_hyperboloid,
+	hyperboloid_distance, pairwise_hyperboloid_distance)
+
+METRICS = ("hyperboloid", "poincare", "euclidean")
+
+# arrays that make up a saved index
+INDEX_ARRAYS = ("points", "index", "offsets", "centres", "radii")
+
+# maximum number of candidate points gathered in one round of a batch
+SCAN_ELEMENTS = 2 ** 21
+
+def pairwise_euclidean_distance(X, Y):
+	sq_dist = np.sum(X ** 2, axis=-1, keepdims=True) + \
+		np.sum(Y ** 2, axis=-1) - \
+		2 * X.dot(np.ascontiguousarray(Y.T))
+	return np.sqrt(np.maximum(sq_dist, 0, out=sq_dist), out=sq_dist)
+
+class NeighbourIndex(object):
+
+	def __init__(self, embedding, dist_fn="hyperboloid", leaf_size=64,
+		seed=0):
+		assert dist_fn in METRICS, \
+			"{} is not a metric, choose one of {}".format(dist_fn, METRICS)
+		self.dist_fn = dist_fn
+		self.leaf_size = leaf_size
+		self.points = self.to_metric_space(embedding)
+		self.build(np.random.RandomState(seed))
+
+	@classmethod
+	def from_arrays(cls, dist_fn, leaf_size, **arrays):
+		index = cls.__new__(cls)
+		index.dist_fn = dist_fn
+		index.leaf_size = leaf_size
+		for name in INDEX_ARRAYS:
+			setattr(index, name, arrays[name])
+		return index
+
+	def __len__(self):
+		return len(self.points)
+
+	@property
+	def num_leaves(self):
+		return len(self.offsets) - 1
+
+	def to_metric_space(self, X):
+		X = np.asarray(X, dtype=np.float64)
+		if self.dist_fn == "poincare":
+			return poincare_ball_to_hyperboloid(X)
+		return X
+
+	def distance(self, X, Y):
+		'''
+		(len(X), len(Y)) distances between points in metric space
+		'''
+		if self.dist_fn == "euclidean":
+			return pairwise_euclidean_distance(X, Y)
+		return pairwise_hyperboloid_distance(X, Y)
+
+	def paired_distance(self, X, Y):
+		if self.dist_fn == "euclidean":
+			return np.linalg.norm(X - Y, axis=-1)
+		return hyperboloid_distance(X, Y)
+
+	def build(self, rng):
+		N = len(self.points)
+		index = np.arange(N)
+		leaves = []
+		stack = [(0, N)]
+		while stack:
+			lo, hi = stack.pop()
+			if hi - lo <= self.leaf_size:
+				leaves.append(lo)
+				continue
+			points = index[lo:hi]
+			a, b = self.choose_pivots(points, rng)
+			d = self.distance(self.points[[a, b]], self.points[points])
+			median = (hi - lo) // 2
+			index[lo:hi] = points[np.argpartition(d[0] - d[1], median)]
+			stack.extend(((lo + median, hi), (lo, lo + median)))
+
+		self.index = index
+		self.offsets = np.array(sorted(leaves) + [N], dtype=np.int64)
+		self.set_bounds()
+
+	def choose_pivots(self, points, rng, sample_size=1000):
+		'''
+		two distant points: the furthest point from a random point and
+		the furthest point from that, searched in a sample of points
+		'''
+		sample = points if len(points) <= sample_size else \
+			rng.choice(points, size=sample_size, replace=False)
+		a = sample[np.argmax(self.distance(self.points[[rng.choice(sample)]],
+			self.points[sample])[0])]
+		b = sample[np.argmax(self.distance(self.points[[a]],
+			self.points[sample])[0])]
+		return a, b
+
+	def set_bounds(self):
+		'''
+		centre of every leaf (the normalised mean on the hyperboloid) and
+		the distance from it to the furthest point of the leaf
+		'''
+		sizes = np.diff(self.offsets)
+		leaf = np.repeat(np.arange(self.num_leaves), sizes)
+		points = self.points[self.index]
+		centres = np.add.reduceat(points, self.offsets[:-1], axis=0) / \
+			sizes[:, None]
+		if self.dist_fn != "euclidean":
+			centres = normalise_to_hyperboloid(centres)
+		radii = np.zeros(self.num_leaves)
+		np.maximum.at(radii, leaf, self.paired_distance(points, centres[leaf]))
+		self.centres = centres
+		self.radii = radii
+
+	def leaf_table(self):
+		'''
+		(num_leaves, leaf_size) indices of the points of every leaf,
+		padded with -1
+		'''
+		if getattr(self, "_leaf_table", None) is None:
+			sizes = np.diff(self.offsets)
+			slots = np.arange(sizes.max())
+			table = self.index[np.minimum(self.offsets[:-1, None] + slots,
+				len(self) - 1)]
+			table[slots >= sizes[:, None]] = -1
+			self._leaf_table = table
+		return self._leaf_table
+
+	def query(self, queries, k=10, max_visits=None, batch_size=1024):
+		'''
+		the k nearest indexed points of every row of queries (in the
+		coordinates of the embedding). returns (indices, distances), both
+		of shape (len(queries), k) and sorted by distance
+		'''
+		queries = self.to_metric_space(queries)
+		k = min(k, len(self))
+		indices = np.full((len(queries), k), -1, dtype=np.int64)
+		distances = np.full((len(queries), k), np.inf)
+		for start in range(0, len(queries), batch_size):
+			batch = slice(start, start + batch_size)
+			indices[batch], distances[batch] = self.query_batch(
+				queries[batch], k, max_visits)
+		return indices, distances
+
+	def query_batch(self, queries, k, max_visits):
+		table = self.leaf_table()
+		indices = np.full((len(queries), k), -1, dtype=np.int64)
+		distances = np.full((len(queries), k), np.inf)
+
+		centre_distances = self.distance(queries, self.centres)
+		order = np.argsort(centre_distances, axis=1)
+		lower_bounds = np.take_along_axis(centre_distances - self.radii,
+			order, axis=1)
+		# smallest bound of the leaves not scanned yet
+		remaining_bounds = np.minimum.accumulate(lower_bounds[:, ::-1],
+			axis=1)[:, ::-1]
+		num_visits = self.num_leaves if max_visits is None \
+			else min(max_visits, self.num_leaves)
+
+		active = np.arange(len(queries))
+		# number of leaves scanned by every query
+		scanned_leaves = np.zeros(len(queries), dtype=np.int64)
+		start = 0
+		width = 1
+		while start < num_visits:
+			active = active[remaining_bounds[active, start] <
+				distances[active, -1]]
+			if max_visits is None:
+				# the bounds hardly prune for these queries, comparing them
+				# against every point is cheaper
+				exhausted = scanned_leaves[active] >= self.num_leaves // 8
+				self.scan_all(queries, active[exhausted], indices, distances)
+				active = active[~exhausted]
+			if len(active) == 0:
+				break
+			width = max(1, min(width, num_visits - start,
+				SCAN_ELEMENTS // (len(active) * table.shape[1])))
+			window = slice(start, start + width)
+			skip = lower_bounds[active, window] >= distances[active, -1:]
+			# move the leaves to scan to the front and drop the columns
+			# that every query skips
+			front = np.argsort(skip, axis=1, kind="mergesort")
+			num_columns = max(1, (~skip).sum(axis=1).max())
+			front = front[:, :num_columns]
+			leaves = np.take_along_axis(order[active, window], front, axis=1)
+			skip = np.take_along_axis(skip, front, axis=1)
+			scanned_leaves[active] += (~skip).sum(axis=1)
+			start += width
+			width *= 2
+
+			rows, columns = np.nonzero(~skip)
+			scanned = table[leaves[rows, columns]]
+			padding = scanned < 0
+			d = np.full(leaves.shape + (table.shape[1], ), np.inf)
+			d[rows, columns] = np.where(padding, np.inf,
+				self.paired_distance(queries[active[rows], None],
+				self.points[np.where(padding, 0, scanned)]))
+			d = d.reshape(len(active), -1)
+			candidates = table[leaves].reshape(len(active), -1)
+
+			d = np.concatenate([distances[active], d], axis=1)
+			candidates = np.concatenate([indices[active], candidates], axis=1)
+			best = np.argpartition(d, k - 1, axis=1)[:, :k]
+			d = np.take_along_axis(d, best, axis=1)
+			candidates = np.take_along_axis(candidates, best, axis=1)
+			best = np.argsort(d, axis=1, kind="mergesort")
+			distances[active] = np.take_along_axis(d, best, axis=1)
+			indices[active] = np.take_along_axis(candidates, best, axis=1)
+
+		return indices, distances
+
+	def scan_all(self, queries, active, indices, distances):
+		'''
+		exact neighbours of queries[active] by comparing against every point
+		'''
+		k = indices.shape[1]
+		block_size = max(1, SCAN_ELEMENTS // len(self))
+		for start in range(0, len(active), block_size):
+			block = active[start:start + block_size]
+			d = self.distance(queries[block], self.points)
+			best = np.argpartition(d, k - 1, axis=1)[:, :k]
+			d = np.take_along_axis(d, best, axis=1)
+			order = np.argsort(d, axis=1, kind="mergesort")
+			distances[block] = np.take_along_axis(d, order, axis=1)
+			indices[block] = np.take_along_axis(best, order, axis=1)
+
+	def save(self, filename, **metadata):
+		'''
+		write the index to filename (.npz) via a temporary file, metadata
+		is stored alongside as strings
+		'''
+		temporary_filename = filename + ".tmp"
+		with open(temporary_filename, "wb") as f:
+			np.savez(f, dist_fn=np.array(self.dist_fn),
+				leaf_size=np.array(self.leaf_size),
+				**dict([(name, getattr(self, name)) for name in INDEX_ARRAYS] +
+					[("metadata_" + key, np.array(str(value)))
+					for key, value in metadata.items()]))
+		os.replace(temporary_filename, filename)
+
+def load_neighbour_index(filename):
+	'''
+	returns the index saved in filename and its metadata
+	'''
+	with np.load(filename) as f:
+		arrays = {name: f[name] for name in INDEX_ARRAYS}
+		metadata = {name[len("metadata_"):]: str(f[name])
+			for name in f.files if name.startswith("metadata_")}
+		index = NeighbourIndex.from_arrays(str(f["dist_fn"]),
+			int(f["leaf_size"]), **arrays)
+	return index, metadata
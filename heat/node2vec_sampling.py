@@ -3,12 +3,10 @@ Source: https://github.com/aditya-grover/node2vec/blob/master/src/node2vec.py
 '''
 
 import numpy as np
-import scipy as sp
 import networkx as nx
 import random
 
 import functools
-from multiprocessing.pool import Pool
 
 class Graph():
 	def __init__(self, 
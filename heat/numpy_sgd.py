@@ -0,0 +1,146 @@
+'''
+NumPy counterparts of the hyperbolic softmax loss in heat.losses and the
+sparse update of heat.optimizers.RiemannianOptimizer. Used by training
+modes that do not keep the whole embedding inside a TF variable.
+'''
+
+import numpy as np
+
+from .geometry import (minkowski_dot, project_onto_tangent_space,
+	exponential_map, poincare_ball_to_hyperboloid)
+
+def initialise_embedding(num_nodes, embedding_dim, r_max=1e-3):
+	'''
+	same initialisation as heat.models.hyperboloid_initializer
+	'''
+	w = np.random.uniform(-r_max, r_max,
+		size=(num_nodes, embedding_dim + 1))
+	return poincare_ball_to_hyperboloid(w)
+
+def hyperbolic_softmax_loss_and_grad(source, targets,
+	sigma=1., epsilon=1e-15):
+	'''
+	source: (batch, 1, d+1) embedding of source nodes
+	targets: (batch, 1+num_negative_samples, d+1) positive sample
+	followed by the negative samples
+	returns the mean loss over the batch and the (euclidean) gradients
+	with respect to source and targets
+	'''
+	batch_size = source.shape[0]
+
+	inner_uv = -minkowski_dot(source, targets)[...,0]
+	clipped = inner_uv <= 1. + epsilon
+	inner_uv = np.maximum(inner_uv, 1. + epsilon)
+
+	d_uv = np.arccosh(inner_uv)
+	logits = -0.5 * np.square(d_uv / sigma)
+
+	logits_max = logits.max(axis=-1, keepdims=True)
+	exp_logits = np.exp(logits - logits_max)
+	sum_exp_logits = exp_logits.sum(axis=-1, keepdims=True)
+	log_softmax = logits - logits_max - np.log(sum_exp_logits)
+	loss = -log_softmax[:,0].mean()
+
+	# d loss / d inner_uv
+	grad_logits = exp_logits / sum_exp_logits
+	grad_logits[:,0] -= 1.
+	grad_inner_uv = grad_logits * -d_uv / sigma ** 2 / \
+		np.sqrt(inner_uv ** 2 - 1)
+	grad_inner_uv[clipped] = 0
+	grad_inner_uv /= batch_size
+
+	# d inner_uv / d u = - M v, where M = diag(1, ..., 1, -1)
+	source_M = np.concatenate([source[...,:-1], -source[...,-1:]],
+		axis=-1)
+	targets_M = np.concatenate([targets[...,:-1], -targets[...,-1:]],
+		axis=-1)
+
+	source_grad = -np.sum(grad_inner_uv[...,None] * targets_M,
+		axis=1, keepdims=True)
+	targets_grad = -grad_inner_uv[...,None] * source_M
+
+	return loss, source_grad, targets_grad
+
+def aggregate_gradient(idx, grad):
+	'''
+	sum gradients of repeated indices, as tf does for IndexedSlices
+	before calling _apply_sparse
+	'''
+	idx = idx.reshape(-1)
+	grad = grad.reshape(len(idx), -1)
+	unique_idx, inverse = np.unique(idx, return_inverse=True)
+	unique_grad = np.zeros((len(unique_idx), grad.shape[-1]),
+		dtype=grad.dtype)
+	np.add.at(unique_grad, inverse.reshape(-1), grad)
+	return unique_idx, unique_grad
+
+def riemannian_update(points, grad, lr):
+	'''
+	points: (n, d+1) rows of the embedding
+	grad: (n, d+1) euclidean gradient of the loss for those rows
+	returns the updated rows
+	'''
+	ambient_grad = np.concatenate([grad[:,:-1], -grad[:,-1:]],
+		axis=-1)
+	tangent_grad = project_onto_tangent_space(points, ambient_grad)
+	return exponential_map(points, -lr * tangent_grad)
+
+def sgd_step(embedding, batch_nodes, lr, sigma=1.):
+	'''
+	perform one step of Riemannian SGD in place on embedding
+	(an (N, d+1) array or memmap) for batch_nodes, an array of shape
+	(batch, 2 + num_negative_samples) laid out as for the keras model
+	returns the loss of the batch and the updated rows
+	'''
+	batch_embedding = embedding[batch_nodes]
+	loss, source_grad, targets_grad = hyperbolic_softmax_loss_and_grad(
+		batch_embedding[:,:1], batch_embedding[:,1:], sigma=sigma)
+	idx, grad = aggregate_gradient(batch_nodes,
+		np.concatenate([source_grad, targets_grad], axis=1))
+	embedding[idx] = riemannian_update(embedding[idx], grad, lr)
+	return loss, idx
+
+class NegativeSampler(object):
+	'''
+	draw negative samples from the distribution of 
+	heat.utils.negative_sampling_probs, counts ** 0.75 over all nodes but
+	the source itself and, unless all_negs, its positive samples, by
+	drawing from counts ** 0.75 and redrawing excluded nodes instead of
+	searching an N x N table row by row
+	'''
+
+	def __init__(self, counts, positive_samples, all_negs=False):
+		self.num_nodes = len(counts)
+		cumulative = np.cumsum(np.asarray(counts, dtype=np.float64) ** 0.75)
+		self.cumulative = cumulative / cumulative[-1]
+		positive_samples = np.asarray(positive_samples, dtype=np.int64)
+		if all_negs or len(positive_samples) == 0:
+			self.excluded = np.zeros(0, dtype=np.int64)
+		else:
+			self.excluded = np.unique(positive_samples[:,0] * self.num_nodes
+				+ positive_samples[:,1])
+
+	def is_excluded(self, sources, negatives):
+		excluded = negatives == sources
+		if len(self.excluded) > 0:
+			keys = sources * self.num_nodes + negatives
+			idx = np.minimum(np.searchsorted(self.excluded, keys),
+				len(self.excluded) - 1)
+			excluded |= self.excluded[idx] == keys
+		return excluded
+
+	def sample(self, sources, num_negative_samples, random_state=np.random):
+		'''
+		(len(sources), num_negative_samples) negative samples
+		'''
+		sources = np.repeat(np.asarray(sources, dtype=np.int64)[:,None],
+			num_negative_samples, axis=1)
+		negatives = np.searchsorted(self.cumulative,
+			random_state.rand(*sources.shape))
+		excluded = self.is_excluded(sources, negatives)
+		while excluded.any():
+			negatives[excluded] = np.searchsorted(self.cumulative,
+				random_state.rand(excluded.sum()))
+			excluded[excluded] = self.is_excluded(sources[excluded],
+				negatives[excluded])
+		return negatives
@@ -1,13 +1,9 @@
-import keras.backend as K
 import tensorflow as tf
 from tensorflow.python.framework import ops
 from tensorflow.python.ops import math_ops, control_flow_ops
 from tensorflow.python.training import optimizer
 
-def minkowski_dot(x, y):
-	axes = len(x.shape) - 1, len(y.shape) -1
-	return K.batch_dot(x[...,:-1], y[...,:-1], axes=axes) - \
-		K.batch_dot(x[...,-1:], y[...,-1:], axes=axes)
+from heat import geometry_tf
 
 class RiemannianOptimizer(optimizer.Optimizer):
 	
@@ -64,36 +60,11 @@ class RiemannianOptimizer(optimizer.Optimizer):
 
     def project_onto_tangent_space(self, 
         hyperboloid_point, minkowski_ambient):
-        return minkowski_ambient + \
-            minkowski_dot(hyperboloid_point, minkowski_ambient) * \
-                hyperboloid_point
+        return geometry_tf.project_onto_tangent_space(
+            hyperboloid_point, minkowski_ambient)
 
     def normalise_to_hyperboloid(self, x):
-        return x / K.sqrt( K.abs(minkowski_dot(x, x)) )
+        return geometry_tf.normalise_to_hyperboloid(x)
 
     def exponential_mapping( self, p, x ):
-        r = K.sqrt( K.relu( minkowski_dot(x, x) ) ) 
-        ####################################################
-        exp_map_p = tf.cosh(r) * p
-        
-        idx = tf.cast( 
-            tf.where(r > K.cast(0., K.floatx()), )[:,0], 
-            tf.int64)
-        non_zero_norm = tf.gather(r, idx)
-        z = tf.gather(x, idx) / non_zero_norm
-
-        updates = tf.sinh(non_zero_norm) * z
-        dense_shape = tf.cast( tf.shape(p), tf.int64)
-        exp_map_x = tf.scatter_nd(indices=idx[:,None], 
-            updates=updates, shape=dense_shape)
-        
-        exp_map = exp_map_p + exp_map_x 
-        #####################################################
-        # z = x / K.maximum(norm_x, K.epsilon()) # unit norm 
-        # exp_map = tf.cosh(norm_x) * p + tf.sinh(norm_x) * z
-        #####################################################
-         
-        # account for floating point imprecision
-        exp_map = self.normalise_to_hyperboloid(exp_map)
-
-        return exp_map
\ No newline at end of file
+        return geometry_tf.exponential_map(p, x)
@@ -0,0 +1,382 @@
+'''
+Out-of-core training in the style of PyTorch-BigGraph.
+
+Nodes are split into contiguous partitions, each stored on disk as its own
+.npy shard. Positive pairs are bucketed by (partition of u, partition of v)
+and training iterates over buckets, holding at most two shards in memory.
+Negative samples for a bucket (i, j) are drawn from the nodes of partition j.
+'''
+
+from __future__ import print_function
+
+import os
+import re
+import gzip
+import json
+import glob
+import time
+
+import numpy as np
+import pandas as pd
+
+from .numpy_sgd import initialise_embedding, sgd_step
+from . import profiling
+from .checkpoint import (checkpoint_filenames, publish_checkpoint,
+	remove_old_checkpoints)
+
+def partition_bounds(num_nodes, num_partitions):
+	return np.linspace(0, num_nodes, num_partitions + 1).astype(np.int64)
+
+def pairs_from_walk(walk, context_size):
+	walk = np.asarray(walk, dtype=np.int64)
+	pairs = []
+	for j in range(1, context_size + 1):
+		if j >= len(walk):
+			break
+		u = walk[:-j]
+		v = walk[j:]
+		mask = u != v
+		pairs.append(np.stack([u[mask], v[mask]], axis=-1))
+		pairs.append(np.stack([v[mask], u[mask]], axis=-1))
+	if len(pairs) == 0:
+		return np.zeros((0, 2), dtype=np.int64)
+	return np.concatenate(pairs)
+
+class PositiveSampleBuckets(object):
+	'''
+	Positive sample pairs on disk, one raw int64 file per
+	(source partition, target partition) bucket.
+	'''
+
+	def __init__(self, directory, bounds):
+		self.directory = directory
+		self.bounds = bounds
+		self.num_partitions = len(bounds) - 1
+
+	def bucket_filename(self, i, j):
+		return os.path.join(self.directory,
+			"bucket_{:03d}_{:03d}.bin".format(i, j))
+
+	def marker_filename(self):
+		return os.path.join(self.directory, "buckets_complete")
+
+	def exists(self):
+		'''
+		buckets are only reused if they were written with the same
+		partitions
+		'''
+		if not os.path.exists(self.marker_filename()):
+			return False
+		with open(self.marker_filename(), "r") as f:
+			try:
+				marker = json.load(f)
+			except ValueError:
+				marker = None
+		if not isinstance(marker, dict) or \
+			marker.get("num_partitions") != self.num_partitions or \
+			marker.get("bounds") != [int(b) for b in self.bounds]:
+			print ("positive samples in {} were bucketed with different "
+				"partitions, rebuilding them".format(self.directory))
+			return False
+		return True
+
+	def write(self, pair_chunks):
+		'''
+		pair_chunks is an iterable of (n, 2) arrays, so that the full
+		set of positive samples never needs to be held in memory
+		'''
+		if not os.path.exists(self.directory):
+			os.makedirs(self.directory, exist_ok=True)
+		if os.path.exists(self.marker_filename()):
+			os.remove(self.marker_filename())
+		for filename in glob.iglob(os.path.join(self.directory,
+			"bucket_*.bin")):
+			os.remove(filename)
+
+		num_pairs = 0
+		for pairs in pair_chunks:
+			if len(pairs) == 0:
+				continue
+			partition_u = np.searchsorted(self.bounds, pairs[:,0],
+				side="right") - 1
+			partition_v = np.searchsorted(self.bounds, pairs[:,1],
+				side="right") - 1
+			bucket = partition_u * self.num_partitions + partition_v
+			idx = bucket.argsort(kind="mergesort")
+			pairs = pairs[idx]
+			bucket = bucket[idx]
+			unique_buckets, starts = np.unique(bucket, return_index=True)
+			ends = np.append(starts[1:], len(bucket))
+			for b, start, end in zip(unique_buckets, starts, ends):
+				i, j = divmod(b, self.num_partitions)
+				with open(self.bucket_filename(i, j), "ab") as f:
+					pairs[start:end].astype(np.int64).tofile(f)
+			num_pairs += len(pairs)
+
+		with open(self.marker_filename(), "w") as f:
+			json.dump({"num_pairs": num_pairs,
+				"num_partitions": self.num_partitions,
+				"bounds": [int(b) for b in self.bounds]}, f)
+		print ("wrote {} positive samples to {}".format(num_pairs,
+			self.directory))
+
+	def nonempty_buckets(self):
+		buckets = []
+		for filename in sorted(glob.iglob(os.path.join(self.directory,
+			"bucket_*.bin"))):
+			i, j = map(int, re.findall("[0-9]+",
+				os.path.basename(filename)))
+			buckets.append((i, j))
+		return buckets
+
+	def load(self, i, j):
+		filename = self.bucket_filename(i, j)
+		if not os.path.exists(filename) or os.path.getsize(filename) == 0:
+			return np.zeros((0, 2), dtype=np.int64)
+		return np.memmap(filename, dtype=np.int64, mode="r").reshape(-1, 2)
+
+class PartitionedEmbedding(object):
+	'''
+	Hyperboloid embedding stored as one .npy shard per node partition.
+	'''
+
+	def __init__(self, directory, num_nodes, embedding_dim, num_partitions):
+		self.directory = directory
+		self.num_nodes = num_nodes
+		self.embedding_dim = embedding_dim
+		self.num_partitions = num_partitions
+		self.bounds = partition_bounds(num_nodes, num_partitions)
+		self.metadata_filename = os.path.join(directory, "partitions.json")
+
+	def shard_filename(self, i):
+		return os.path.join(self.directory,
+			"partition_{:03d}.npy".format(i))
+
+	def partition_size(self, i):
+		return self.bounds[i + 1] - self.bounds[i]
+
+	def exists(self):
+		if not os.path.exists(self.metadata_filename):
+			return False
+		with open(self.metadata_filename, "r") as f:
+			metadata = json.load(f)
+		return (metadata["num_nodes"] == self.num_nodes
+			and metadata["embedding_dim"] == self.embedding_dim
+			and metadata["num_partitions"] == self.num_partitions)
+
+	@property
+	def epoch(self):
+		with open(self.metadata_filename, "r") as f:
+			return json.load(f)["epoch"]
+
+	def set_epoch(self, epoch):
+		with open(self.metadata_filename + ".tmp", "w") as f:
+			json.dump({"num_nodes": self.num_nodes,
+				"embedding_dim": self.embedding_dim,
+				"num_partitions": self.num_partitions,
+				"epoch": epoch}, f)
+		os.replace(self.metadata_filename + ".tmp", self.metadata_filename)
+
+	def initialise(self, r_max=1e-3):
+		if not os.path.exists(self.directory):
+			os.makedirs(self.directory, exist_ok=True)
+		for i in range(self.num_partitions):
+			self.save_shard(i, initialise_embedding(
+				self.partition_size(i), self.embedding_dim, r_max=r_max))
+		self.set_epoch(0)
+
+	def load_shard(self, i):
+		return np.load(self.shard_filename(i))
+
+	def save_shard(self, i, shard):
+		filename = self.shard_filename(i)
+		with open(filename + ".tmp", "wb") as f:
+			np.save(f, shard)
+		os.replace(filename + ".tmp", filename)
+
+	def write_checkpoint(self, directory, epoch, export_csv=False):
+		'''
+		write a checkpoint in the format of heat.checkpoint, one shard
+		at a time
+		'''
+		filename, _, csv_filename = checkpoint_filenames(directory, epoch)
+		print ("saving current embedding to {}".format(filename))
+		with profiling.stage("checkpoint_write", items=self.num_nodes):
+			temporary_filename = filename + ".tmp"
+			checkpoint = None
+			for i in range(self.num_partitions):
+				shard = np.load(self.shard_filename(i), mmap_mode="r")
+				if checkpoint is None:
+					checkpoint = np.lib.format.open_memmap(temporary_filename,
+						mode="w+", dtype=shard.dtype,
+						shape=(self.num_nodes, shard.shape[1]))
+				checkpoint[self.bounds[i]:self.bounds[i+1]] = shard
+			checkpoint.flush()
+			del checkpoint
+			publish_checkpoint(directory, epoch, temporary_filename)
+		if export_csv:
+			print ("exporting embedding to {}".format(csv_filename))
+			self.to_csv(csv_filename)
+		return filename
+
+	def to_csv(self, filename):
+		'''
+		write the embedding in the format of heat.callbacks.Checkpointer,
+		one shard at a time
+		'''
+		with gzip.open(filename, "wt") as f:
+			for i in range(self.num_partitions):
+				shard = np.load(self.shard_filename(i), mmap_mode="r")
+				shard_df = pd.DataFrame(np.asarray(shard),
+					index=range(self.bounds[i], self.bounds[i+1]))
+				shard_df.to_csv(f, header=i == 0)
+
+def walk_pair_chunks(walks, context_size, chunk_size=10000):
+	chunk = []
+	for walk in walks:
+		chunk.append(pairs_from_walk(walk, context_size))
+		if len(chunk) == chunk_size:
+			yield np.concatenate(chunk)
+			chunk = []
+	if len(chunk) > 0:
+		yield np.concatenate(chunk)
+
+def determine_positive_sample_buckets(graph, features, buckets, args):
+	'''
+	bucket the positive samples on disk and return the node counts used
+	to build the negative sampling distribution
+	'''
+	from .utils import perform_walks
+
+	graph = graph.to_undirected() # we perform walks on undirected matrix
+	N = len(graph)
+
+	if args.no_walks:
+		counts = np.array([graph.degree(u)
+			for u in sorted(graph)], dtype=np.float64)
+		if not buckets.exists():
+			edges = np.array(list(graph.edges()), dtype=np.int64)
+			buckets.write([edges, edges[:,::-1]])
+	else:
+		counts_filename = os.path.join(buckets.directory, "counts.npy")
+		if buckets.exists() and os.path.exists(counts_filename):
+			print ("loading bucketed positive samples from {}".format(
+				buckets.directory))
+			return np.load(counts_filename)
+
+		print ("determining positive samples using random walks")
+		walks = perform_walks(graph, features, args)
+		counts = np.zeros(N)
+		def count_walks(walks):
+			for walk in walks:
+				np.add.at(counts, walk, 1)
+				yield walk
+		buckets.write(walk_pair_chunks(count_walks(walks),
+			args.context_size))
+		np.save(counts_filename, counts)
+
+	return counts
+
+def train_partitioned(graph, features, args):
+
+	num_nodes = len(graph)
+	num_partitions = args.num_partitions
+	partition_dir = args.partition_dir
+
+	embedding = PartitionedEmbedding(partition_dir,
+		num_nodes,
+		args.embedding_dim,
+		num_partitions)
+	if embedding.exists():
+		initial_epoch = embedding.epoch
+		print ("found partitioned embedding in {} -- resuming from epoch {}".format(
+			partition_dir, initial_epoch))
+	else:
+		print ("initialising {} partitions in {}".format(num_partitions,
+			partition_dir))
+		embedding.initialise()
+		initial_epoch = 0
+
+	buckets = PositiveSampleBuckets(
+		os.path.join(partition_dir, "buckets"),
+		embedding.bounds)
+	counts = determine_positive_sample_buckets(graph,
+		features, buckets, args)
+	del graph, features
+
+	negative_probs = counts ** 0.75
+	num_negative_samples = args.num_negative_samples
+	batch_size = args.batch_size
+
+	for epoch in range(initial_epoch, args.num_epochs):
+
+		bucket_order = buckets.nonempty_buckets()
+		np.random.shuffle(bucket_order)
+
+		epoch_start_time = time.time()
+		epoch_loss = 0.
+		num_batches = 0
+		num_samples = 0
+
+		for bucket_num, (i, j) in enumerate(bucket_order):
+
+			lo_i, hi_i = embedding.bounds[i], embedding.bounds[i+1]
+			lo_j, hi_j = embedding.bounds[j], embedding.bounds[j+1]
+
+			# only the two shards of the bucket are held in memory
+			shard_i = embedding.load_shard(i)
+			if i == j:
+				table = shard_i
+				offset_j = -lo_j
+			else:
+				table = np.concatenate([shard_i,
+					embedding.load_shard(j)])
+				offset_j = hi_i - lo_i - lo_j
+			del shard_i
+
+			pairs = np.asarray(buckets.load(i, j))
+			pairs = pairs[np.random.permutation(len(pairs))]
+
+			probs = negative_probs[lo_j:hi_j]
+			if not (probs > 0).any():
+				probs = np.ones_like(probs)
+			probs = (probs / probs.sum()).cumsum()
+
+			for start in range(0, len(pairs), batch_size):
+				batch_pairs = pairs[start:start+batch_size]
+				batch_negatives = np.searchsorted(probs,
+					np.random.rand(len(batch_pairs),
+						num_negative_samples) * probs[-1])
+				batch_negatives = np.minimum(batch_negatives,
+					hi_j - lo_j - 1)
+				batch_nodes = np.concatenate([
+					batch_pairs[:,:1] - lo_i,
+					batch_pairs[:,1:] + offset_j,
+					batch_negatives + lo_j + offset_j], axis=1)
+				loss, _ = sgd_step(table, batch_nodes,
+					lr=args.lr, sigma=args.sigma)
+				epoch_loss += loss
+				num_batches += 1
+				num_samples += len(batch_pairs)
+
+			embedding.save_shard(i, table[:hi_i-lo_i])
+			if i != j:
+				embedding.save_shard(j, table[hi_i-lo_i:])
+			del table
+
+			if args.verbose:
+				print ("epoch {} completed bucket {}/{} ({}, {})".format(
+					epoch + 1, bucket_num + 1, len(bucket_order), i, j))
+
+		embedding.set_epoch(epoch + 1)
+		print ("\nEpoch {} complete -- loss={}".format(epoch + 1,
+			epoch_loss / max(num_batches, 1)))
+		profiling.record("epoch", time.time() - epoch_start_time,
+			items=num_samples, epoch=epoch + 1, steps=num_batches,
+			loss=epoch_loss / max(num_batches, 1))
+
+		embedding.write_checkpoint(args.embedding_path, epoch + 1,
+			export_csv=args.export_csv)
+		remove_old_checkpoints(args.embedding_path)
+
+	return embedding
@@ -0,0 +1,380 @@
+'''
+DAG runner for experiment pipelines.
+
+A Task is a command with input files, output files and dependencies on
+other tasks. A task is fresh, and skipped, when a stamp written after its
+last successful run still matches the hash of its command, the content of
+its inputs and the content of its outputs. File hashes are cached by
+(size, mtime) so unchanged files are only read once.
+
+The local backend runs ready tasks as subprocesses as long as the sum of
+their cores and memory fits the limits, retrying failed tasks. The SLURM
+backend submits every stale task with sbatch, chained by afterok
+dependencies, and writes the stamp at the end of the job.
+'''
+
+from __future__ import print_function
+
+import os
+import sys
+import json
+import time
+import shlex
+import hashlib
+import subprocess
+
+STATE_DIRECTORY = ".pipeline"
+
+class Task(object):
+
+	def __init__(self,
+		name,
+		command,
+		inputs=(),
+		outputs=(),
+		dependencies=(),
+		cores=1,
+		memory_gb=1.,
+		retries=1):
+		self.name = name
+		self.command = list(command)
+		self.inputs = list(inputs)
+		self.outputs = list(outputs)
+		self.dependencies = list(dependencies)
+		self.cores = cores
+		self.memory_gb = memory_gb
+		self.retries = retries
+
+	def stamp_filename(self, state_directory=STATE_DIRECTORY):
+		return os.path.join(state_directory, "stamps",
+			hashlib.sha1(self.name.encode()).hexdigest() + ".json")
+
+	def log_filename(self, state_directory=STATE_DIRECTORY):
+		return os.path.join(state_directory, "logs",
+			self.name.replace(os.sep, "_") + ".log")
+
+	def command_hash(self):
+		return hashlib.sha1(json.dumps(self.command).encode()).hexdigest()
+
+class FileHasher(object):
+	'''
+	sha1 of file contents, cached by path, size and mtime
+	'''
+
+	def __init__(self, state_directory=STATE_DIRECTORY):
+		self.filename = os.path.join(state_directory, "file_hashes.json")
+		self.cache = {}
+		if os.path.exists(self.filename):
+			with open(self.filename, "r") as f:
+				self.cache = json.load(f)
+
+	def __call__(self, filename):
+		if not os.path.exists(filename):
+			return None
+		if os.path.isdir(filename):
+			return hashlib.sha1(json.dumps([(name, self(os.path.join(filename, name)))
+				for name in sorted(os.listdir(filename))]).encode()).hexdigest()
+		stat = os.stat(filename)
+		key = os.path.abspath(filename)
+		signature = [stat.st_size, stat.st_mtime_ns]
+		if key in self.cache and self.cache[key][0] == signature:
+			return self.cache[key][1]
+		h = hashlib.sha1()
+		with open(filename, "rb") as f:
+			for chunk in iter(lambda: f.read(1 << 20), b""):
+				h.update(chunk)
+		self.cache[key] = [signature, h.hexdigest()]
+		return self.cache[key][1]
+
+	def save(self):
+		directory = os.path.dirname(self.filename)
+		if not os.path.exists(directory):
+			os.makedirs(directory, exist_ok=True)
+		with open(self.filename + ".tmp", "w") as f:
+			json.dump(self.cache, f)
+		os.replace(self.filename + ".tmp", self.filename)
+
+def task_stamp(task, hasher):
+	return {"command": task.command_hash(),
+		"inputs": {filename: hasher(filename) for filename in task.inputs},
+		"outputs": {filename: hasher(filename) for filename in task.outputs}}
+
+def is_fresh(task, hasher, state_directory=STATE_DIRECTORY):
+	stamp_filename = task.stamp_filename(state_directory)
+	if not os.path.exists(stamp_filename):
+		return False
+	if any(not os.path.exists(filename) for filename in task.outputs):
+		return False
+	with open(stamp_filename, "r") as f:
+		stamp = json.load(f)
+	return stamp == task_stamp(task, hasher)
+
+def write_stamp(task, hasher, state_directory=STATE_DIRECTORY):
+	stamp_filename = task.stamp_filename(state_directory)
+	directory = os.path.dirname(stamp_filename)
+	if not os.path.exists(directory):
+		os.makedirs(directory, exist_ok=True)
+	with open(stamp_filename + ".tmp", "w") as f:
+		json.dump(task_stamp(task, hasher), f, sort_keys=True)
+	os.replace(stamp_filename + ".tmp", stamp_filename)
+
+def topological_order(tasks):
+	'''
+	tasks is a dict of name to Task
+	'''
+	order = []
+	state = {}
+	def visit(name, path):
+		if state.get(name) == "done":
+			return
+		assert state.get(name) != "visiting", \
+			"dependency cycle: {}".format(" -> ".join(path + [name]))
+		assert name in tasks, "unknown dependency {}".format(name)
+		state[name] = "visiting"
+		for dependency in tasks[name].dependencies:
+			visit(dependency, path + [name])
+		state[name] = "done"
+		order.append(name)
+	for name in tasks:
+		visit(name, [])
+	return order
+
+def stale_tasks(tasks, state_directory=STATE_DIRECTORY):
+	'''
+	a task is stale when it is not fresh or depends on a stale task
+	'''
+	hasher = FileHasher(state_directory)
+	stale = set()
+	for name in topological_order(tasks):
+		task = tasks[name]
+		if any(dependency in stale for dependency in task.dependencies) or \
+			not is_fresh(task, hasher, state_directory):
+			stale.add(name)
+	hasher.save()
+	return stale
+
+def available_memory_gb():
+	try:
+		with open("/proc/meminfo", "r") as f:
+			for line in f:
+				if line.startswith("MemAvailable:"):
+					return int(line.split()[1]) / 1024. ** 2
+	except (IOError, OSError):
+		pass
+	return float("inf")
+
+class LocalBackend(object):
+
+	def __init__(self,
+		max_cores=None,
+		max_memory_gb=None,
+		state_directory=STATE_DIRECTORY,
+		poll_interval=0.2):
+		self.max_cores = max_cores or os.cpu_count()
+		self.max_memory_gb = max_memory_gb or 0.9 * available_memory_gb()
+		self.state_directory = state_directory
+		self.poll_interval = poll_interval
+
+	def start(self, task):
+		log_filename = task.log_filename(self.state_directory)
+		directory = os.path.dirname(log_filename)
+		if not os.path.exists(directory):
+			os.makedirs(directory, exist_ok=True)
+		log = open(log_filename, "a")
+		log.write("$ {}\n".format(" ".join(shlex.quote(c) for c in task.command)))
+		log.flush()
+		env = dict(os.environ)
+		for variable in ("OMP_NUM_THREADS", "MKL_NUM_THREADS",
+			"OPENBLAS_NUM_THREADS"):
+			env[variable] = str(task.cores)
+		process = subprocess.Popen(task.command, stdout=log,
+			stderr=subprocess.STDOUT, env=env)
+		return process, log
+
+	def run(self, tasks, stale):
+		'''
+		returns a dict of name to (status, attempts, seconds)
+		'''
+		hasher = FileHasher(self.state_directory)
+		results = {}
+		pending = [name for name in topological_order(tasks) if name in stale]
+		running = {}
+		attempts = {}
+		used_cores = 0
+		used_memory = 0.
+
+		while len(pending) > 0 or len(running) > 0:
+
+			for name in list(pending):
+				task = tasks[name]
+				dependencies = [results.get(d, ("done", 0, 0))[0]
+					if d in stale else "done" for d in task.dependencies]
+				if any(status == "failed" or status == "skipped"
+					for status in dependencies):
+					pending.remove(name)
+					results[name] = ("skipped", 0, 0.)
+					print ("skipping {}: a dependency failed".format(name))
+					continue
+				if any(d in stale and d not in results
+					for d in task.dependencies):
+					continue
+				cores = min(task.cores, self.max_cores)
+				memory = min(task.memory_gb, self.max_memory_gb)
+				if len(running) > 0 and (used_cores + cores > self.max_cores or
+					used_memory + memory > self.max_memory_gb):
+					continue
+				pending.remove(name)
+				attempts[name] = attempts.get(name, 0) + 1
+				print ("starting {} (attempt {})".format(name, attempts[name]))
+				process, log = self.start(task)
+				running[name] = (process, log, time.time(), cores, memory)
+				used_cores += cores
+				used_memory += memory
+
+			time.sleep(self.poll_interval)
+
+			for name in list(running):
+				process, log, start_time, cores, memory = running[name]
+				returncode = process.poll()
+				if returncode is None:
+					continue
+				log.close()
+				del running[name]
+				used_cores -= cores
+				used_memory -= memory
+				seconds = time.time() - start_time
+				task = tasks[name]
+				missing = [f for f in task.outputs if not os.path.exists(f)]
+				if returncode == 0 and len(missing) == 0:
+					write_stamp(task, hasher, self.state_directory)
+					results[name] = ("done", attempts[name], seconds)
+					print ("finished {} ({:.2f}s)".format(name, seconds))
+				elif attempts[name] <= task.retries:
+					print ("{} failed with code {}, retrying -- see {}".format(
+						name, returncode, task.log_filename(self.state_directory)))
+					pending.insert(0, name)
+				else:
+					results[name] = ("failed", attempts[name], seconds)
+					print ("{} FAILED with code {} -- see {}".format(
+						name, returncode, task.log_filename(self.state_directory)))
+
+		hasher.save()
+		return results
+
+class SlurmBackend(object):
+	'''
+	submit stale tasks with sbatch, the stamp is written by the job
+	'''
+
+	def __init__(self,
+		state_directory=STATE_DIRECTORY,
+		time_limit="1-00:00:00",
+		sbatch_args=()):
+		self.state_directory = state_directory
+		self.time_limit = time_limit
+		self.sbatch_args = list(sbatch_args)
+
+	def run(self, tasks, stale):
+		job_ids = {}
+		results = {}
+		for name in topological_order(tasks):
+			if name not in stale:
+				continue
+			task = tasks[name]
+			task_filename = os.path.join(self.state_directory, "tasks",
+				os.path.basename(task.stamp_filename()))
+			directory = os.path.dirname(task_filename)
+			if not os.path.exists(directory):
+				os.makedirs(directory, exist_ok=True)
+			with open(task_filename, "w") as f:
+				json.dump(vars(task), f)
+
+			command = " ".join(shlex.quote(c) for c in task.command)
+			stamp = " ".join(shlex.quote(c) for c in [sys.executable, "-m",
+				"heat.pipeline", "stamp", task_filename, self.state_directory])
+			log_filename = task.log_filename(self.state_directory)
+			if not os.path.exists(os.path.dirname(log_filename)):
+				os.makedirs(os.path.dirname(log_filename), exist_ok=True)
+
+			sbatch = ["sbatch", "--parsable",
+				"--job-name={}".format(name[:64]),
+				"--output={}".format(log_filename),
+				"--cpus-per-task={}".format(task.cores),
+				"--mem={}G".format(int(max(1, round(task.memory_gb)))),
+				"--time={}".format(self.time_limit),
+				"--requeue"] + self.sbatch_args
+			dependencies = [job_ids[d] for d in task.dependencies
+				if d in job_ids]
+			if len(dependencies) > 0:
+				sbatch.append("--dependency=afterok:{}".format(
+					":".join(dependencies)))
+			script = "#!/bin/bash\nfor attempt in $(seq {}); do {} && exec {}; done\nexit 1\n".format(
+				task.retries + 1, command, stamp)
+			output = subprocess.check_output(sbatch,
+				input=script.encode()).decode().strip()
+			job_ids[name] = output.split(";")[0]
+			results[name] = ("submitted", 0, 0.)
+			print ("submitted {} as job {}".format(name, job_ids[name]))
+		return results
+
+def run_pipeline(tasks, backend, force=False):
+	'''
+	tasks is a list of Task, returns a dict of name to
+	(status, attempts, seconds)
+	'''
+	tasks = dict((task.name, task) for task in tasks)
+	assert len(tasks) > 0
+	state_directory = backend.state_directory
+
+	stale = set(tasks) if force else stale_tasks(tasks, state_directory)
+	print ("{} tasks, {} up to date, {} to run".format(len(tasks),
+		len(tasks) - len(stale), len(stale)))
+
+	start_time = time.time()
+	results = backend.run(tasks, stale)
+	for name in tasks:
+		if name not in stale:
+			results[name] = ("fresh", 0, 0.)
+
+	timings_filename = os.path.join(state_directory, "timings.jsonl")
+	with open(timings_filename, "a") as f:
+		for name, (status, attempts, seconds) in results.items():
+			if status in ("done", "failed"):
+				f.write(json.dumps({"task": name, "status": status,
+					"attempts": attempts, "seconds": seconds,
+					"time": start_time}) + "\n")
+
+	print_summary(results, time.time() - start_time)
+	return results
+
+def print_summary(results, elapsed):
+	print ("\n{:<60s} {:>10s} {:>9s} {:>12s}".format("task", "status",
+		"attempts", "time"))
+	for name, (status, attempts, seconds) in sorted(results.items(),
+		key=lambda item: -item[1][2]):
+		if status == "fresh":
+			continue
+		print ("{:<60s} {:>10s} {:>9d} {:>11.2f}s".format(name[-60:], status,
+			attempts, seconds))
+	counts = {}
+	for status, _, _ in results.values():
+		counts[status] = counts.get(status, 0) + 1
+	busy = sum(seconds for _, _, seconds in results.values())
+	print ("\n{} ({:.2f}s elapsed, {:.2f}s of task time)".format(
+		", ".join("{} {}".format(n, status) for status, n in sorted(counts.items())),
+		elapsed, busy))
+
+def main():
+	'''
+	python -m heat.pipeline stamp task.json state_directory
+	writes the stamp of a task run by the SLURM backend
+	'''
+	assert len(sys.argv) == 4 and sys.argv[1] == "stamp"
+	with open(sys.argv[2], "r") as f:
+		task = Task(**json.load(f))
+	state_directory = sys.argv[3]
+	hasher = FileHasher(state_directory)
+	write_stamp(task, hasher, state_directory)
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,339 @@
+'''
+Dry-run memory and time planner.
+
+Predicts the footprint of every stage of main.py from the graph statistics
+(N, E, degree distribution, feature shape) and the selected options, without
+building the graph in networkx or running any training. Memory figures are
+the arrays and Python objects each stage allocates, times are rough
+single-core estimates.
+'''
+
+from __future__ import print_function
+
+import os
+
+import numpy as np
+import pandas as pd
+
+# approximate sizes of python objects on a 64 bit build
+POINTER_BYTES = 8
+LIST_BYTES = 56
+TUPLE_PAIR_BYTES = 64 + POINTER_BYTES
+NETWORKX_EDGE_BYTES = 2 * (POINTER_BYTES * 4 + 232) # both adjacency entries with attribute dict
+NETWORKX_NODE_BYTES = 2 * 232 + 100
+ALIAS_ENTRY_BYTES = 8 + 8 + 24 + 32 # J, q and the temporary list of probabilities
+ALIAS_DICT_ENTRY_BYTES = 200
+
+# approximate single-core throughput of each stage
+SECONDS_PER_WALK_STEP = 5e-6
+SECONDS_PER_PAIR = 1e-6
+SECONDS_PER_ALIAS_ENTRY = 1e-6
+SECONDS_PER_FLOP = 1e-9
+SECONDS_PER_SAMPLE_TARGET = 2e-6
+SECONDS_PER_DISK_BYTE = 2e-9
+SECONDS_PER_CSV_VALUE = 2e-6
+
+GB = 1024. ** 3
+
+def graph_statistics(edgelist_filename, features_filename=None, directed=False):
+	'''
+	read the edgelist with pandas rather than networkx and compute the
+	statistics the planner needs
+	'''
+	print ("reading edgelist from", edgelist_filename)
+	edges = pd.read_csv(edgelist_filename, sep="\t", header=None,
+		comment="#").values
+	if edges.shape[1] > 2:
+		edges = edges[edges[:,2] != 0]
+	edges = edges[:,:2].astype(np.int64)
+
+	num_nodes = int(edges.max()) + 1
+
+	# walks are performed on the undirected graph
+	undirected = np.sort(edges, axis=-1)
+	undirected = undirected[undirected[:,0] != undirected[:,1]]
+	undirected = np.unique(undirected[:,0] * num_nodes + undirected[:,1])
+	num_edges = len(undirected)
+	degrees = np.bincount(np.append(undirected // num_nodes,
+		undirected % num_nodes), minlength=num_nodes).astype(np.float64)
+
+	if features_filename is not None:
+		num_features = pd.read_csv(features_filename, index_col=0,
+			nrows=0).shape[1]
+	else:
+		num_features = 0
+
+	return {"num_nodes": num_nodes,
+		"num_edges": num_edges,
+		"num_directed_edges": len(edges) if directed else 2 * num_edges,
+		"max_degree": degrees.max(),
+		"mean_degree": degrees.mean(),
+		"sum_degree_squared": np.square(degrees).sum(),
+		"num_features": num_features}
+
+def stored_samples(args):
+	'''
+	the arrays in the sample store for the options of args, None if main.py
+	would not read them from --samples
+	'''
+	from .sample_store import samples_key, load_samples
+
+	if args.samples_path is None or args.num_partitions > 0 \
+		or args.num_workers > 0:
+		return None
+	key = samples_key(args)
+	samples = load_samples(os.path.join(args.samples_path.format(
+		seed=args.seed), key), key)
+	# stores of dense probabilities are rebuilt
+	if samples is None or "counts" not in samples:
+		return None
+	return samples
+
+def plan_stages(stats, args, samples=None):
+	'''
+	returns a list of (stage, memory in bytes, time in seconds, note)
+	memory is the peak of what the stage allocates on top of the data
+	that is still alive from earlier stages. samples are the arrays in
+	the sample store, see stored_samples
+	'''
+	N = float(stats["num_nodes"])
+	E = float(stats["num_edges"])
+	F = float(stats["num_features"])
+	partitioned = args.num_partitions > 0
+	use_generator = args.use_generator or args.num_workers > 0 or partitioned
+	use_store = args.samples_path is not None and not partitioned and \
+		args.num_workers == 0
+
+	stages = []
+
+	stages.append(("load_data",
+		N * NETWORKX_NODE_BYTES + E * NETWORKX_EDGE_BYTES + 3 * N * F * 8,
+		E * 5e-6 + N * F * 1e-7,
+		"networkx graph and standard scaled features"))
+
+	if samples is not None:
+		num_pairs = float(len(samples["positive_samples"]))
+		stored_bytes = sum(array.nbytes for array in samples.values())
+		stages.append(("sample_store_load",
+			N * 8,
+			stored_bytes * SECONDS_PER_DISK_BYTE,
+			"{:.0f} positive samples{} memory mapped from the store "
+			"({:.1f} GB on disk)".format(num_pairs, 
+				"" if use_generator else " and their negative samples",
+				stored_bytes / GB)))
+	elif args.no_walks:
+		num_pairs = 2 * E
+		stages.append(("pair_extraction",
+			num_pairs * TUPLE_PAIR_BYTES,
+			num_pairs * SECONDS_PER_PAIR,
+			"edges in both directions"))
+	else:
+		if F > 0:
+			stages.append(("feature_similarity",
+				3 * N * N * 8,
+				N * N * F * SECONDS_PER_FLOP,
+				"dense N x N cosine similarity and its cumulative sum "
+				"(computed whenever --features is given)"))
+
+		alias_entries = 2 * E
+		alias_memory = alias_entries * ALIAS_ENTRY_BYTES
+		if args.p != 1 or args.q != 1:
+			alias_entries += stats["sum_degree_squared"]
+			alias_memory += stats["sum_degree_squared"] * ALIAS_ENTRY_BYTES + \
+				stats["num_directed_edges"] * ALIAS_DICT_ENTRY_BYTES
+		stages.append(("alias_preprocessing",
+			alias_memory,
+			alias_entries * SECONDS_PER_ALIAS_ENTRY,
+			"alias tables for nodes" + (" and every edge (sum of degree^2)"
+				if args.p != 1 or args.q != 1 else " only (p = q = 1)")))
+
+		num_walks = args.num_walks * N
+		walk_steps = num_walks * args.walk_length
+		stages.append(("walks",
+			num_walks * LIST_BYTES + walk_steps * POINTER_BYTES,
+			walk_steps * SECONDS_PER_WALK_STEP,
+			"{:.0f} walks of length {}".format(num_walks, args.walk_length)))
+
+		context_size = min(args.context_size, args.walk_length - 1)
+		num_pairs = 2 * num_walks * sum(args.walk_length - j
+			for j in range(1, context_size + 1))
+		if partitioned:
+			stages.append(("pair_extraction",
+				10000 * args.walk_length * context_size * 2 * 16,
+				num_pairs * SECONDS_PER_PAIR / 10,
+				"pairs are bucketed to disk in chunks of walks "
+				"({:.1f} GB on disk)".format(num_pairs * 16 / GB)))
+		else:
+			stages.append(("pair_extraction",
+				num_pairs * (TUPLE_PAIR_BYTES + 16),
+				num_pairs * SECONDS_PER_PAIR,
+				"list of {:.0f} tuples and its int64 copy".format(num_pairs)))
+
+	if partitioned:
+		stages.append(("negative_sampling_probs",
+			N * 8,
+			N * 1e-8,
+			"unigram^0.75 counts, sampled within each partition"))
+	elif use_generator:
+		stages.append(("negative_sampler",
+			N * 8 + num_pairs * 8,
+			num_pairs * 1e-7,
+			"unigram^0.75 counts and the sorted keys of the positive "
+			"samples, excluded nodes are redrawn" + ("" if samples is None
+				else ", built from the stored counts")))
+	else:
+		if samples is None:
+			stages.append(("negative_sampling_probs",
+				N * N + 2 * N * N * 8,
+				N * N * 1e-8,
+				"N x N negative mask, dense probabilities and their "
+				"cumulative sum"))
+			stages.append(("negative_sampling",
+				num_pairs * args.num_negative_samples * (4 + 8) + num_pairs * 16,
+				num_pairs * 1e-6,
+				"negative samples for every positive sample selected "
+				"before training"))
+	if use_store and samples is None:
+		stored_bytes = num_pairs * 16 + N * 8 + (0 if use_generator 
+			else num_pairs * args.num_negative_samples * 4)
+		stages.append(("sample_store_write",
+			0,
+			stored_bytes * SECONDS_PER_DISK_BYTE,
+			"positive samples{} and node counts written to the store "
+			"({:.1f} GB on disk)".format(
+				"" if use_generator else ", negative samples",
+				stored_bytes / GB)))
+
+	embedding_memory = N * (args.embedding_dim + 2) * 8
+	if partitioned:
+		shard_memory = 2 * np.ceil(N / args.num_partitions) * \
+			(args.embedding_dim + 2) * 8
+		bucket_pairs = num_pairs / args.num_partitions ** 2
+		training_memory = shard_memory + bucket_pairs * 16
+		note = "two shards of {} partitions and one bucket of pairs".format(
+			args.num_partitions)
+	elif args.num_workers > 0:
+		training_memory = embedding_memory + num_pairs * 16
+		# checks/benchmark_distributed.py has not measured a speedup over
+		# one worker, so the workers are not assumed to shorten training
+		note = "embedding in shared memory updated by {} workers, "\
+			"no speedup assumed".format(args.num_workers)
+	else:
+		training_memory = 3 * embedding_memory + \
+			args.batch_size * (2 + args.num_negative_samples) * \
+				(args.embedding_dim + 2) * 8 * 4
+		note = "embedding variable, gradients and batch activations"
+	training_time = args.num_epochs * num_pairs * \
+		(1 + args.num_negative_samples) * SECONDS_PER_SAMPLE_TARGET
+	stages.append(("training", training_memory, training_time, note))
+
+	if partitioned:
+		checkpoint_memory = shard_memory / 2
+		note = "shards copied one at a time into a memory mapped .npy"
+	else:
+		checkpoint_memory = embedding_memory
+		note = "copy of the embedding written to .npy by a background "\
+			"thread while the next epoch trains"
+	checkpoint_time = embedding_memory * SECONDS_PER_DISK_BYTE
+	if args.export_csv:
+		checkpoint_memory += 2 * checkpoint_memory
+		checkpoint_time += N * (args.embedding_dim + 2) * SECONDS_PER_CSV_VALUE
+		note += ", then a DataFrame copy and gzipped csv"
+	stages.append(("checkpoint_write", checkpoint_memory, checkpoint_time,
+		note))
+
+	return stages
+
+def peak_memory(stages, args):
+	'''
+	stages of the in-memory pipeline keep their allocations alive until
+	training starts (features, walks, pairs and probabilities are all
+	referenced from main), so the peak is roughly the cumulative sum
+	'''
+	cumulative = 0
+	peak = 0
+	for stage, memory, _, _ in stages:
+		if stage == "checkpoint_write":
+			peak = max(peak, cumulative + memory)
+			continue
+		cumulative += memory
+		peak = max(peak, cumulative)
+	return peak
+
+def recommend(stats, stages, args, memory_budget):
+	'''
+	lower memory strategies supported by main.py
+	'''
+	memory = dict((stage, m) for stage, m, _, _ in stages)
+	N = stats["num_nodes"]
+	recommendations = []
+
+	if "feature_similarity" in memory and args.alpha == 0:
+		recommendations.append("alpha is 0 so the N x N feature similarity "
+			"is unused: omit --features to save {:.2f} GB".format(
+				memory["feature_similarity"] / GB))
+	if not args.no_walks and (args.p != 1 or args.q != 1):
+		recommendations.append("p = q = 1 skips the per-edge alias tables "
+			"(sum of degree^2 = {:.3g})".format(stats["sum_degree_squared"]))
+	if "negative_sampling" in memory:
+		recommendations.append("--use-generator draws negative samples per "
+			"batch instead of holding {:.2f} GB of them".format(
+				memory["negative_sampling"] / GB))
+	if "negative_sampling" in memory and \
+		3 * N * N * 8 > 0.25 * memory_budget:
+		shard_budget = 0.25 * memory_budget
+		num_partitions = int(np.ceil(2 * N * (args.embedding_dim + 2) * 8 \
+			/ shard_budget))
+		recommendations.append("the N x N negative sampling arrays need "
+			"{:.2f} GB: --num-partitions {} avoids them and holds only two "
+			"embedding shards in memory".format(
+				(N * N + 2 * N * N * 8) / GB, max(num_partitions, 2)))
+	return recommendations
+
+def format_bytes(num_bytes):
+	for unit in ("B", "KB", "MB", "GB", "TB"):
+		if num_bytes < 1024 or unit == "TB":
+			return "{:.1f}{}".format(num_bytes, unit)
+		num_bytes /= 1024.
+
+def format_seconds(seconds):
+	if seconds < 60:
+		return "{:.1f}s".format(seconds)
+	if seconds < 3600:
+		return "{:.1f}m".format(seconds / 60)
+	if seconds < 24 * 3600:
+		return "{:.1f}h".format(seconds / 3600)
+	return "{:.1f}d".format(seconds / 24 / 3600)
+
+def plan(args, memory_budget_gb=10):
+	stats = graph_statistics(args.edgelist, args.features,
+		directed=args.directed)
+	stages = plan_stages(stats, args, samples=stored_samples(args))
+	memory_budget = memory_budget_gb * GB
+
+	print ("\nnumber of nodes: {}".format(stats["num_nodes"]))
+	print ("number of edges: {}".format(stats["num_edges"]))
+	print ("mean degree: {:.2f}, max degree: {:.0f}, sum of squared degrees: {:.3g}".format(
+		stats["mean_degree"], stats["max_degree"], stats["sum_degree_squared"]))
+	print ("number of features: {}\n".format(stats["num_features"]))
+
+	print ("{:<24s} {:>10s} {:>10s}  {}".format("stage", "memory", "time", "note"))
+	for stage, memory, seconds, note in stages:
+		print ("{:<24s} {:>10s} {:>10s}  {}".format(stage,
+			format_bytes(memory), format_seconds(seconds), note))
+
+	peak = peak_memory(stages, args)
+	total_time = sum(seconds for _, _, seconds, _ in stages)
+	print ("\npredicted peak memory: {} (budget {})".format(format_bytes(peak),
+		format_bytes(memory_budget)))
+	print ("predicted time: {}".format(format_seconds(total_time)))
+
+	recommendations = recommend(stats, stages, args, memory_budget)
+	if peak > memory_budget:
+		print ("\nWARNING: predicted peak memory exceeds the budget")
+	if len(recommendations) > 0:
+		print ("\nrecommendations:")
+		for recommendation in recommendations:
+			print (" - " + recommendation)
+
+	return stats, stages, recommendations
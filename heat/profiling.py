@@ -0,0 +1,211 @@
+'''
+Stage timing for training runs.
+
+Every stage reports wall time, items/sec and peak RSS as one JSON line.
+Profiling is off unless enable_profiling is called, in which case stage()
+records to the active profiler from anywhere in the package.
+
+The peak RSS of a stage is the largest RSS a daemon thread samples while
+the stage is open, or the peak of the process (VmHWM) if the stage raised
+it. VmHWM is never reset, so nested stages and stages opened by other
+threads do not change the peaks of the stages around them.
+'''
+
+from __future__ import print_function
+
+import os
+import json
+import time
+import resource
+import threading
+import contextlib
+
+def read_status_mb(field):
+	'''
+	a field of /proc/self/status in MB, None where it is not available
+	'''
+	try:
+		with open("/proc/self/status", "r") as f:
+			for line in f:
+				if line.startswith(field + ":"):
+					return int(line.split()[1]) / 1024.
+	except (IOError, OSError):
+		pass
+	return None
+
+def current_rss_mb():
+	return read_status_mb("VmRSS")
+
+def peak_rss_mb():
+	peak = read_status_mb("VmHWM")
+	if peak is not None:
+		return peak
+	# ru_maxrss is in kilobytes on linux and bytes on mac
+	return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.
+
+class OpenStage(object):
+	'''
+	the peak RSS seen so far by a stage that has not finished
+	'''
+
+	def __init__(self, depth):
+		self.depth = depth
+		self.process_peak_rss_mb = peak_rss_mb()
+		self.peak_rss_mb = current_rss_mb()
+
+	def sample(self, rss):
+		if rss is not None and self.peak_rss_mb is not None:
+			self.peak_rss_mb = max(self.peak_rss_mb, rss)
+
+	def finish(self):
+		self.sample(current_rss_mb())
+		process_peak_rss_mb = peak_rss_mb()
+		if self.peak_rss_mb is None or \
+			process_peak_rss_mb > self.process_peak_rss_mb:
+			# the peak of the process was reached during the stage
+			return process_peak_rss_mb
+		return self.peak_rss_mb
+
+class Profiler(object):
+
+	def __init__(self, filename=None, sample_interval=0.05):
+		self.filename = filename
+		self.records = []
+		self.sample_interval = sample_interval
+		self.open_stages = []
+		self.lock = threading.Lock()
+		self.sampler = None
+		if filename is not None:
+			directory = os.path.dirname(filename)
+			if directory and not os.path.exists(directory):
+				os.makedirs(directory, exist_ok=True)
+
+	def record(self, stage, wall_time, items=None, **kwargs):
+		'''
+		depth is the number of stages open when the record is made, the
+		peak RSS of records made outside stage() is that of the process
+		'''
+		with self.lock:
+			record = {"stage": stage,
+				"time": time.time(),
+				"wall_time": wall_time,
+				"items": items,
+				"items_per_sec": items / wall_time \
+					if items is not None and wall_time > 0 else None,
+				"peak_rss_mb": peak_rss_mb(),
+				"depth": len(self.open_stages)}
+			record.update(kwargs)
+			self.records.append(record)
+			if self.filename is not None:
+				with open(self.filename, "a") as f:
+					f.write(json.dumps(record) + "\n")
+		return record
+
+	def sample_rss(self):
+		while True:
+			time.sleep(self.sample_interval)
+			rss = current_rss_mb()
+			if rss is None:
+				return
+			with self.lock:
+				for open_stage in self.open_stages:
+					open_stage.sample(rss)
+
+	def start_sampler(self):
+		if self.sampler is None:
+			self.sampler = threading.Thread(target=self.sample_rss)
+			self.sampler.daemon = True
+			self.sampler.start()
+
+	@contextlib.contextmanager
+	def stage(self, name, items=None, **kwargs):
+		'''
+		the yielded dict can be used to set "items" once it is known. the
+		stage is recorded even if its body raises
+		'''
+		info = {"items": items}
+		with self.lock:
+			open_stage = OpenStage(len(self.open_stages))
+			self.open_stages.append(open_stage)
+			self.start_sampler()
+		start_time = time.time()
+		try:
+			yield info
+		finally:
+			wall_time = time.time() - start_time
+			with self.lock:
+				self.open_stages = [other for other in self.open_stages
+					if other is not open_stage]
+			info.update(kwargs)
+			items = info.pop("items")
+			info.update({"peak_rss_mb": open_stage.finish(),
+				"depth": open_stage.depth})
+			self.record(name, wall_time, items=items, **info)
+
+	def summary(self):
+		'''
+		total time, items/sec and peak RSS aggregated over each stage. the
+		percentage is of the time of the top level stages, nested stages
+		are not counted twice
+		'''
+		stages = []
+		totals = {}
+		overall_time = 0.
+		for record in self.records:
+			if record.get("depth", 0) == 0:
+				overall_time += record["wall_time"]
+			stage = record["stage"]
+			if stage not in totals:
+				stages.append(stage)
+				totals[stage] = {"calls": 0, "wall_time": 0.,
+					"items": None, "peak_rss_mb": 0.}
+			total = totals[stage]
+			total["calls"] += 1
+			total["wall_time"] += record["wall_time"]
+			if record["items"] is not None:
+				total["items"] = (total["items"] or 0) + record["items"]
+			total["peak_rss_mb"] = max(total["peak_rss_mb"],
+				record["peak_rss_mb"])
+
+		lines = ["{:<28s} {:>6s} {:>12s} {:>7s} {:>14s} {:>12s}".format(
+			"stage", "calls", "wall time", "%", "items/sec", "peak RSS MB")]
+		for stage in stages:
+			total = totals[stage]
+			items_per_sec = total["items"] / total["wall_time"] \
+				if total["items"] is not None and total["wall_time"] > 0 else None
+			lines.append("{:<28s} {:>6d} {:>11.2f}s {:>6.1f}% {:>14s} {:>12.1f}".format(
+				stage, total["calls"], total["wall_time"],
+				100. * total["wall_time"] / max(overall_time, 1e-15),
+				"{:.1f}".format(items_per_sec) if items_per_sec is not None else "-",
+				total["peak_rss_mb"]))
+		return "\n".join(lines)
+
+	def write_summary(self):
+		summary = self.summary()
+		print (summary)
+		if self.filename is not None:
+			with open(os.path.splitext(self.filename)[0] + "_summary.txt", "w") as f:
+				f.write(summary + "\n")
+		return summary
+
+_profiler = None
+
+def enable_profiling(filename):
+	global _profiler
+	_profiler = Profiler(filename)
+	return _profiler
+
+def get_profiler():
+	return _profiler
+
+@contextlib.contextmanager
+def stage(name, items=None, **kwargs):
+	if _profiler is None:
+		yield {"items": items}
+	else:
+		with _profiler.stage(name, items=items, **kwargs) as info:
+			yield info
+
+def record(stage, wall_time, items=None, **kwargs):
+	if _profiler is not None:
+		return _profiler.record(stage, wall_time, items=items, **kwargs)
@@ -0,0 +1,131 @@
+'''
+Test results in one SQLite database.
+
+Every metric of an evaluation is a row keyed by dataset, exp, algorithm,
+dim, seed and epoch (-1 for the latest embedding), the components of the
+usual test_results/<dataset>/<exp>/<algorithm>/dim=<dim>/<seed>.pkl path.
+The database is in WAL mode, so readers never block the writer, and
+concurrent writers wait for each other for up to busy_timeout seconds
+instead of failing. WAL needs shared memory between processes, so the
+database must not be on a network filesystem.
+'''
+
+from __future__ import print_function
+
+import os
+import glob
+import sqlite3
+
+KEY_COLUMNS = ("dataset", "exp", "algorithm", "dim", "seed", "epoch")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS results (
+	dataset TEXT NOT NULL,
+	exp TEXT NOT NULL,
+	algorithm TEXT NOT NULL,
+	dim INTEGER NOT NULL,
+	seed INTEGER NOT NULL,
+	epoch INTEGER NOT NULL,
+	metric TEXT NOT NULL,
+	value REAL,
+	PRIMARY KEY (dataset, exp, algorithm, dim, seed, epoch, metric)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS results_by_exp ON results (exp, dim, dataset);
+"""
+
+def results_key(test_results_filename):
+	'''
+	dataset, exp, algorithm, dim, seed and epoch of a test results path
+	'''
+	parts = os.path.normpath(test_results_filename).split(os.sep)
+	seed = int(os.path.splitext(parts.pop())[0])
+	epoch = -1
+	if parts and parts[-1].startswith("epoch="):
+		epoch = int(parts.pop()[len("epoch="):])
+	assert len(parts) >= 4 and parts[-1].startswith("dim="), \
+		"{} is not <dataset>/<exp>/<algorithm>/dim=<dim>/<seed>.pkl".format(
+			test_results_filename)
+	return {"dataset": parts[-4],
+		"exp": parts[-3],
+		"algorithm": parts[-2],
+		"dim": int(parts[-1][len("dim="):]),
+		"seed": seed,
+		"epoch": epoch}
+
+class ResultsStore(object):
+
+	def __init__(self, filename, busy_timeout=600., batch_size=64):
+		directory = os.path.dirname(filename)
+		if directory and not os.path.exists(directory):
+			os.makedirs(directory, exist_ok=True)
+		self.filename = filename
+		self.batch_size = batch_size
+		self.connection = sqlite3.connect(filename, timeout=busy_timeout)
+		self.connection.execute("PRAGMA journal_mode=WAL")
+		self.connection.execute("PRAGMA synchronous=NORMAL")
+		self.connection.executescript(SCHEMA)
+		self.pending = []
+
+	def add(self, key, test_results):
+		'''
+		buffer the metrics of one evaluation, they are inserted batch_size
+		evaluations at a time
+		'''
+		self.pending.append((key, test_results))
+		if len(self.pending) >= self.batch_size:
+			self.flush()
+
+	def flush(self):
+		if len(self.pending) == 0:
+			return
+		rows = [tuple(key[column] for column in KEY_COLUMNS)
+			+ (metric, float(value))
+			for key, test_results in self.pending
+			for metric, value in test_results.items()]
+		# one transaction for the whole batch
+		with self.connection:
+			self.connection.executemany("INSERT OR REPLACE INTO results "
+				"VALUES (?, ?, ?, ?, ?, ?, ?, ?)", rows)
+		print ("saved {} results to {}".format(len(self.pending),
+			self.filename))
+		self.pending = []
+
+	def contains(self, key):
+		return self.connection.execute("SELECT 1 FROM results WHERE " +
+			" AND ".join("{} = ?".format(column) for column in KEY_COLUMNS) +
+			" LIMIT 1", [key[column] for column in KEY_COLUMNS]
+			).fetchone() is not None
+
+	def query(self, **conditions):
+		'''
+		metrics of every evaluation matching the conditions as a dataframe
+		indexed by the key columns, with one column per metric
+		'''
+		import pandas as pd
+
+		sql = "SELECT * FROM results"
+		if conditions:
+			sql += " WHERE " + " AND ".join("{} = ?".format(column)
+				for column in conditions)
+		df = pd.read_sql_query(sql, self.connection,
+			params=list(conditions.values()))
+		return df.set_index(list(KEY_COLUMNS) + ["metric"])["value"]\
+			.unstack("metric")
+
+	def import_pickles(self, test_results_path):
+		'''
+		add every <seed>.pkl under test_results_path
+		'''
+		import pickle as pkl
+
+		for filename in sorted(glob.iglob(os.path.join(test_results_path,
+			"**", "*.pkl"), recursive=True)):
+			with open(filename, "rb") as f:
+				test_results = pkl.load(f)
+			self.add(results_key(os.path.relpath(filename, test_results_path)),
+				dict(test_results))
+		self.flush()
+
+	def close(self):
+		self.flush()
+		self.connection.close()
@@ -0,0 +1,187 @@
+'''
+On-disk store of the preprocessed training samples, used with --samples.
+
+The positive samples, the node counts the negative sampling distribution
+is built from and (without a generator) the selected negative samples are
+saved as .npy files in <samples>/<key>, with samples.json holding the key
+of every option they depend on. Runs with the same key, for example the
+dimensions of one configuration or a resumed run, memory map them instead
+of repeating the walks and pair extraction. With a generator, negative
+samples are drawn by a heat.numpy_sgd.NegativeSampler built from the
+counts and positive samples, without the dense N x N probabilities.
+
+stored_dataset keeps the graph, the scaled features and their similarity
+in <samples>/<dataset key> the same way, so that the processes of a sweep
+memory map them instead of loading the edgelist and computing the N x N
+feature similarity again.
+'''
+
+from __future__ import print_function
+
+import os
+import json
+import hashlib
+
+import numpy as np
+import networkx as nx
+
+from . import profiling
+from .utils import (load_data, make_feature_sim,
+	determine_positive_and_negative_samples)
+from .numpy_sgd import NegativeSampler
+
+def file_signature(filename):
+	if filename is None or not os.path.exists(filename):
+		return None
+	stat = os.stat(filename)
+	return [os.path.abspath(filename), stat.st_size, int(stat.st_mtime)]
+
+def samples_key(args):
+	'''
+	hash of everything the training samples depend on
+	'''
+	options = {"edgelist": file_signature(args.edgelist),
+		"features": file_signature(args.features),
+		"seed": args.seed,
+		"directed": args.directed,
+		"no_walks": args.no_walks,
+		"all_negs": args.all_negs,
+		"use_generator": args.use_generator,
+		"num_negative_samples": None if args.use_generator
+			else args.num_negative_samples}
+	if not args.no_walks:
+		options.update({"num_walks": args.num_walks,
+			"walk_length": args.walk_length,
+			"context_size": args.context_size,
+			"p": args.p,
+			"q": args.q,
+			"alpha": args.alpha})
+	return hashlib.sha1(json.dumps(options,
+		sort_keys=True).encode()).hexdigest()
+
+def save_samples(directory, key, **arrays):
+	if not os.path.exists(directory):
+		os.makedirs(directory, exist_ok=True)
+	for name, array in arrays.items():
+		if array is None:
+			continue
+		filename = os.path.join(directory, name + ".npy")
+		with open(filename + ".tmp", "wb") as f:
+			np.save(f, array)
+		os.replace(filename + ".tmp", filename)
+	metadata_filename = os.path.join(directory, "samples.json")
+	with open(metadata_filename + ".tmp", "w") as f:
+		json.dump({"key": key,
+			"arrays": [name for name, array in arrays.items()
+				if array is not None]}, f)
+	os.replace(metadata_filename + ".tmp", metadata_filename)
+
+def load_samples(directory, key, mmap_mode="r"):
+	'''
+	returns a dict of the stored arrays or None if there are none for key
+	'''
+	metadata_filename = os.path.join(directory, "samples.json")
+	if not os.path.exists(metadata_filename):
+		return None
+	with open(metadata_filename, "r") as f:
+		metadata = json.load(f)
+	if metadata["key"] != key:
+		print ("stored samples in {} were made with different options".format(
+			directory))
+		return None
+	return {name: np.load(os.path.join(directory, name + ".npy"),
+		mmap_mode=mmap_mode) for name in metadata["arrays"]}
+
+def negative_sampler(positive_samples, counts, args):
+	if not args.use_generator:
+		return None
+	return NegativeSampler(counts, positive_samples, all_negs=args.all_negs)
+
+def stored_positive_and_negative_samples(graph, features, args, directory,
+	feature_sim=None):
+	'''
+	determine_positive_and_negative_samples, reading and writing the store
+	in directory/<samples key> if directory is not None. returns the
+	positive samples, the negative samples without a generator and the
+	NegativeSampler with one
+	'''
+	if directory is None:
+		positive_samples, negative_samples, _, counts = \
+			determine_positive_and_negative_samples(graph, features, args,
+				feature_sim=feature_sim, return_counts=True,
+				compute_probs=not args.use_generator)
+		return positive_samples, negative_samples, negative_sampler(
+			positive_samples, counts, args)
+
+	key = samples_key(args)
+	directory = os.path.join(directory, key)
+	samples = load_samples(directory, key)
+	if samples is not None and "counts" not in samples:
+		print ("stored samples in {} hold dense probabilities, rebuilding them".format(
+			directory))
+		samples = None
+	if samples is not None:
+		print ("loaded positive and negative samples from {}".format(directory))
+		positive_samples = samples["positive_samples"]
+		negative_samples = samples.get("negative_samples")
+		counts = samples["counts"]
+	else:
+		positive_samples, negative_samples, _, counts = \
+			determine_positive_and_negative_samples(graph, features, args,
+				feature_sim=feature_sim, return_counts=True,
+				compute_probs=not args.use_generator)
+		print ("saving positive and negative samples to {}".format(directory))
+		save_samples(directory, key,
+			positive_samples=positive_samples,
+			negative_samples=negative_samples,
+			counts=counts)
+
+	return positive_samples, negative_samples, negative_sampler(
+		positive_samples, counts, args)
+
+def dataset_key(args):
+	'''
+	hash of the files load_data reads the graph and features from
+	'''
+	options = {"dataset": True,
+		"edgelist": file_signature(args.edgelist),
+		"features": file_signature(args.features),
+		"directed": args.directed}
+	return hashlib.sha1(json.dumps(options,
+		sort_keys=True).encode()).hexdigest()
+
+def stored_dataset(args, directory, feature_sim=True):
+	'''
+	the graph, features and, if feature_sim and there are features, the
+	feature similarity of args from directory/<dataset key>. they are
+	loaded with load_data, computed and saved there the first time.
+	labels are not stored
+	'''
+	key = dataset_key(args)
+	directory = os.path.join(directory, key)
+	arrays = load_samples(directory, key)
+	if arrays is not None and feature_sim and "features" in arrays \
+		and "feature_sim" not in arrays:
+		arrays = None
+	if arrays is None:
+		graph, features, _ = load_data(args)
+		arrays = {"nodes": np.array(list(graph), dtype=np.int64),
+			"edges": np.array([(u, v, w)
+				for u, v, w in graph.edges(data="weight")],
+				dtype=np.float64).reshape(-1, 3),
+			"features": features}
+		if feature_sim and features is not None:
+			with profiling.stage("feature_similarity"):
+				arrays["feature_sim"] = make_feature_sim(features)
+		print ("saving graph and features to {}".format(directory))
+		save_samples(directory, key, **arrays)
+		return graph, features, arrays.get("feature_sim")
+
+	print ("loaded graph and features from {}".format(directory))
+	graph = nx.DiGraph() if args.directed else nx.Graph()
+	# the node order of load_data
+	graph.add_nodes_from(arrays["nodes"].astype(np.uint16))
+	edges = arrays["edges"]
+	graph.add_weighted_edges_from(zip(edges[:,0].astype(np.uint16),
+		edges[:,1].astype(np.uint16), edges[:,2]))
+	return graph, arrays.get("features"), arrays.get("feature_sim")
@@ -6,24 +6,19 @@ import functools
 import numpy as np
 import networkx as nx
 
-import random
-
-from sklearn.metrics.pairwise import cosine_similarity
-from sklearn.preprocessing import StandardScaler
-
-import pandas as pd
-
 import pickle as pkl
 
 from .node2vec_sampling import Graph 
-
-from multiprocessing.pool import Pool 
-
-import matplotlib.pyplot as plt
+from . import profiling
+from .checkpoint import load_checkpoint
 
 from collections import Counter
 
+# pandas and sklearn are imported where they are used, so that evaluation
+# scripts that only need load_data start quickly
+
 def load_data(args):
+	import pandas as pd
 
 	edgelist_filename = args.edgelist
 	features_filename = args.features
@@ -57,6 +52,7 @@ def load_data(args):
 		print ("loading features from {}".format(features_filename))
 
 		if features_filename.endswith(".csv") or features_filename.endswith(".csv.gz"):
+			from sklearn.preprocessing import StandardScaler
 			features = pd.read_csv(features_filename, index_col=0, sep=",")
 			features = features.reindex(sorted(graph.nodes())).values
 			features = StandardScaler().fit_transform(features) # input features are standard scaled
@@ -91,27 +87,14 @@ def load_data(args):
 	return graph, features, labels
 
 def load_embedding(embedding_filename):
+	if embedding_filename.endswith(".npy"):
+		return load_checkpoint(embedding_filename)
 	assert embedding_filename.endswith(".csv.gz")
+	import pandas as pd
 	embedding_df = pd.read_csv(embedding_filename, index_col=0)
 	embedding_df = embedding_df.reindex(sorted(embedding_df.index))
 	return embedding_df.values
 
-def hyperboloid_to_poincare_ball(X):
-	return X[:,:-1] / (1 + X[:,-1:])
-
-def hyperboloid_to_klein(X):
-	return X[:,:-1] / X[:,-1:]
-
-def poincare_ball_to_klein(X):
-	norm = np.linalg.norm(X, axis=-1, keepdims=True)
-	return 2 * norm / (1 + norm**2) * X / norm
-
-def poincare_ball_to_hyperboloid(X):
-	x = 2 * X
-	t = 1. + np.sum(np.square(X), axis=-1, keepdims=True)
-	x = np.concatenate([x, t], axis=-1)
-	return 1 / (1. - np.sum(np.square(X), axis=-1, keepdims=True)) * x
-
 def alias_setup(probs):
 	'''
 	Compute utility lists for non-uniform sampling from discrete distributions.
@@ -160,7 +143,38 @@ def alias_draw(J, q, size=1):
 	return kk
 
 
-def determine_positive_and_negative_samples(graph, features, args):
+def negative_sampling_probs(counts, positive_samples, all_negs=False):
+	'''
+	cumulative negative sampling distribution of every node, proportional
+	to counts ** 0.75 over all nodes but the node itself and, unless
+	all_negs, its positive samples
+	'''
+	N = len(counts)
+	with profiling.stage("negative_sampling_probs", items=N):
+		negative_samples = np.ones((N, N), dtype=bool)
+		np.fill_diagonal(negative_samples, 0)
+		if not all_negs and len(positive_samples) > 0:
+			negative_samples[positive_samples[:,0], positive_samples[:,1]] = 0
+
+		counts = counts ** 0.75
+		probs = counts[None, :] 
+		probs = probs * negative_samples
+		assert (probs > 0).any(axis=-1).all(), \
+			"a node in the network does not have any negative samples"
+		probs /= probs.sum(axis=-1, keepdims=True)
+		probs = probs.cumsum(axis=-1)
+
+	assert np.allclose(probs[:,-1], 1)
+	return probs
+
+def determine_positive_and_negative_samples(graph, features, args,
+	feature_sim=None, return_counts=False, compute_probs=True):
+	'''
+	with return_counts, the counts that negative_sampling_probs builds
+	probs from are returned as well. without compute_probs, probs is None,
+	which needs args.use_generator
+	'''
+	assert compute_probs or args.use_generator
 
 	graph = graph.to_undirected() # we perform walks on undirected matrix
 
@@ -172,8 +186,6 @@ def determine_positive_and_negative_samples(graph, features, args):
 	def determine_positive_samples_and_probs(graph, features, args):
 
 		N = len(graph)
-		negative_samples = np.ones((N, N), dtype=bool)
-		np.fill_diagonal(negative_samples, 0)
 
 		if args.no_walks:
 
@@ -183,10 +195,6 @@ def determine_positive_and_negative_samples(graph, features, args):
 
 			counts = np.array([graph.degree(u)
 				for u in sorted(graph)])
-
-			if not args.all_negs:
-				for n in nodes:
-					negative_samples[n, list(graph.neighbors(n))] = 0
 	
 		else:
 			positive_samples = []
@@ -196,7 +204,8 @@ def determine_positive_and_negative_samples(graph, features, args):
 			print ("determining positive and negative samples", 
 				"using random walks")
 
-			walks = perform_walks(graph, features, args)
+			walks = perform_walks(graph, features, args, 
+				feature_sim=feature_sim)
 
 			if not args.visualise:
 				del graph
@@ -204,55 +213,50 @@ def determine_positive_and_negative_samples(graph, features, args):
 
 			context_size = args.context_size
 
-			for num_walk, walk in enumerate(walks):
-				for i in range(len(walk)):
-					u = walk[i]
-					counts[u] += 1
-					for j in range(context_size):
-
-						if i+j+1 >= len(walk):
-							break
-						v = walk[i+j+1]
-						if u == v:
-							continue
-
-						positive_samples.append((u, v))
-						positive_samples.append((v, u))
-						# if (u, v) not in positive_samples:
-						# 	positive_samples[(u, v)] = 0
-						# if (v, u) not in positive_samples:
-						# 	positive_samples[(v, u)] = 0
-						# positive_samples[(u, v)] += 1
-						# positive_samples[(v, u)] += 1
-
-						if not args.all_negs:
-							negative_samples[u, v] = 0
-							negative_samples[v, u] = 0
-
-				if num_walk % 1000 == 0:  
-					print ("processed walk {:04d}/{}".format(
-						num_walk, 
-						# len(graph) * args.num_walks
-						len(walks)
-						))
+			with profiling.stage("pair_extraction") as info:
+				for num_walk, walk in enumerate(walks):
+					for i in range(len(walk)):
+						u = walk[i]
+						counts[u] += 1
+						for j in range(context_size):
+
+							if i+j+1 >= len(walk):
+								break
+							v = walk[i+j+1]
+							if u == v:
+								continue
+
+							positive_samples.append((u, v))
+							positive_samples.append((v, u))
+							# if (u, v) not in positive_samples:
+							# 	positive_samples[(u, v)] = 0
+							# if (v, u) not in positive_samples:
+							# 	positive_samples[(v, u)] = 0
+							# positive_samples[(u, v)] += 1
+							# positive_samples[(v, u)] += 1
+
+					if num_walk % 1000 == 0:  
+						print ("processed walk {:04d}/{}".format(
+							num_walk, 
+							# len(graph) * args.num_walks
+							len(walks)
+							))
+
+				info["items"] = len(positive_samples)
 
 		print ("DETERMINED POSITIVE AND NEGATIVE SAMPLES")
 		print ("found {} positive sample pairs".format(
 			len(positive_samples)))
 
-		counts = counts ** 0.75
-		probs = counts[None, :] 
-		probs = probs * negative_samples
-		assert (probs > 0).any(axis=-1).all(), \
-			"a node in the network does not have any negative samples"
-		probs /= probs.sum(axis=-1, keepdims=True)
-		probs = probs.cumsum(axis=-1)
-
-		assert np.allclose(probs[:,-1], 1)
+		positive_samples = np.array(positive_samples)
 
-		print ("PREPROCESSED NEGATIVE SAMPLE PROBABILTIES")
+		# positive samples are excluded from the negative samples
+		probs = None
+		if compute_probs:
+			probs = negative_sampling_probs(counts, positive_samples, 
+				all_negs=args.all_negs)
 
-		positive_samples = np.array(positive_samples)
+			print ("PREPROCESSED NEGATIVE SAMPLE PROBABILTIES")
 
 		if not args.use_generator:
 			print ("SORTING POSITIVE SAMPLES")
@@ -260,7 +264,7 @@ def determine_positive_and_negative_samples(graph, features, args):
 			positive_samples = positive_samples[idx]
 			print ("SORTED POSITIVE SAMPLES")
 
-		return positive_samples, probs
+		return positive_samples, probs, counts
 
 	def select_negative_samples(positive_samples, probs, num_negative_samples):
 
@@ -278,26 +282,47 @@ def determine_positive_and_negative_samples(graph, features, args):
 
 		return positive_samples, negative_samples
 
-	positive_samples, probs = \
+	positive_samples, probs, counts = \
 		determine_positive_samples_and_probs(
 			graph, features, args)
 
 	if not args.use_generator:
 		print("Training without generator -- selecting negative samples before training")
-		positive_samples, negative_samples = select_negative_samples(
-			positive_samples, probs, args.num_negative_samples)
+		with profiling.stage("negative_sampling", 
+			items=len(positive_samples)):
+			positive_samples, negative_samples = select_negative_samples(
+				positive_samples, probs, args.num_negative_samples)
 		probs = None
 	else:
 		print ("Training using data generator -- skipping selection of negative samples")
 		negative_samples = None 
 
+	if return_counts:
+		return positive_samples, negative_samples, probs, counts
 	return positive_samples, negative_samples, probs
 
 def choose_negative_samples(x, num_negative_samples):
 		u, count, probs = x
 		return u, np.searchsorted(probs, np.random.rand(count, num_negative_samples)).astype(np.int32)
 
-def perform_walks(graph, features, args):
+def make_feature_sim(features):
+	from sklearn.metrics.pairwise import cosine_similarity
+
+	if features is not None:
+		feature_sim = cosine_similarity(features)
+		np.fill_diagonal(feature_sim, 0) # remove diagonal
+		feature_sim[feature_sim < 1e-15] = 0
+		feature_sim /= np.maximum(
+			feature_sim.sum(axis=-1, keepdims=True), 1e-15) # row normalize
+	else:
+		feature_sim = None
+
+	return feature_sim
+
+def perform_walks(graph, features, args, feature_sim=None):
+	'''
+	feature_sim can be passed in when it is shared between several runs
+	'''
 
 	def save_walks_to_file(walks, walk_file):
 		with open(walk_file, "w") as f:
@@ -313,24 +338,13 @@ def perform_walks(graph, features, args):
 				walks.append([int(n) for n in line.split(",")])
 		return walks
 
-	def make_feature_sim(features):
-
-		if features is not None:
-			feature_sim = cosine_similarity(features)
-			np.fill_diagonal(feature_sim, 0) # remove diagonal
-			feature_sim[feature_sim < 1e-15] = 0
-			feature_sim /= np.maximum(
-				feature_sim.sum(axis=-1, keepdims=True), 1e-15) # row normalize
-		else:
-			feature_sim = None
-
-		return feature_sim
-
 	walk_file = args.walk_filename
 
 	if not os.path.exists(walk_file):
 
-		feature_sim = make_feature_sim(features)
+		if feature_sim is None:
+			with profiling.stage("feature_similarity"):
+				feature_sim = make_feature_sim(features)
 
 		if args.alpha > 0:
 			assert features is not None
@@ -342,10 +356,13 @@ def perform_walks(graph, features, args):
 			alpha=args.alpha, 
 			feature_sim=feature_sim, 
 			seed=args.seed)
-		node2vec_graph.preprocess_transition_probs()
-		walks = node2vec_graph.simulate_walks(
-			num_walks=args.num_walks, 
-			walk_length=args.walk_length)
+		with profiling.stage("alias_preprocessing", items=len(graph)):
+			node2vec_graph.preprocess_transition_probs()
+		with profiling.stage("walks") as info:
+			walks = node2vec_graph.simulate_walks(
+				num_walks=args.num_walks, 
+				walk_length=args.walk_length)
+			info["items"] = len(walks)
 		
 		if args.save_walks: 
 			walks = list(walks)
@@ -354,7 +371,9 @@ def perform_walks(graph, features, args):
 
 	else:
 		print ("loading walks from {}".format(walk_file))
-		walks = load_walks_from_file(walk_file, )
+		with profiling.stage("load_walks") as info:
+			walks = load_walks_from_file(walk_file, )
+			info["items"] = len(walks)
 
 	return walks
 
@@ -369,15 +388,13 @@ def lock_method(lock_filename):
 			# Hold program if it is already running 
 			# Snippet based on
 			# http://linux.byexamples.com/archives/494/how-can-i-avoid-running-a-python-script-multiple-times-implement-file-locking/
-			fp = open(lock_filename, 'r+')
-			done = False
-			while not done:
+			# lockf blocks until the lock is released, without polling
+			with open(lock_filename, 'a') as fp:
+				fcntl.lockf(fp, fcntl.LOCK_EX)
 				try:
-					fcntl.lockf(fp, fcntl.LOCK_EX | fcntl.LOCK_NB)
-					done = True
-				except IOError:
-					pass
-			return func(*args, **kwargs)
+					return func(*args, **kwargs)
+				finally:
+					fcntl.lockf(fp, fcntl.LOCK_UN)
 
 		return lock_and_run_method
 
@@ -387,6 +404,7 @@ def threadsafe_fn(lock_filename, fn, *args, **kwargs ):
 	lock_method(lock_filename)(fn)(*args, **kwargs)
 
 def save_test_results(filename, seed, data, ):
+	import pandas as pd
 	d = pd.DataFrame(index=[seed], data=data)
 	if os.path.exists(filename):
 		test_df = pd.read_csv(filename, sep=",", index_col=0)
@@ -4,30 +4,32 @@ import os
 import argparse
 import random
 import numpy as np
-import networkx as nx
-import pandas as pd
 
-
-from keras import backend as K
-from keras.callbacks import Callback, TerminateOnNaN, EarlyStopping
-
-import tensorflow as tf
-
-from heat.utils import hyperboloid_to_poincare_ball, load_data, load_embedding
-from heat.utils import determine_positive_and_negative_samples
-from heat.losses import  hyperbolic_softmax_loss
-from heat.generators import TrainingDataGenerator
-from heat.visualise import draw_graph, plot_degree_dist
-from heat.callbacks import Checkpointer
-from heat.models import build_model, load_weights
-from heat.optimizers import RiemannianOptimizer
-
-K.set_floatx("float64")
-K.set_epsilon(1e-15)
-
-def parse_args():
+from heat.utils import load_data, determine_positive_and_negative_samples
+from heat.geometry import hyperboloid_to_poincare_ball
+from heat.partitioned import train_partitioned
+from heat.distributed import train_distributed
+from heat.numpy_sgd import NegativeSampler, initialise_embedding
+from heat import profiling
+from heat.checkpoint import latest_checkpoint, load_checkpoint, list_checkpoints
+from heat.checkpoint import list_sub_epoch_checkpoints
+from heat.checkpoint import save_training_state, load_training_state
+from heat.sample_store import stored_positive_and_negative_samples, samples_key
+
+# keras, tensorflow and matplotlib are only imported by the code paths
+# that use them, see configure_keras
+
+def configure_keras(seed):
+	import tensorflow as tf
+	from keras import backend as K
+
+	K.set_floatx("float64")
+	K.set_epsilon(1e-15)
+	tf.set_random_seed(seed)
+
+def parse_args(argv=None):
 	'''
-	parse args from the command line
+	parse args from the command line, or from argv if it is given
 	'''
 	parser = argparse.ArgumentParser(description="HEAT algorithm for feature learning on complex networks")
 
@@ -82,6 +84,8 @@ def parse_args():
 
 	parser.add_argument("--embedding", dest="embedding_path", default=None, 
 		help="path to save embedings.")
+	parser.add_argument("--samples", dest="samples_path", default=None, 
+		help="directory to store positive and negative samples in, shared by runs with the same samples (default is <embedding>/samples when resuming and not to store them otherwise).")
 
 	parser.add_argument('--directed', action="store_true", help='flag to train on directed graph')
 
@@ -99,7 +103,38 @@ def parse_args():
 	parser.add_argument('--all-negs', action="store_true", 
 		help='flag to only train using all nodes as negative samples')
 
-	args = parser.parse_args()
+	parser.add_argument('--export-csv', action="store_true", 
+		help='flag to also export every checkpoint as a gzipped csv')
+	parser.add_argument("--delta-steps", dest="delta_steps", type=int, default=0,
+		help="Save the rows changed since the last full snapshot every this many batches "
+		"(default is 0, only checkpoint at the end of each epoch).")
+	parser.add_argument("--deltas-per-snapshot", dest="deltas_per_snapshot", type=int, default=10,
+		help="Number of delta checkpoints before a full snapshot is written instead (default is 10).")
+
+	parser.add_argument("--plan", action="store_true",
+		help="flag to predict the memory and time of each stage from the graph statistics and exit without training")
+	parser.add_argument("--memory-budget", dest="memory_budget", type=float, default=10,
+		help="memory available to the job in GB, used by --plan (default is 10).")
+
+	parser.add_argument("--profile", dest="profile_path", default=None,
+		help="path of a JSON lines file to write stage timings, throughput and peak memory to.")
+
+	parser.add_argument("--replica-seeds", dest="replica_seeds", type=int, nargs="+", default=None,
+		help="Train one independent embedding per seed stacked in a single model. "
+		"The embedding and walk paths must contain {seed}, for example seed={seed:03d}.")
+
+	parser.add_argument("--num-partitions", dest="num_partitions", type=int, default=0,
+		help="Number of node partitions for out-of-core training. "
+		"Only two partitions are held in memory at a time (default is 0, no partitioning).")
+	parser.add_argument("--partition-dir", dest="partition_dir", default=None,
+		help="path to store embedding partitions and bucketed positive samples "
+		"(default is embedding_path/partitions).")
+
+	parser.add_argument("--num-workers", dest="num_workers", type=int, default=0,
+		help="Number of data-parallel worker processes updating an embedding in shared memory "
+		"without locks, see heat/distributed.py (default is 0, train with keras).")
+
+	args = parser.parse_args(argv)
 	return args
 
 def configure_paths(args):
@@ -121,10 +156,32 @@ def configure_paths(args):
 		print ("making {}".format(args.embedding_path))
 	print ("saving embedding to {}".format(args.embedding_path))
 
+	if args.num_partitions > 0 and args.partition_dir is None:
+		args.partition_dir = os.path.join(args.embedding_path, "partitions")
+
+	# a resumed run stores its samples, so that it and every later resume
+	# memory maps them instead of repeating the walks
+	if args.samples_path is None and args.num_partitions == 0 \
+		and args.num_workers == 0 and (
+		len(list_checkpoints(args.embedding_path)) > 0 or
+		len(list_sub_epoch_checkpoints(args.embedding_path)) > 0):
+		args.samples_path = os.path.join(args.embedding_path, "samples")
+		print ("resuming -- storing samples in {}".format(args.samples_path))
+
+def write_profile_summary():
+	profiler = profiling.get_profiler()
+	if profiler is not None:
+		profiler.write_summary()
+
 def main():
 
 	args = parse_args()
 
+	if args.plan:
+		from heat.planner import plan
+		plan(args, memory_budget_gb=args.memory_budget)
+		return
+
 	assert not (args.visualise and args.embedding_dim > 2), "Can only visualise two dimensions"
 	assert args.embedding_path is not None, "you must specify a path to save embedding"
 	if not args.no_walks:
@@ -132,19 +189,204 @@ def main():
 
 	random.seed(args.seed)
 	np.random.seed(args.seed)
-	tf.set_random_seed(args.seed)
 
-	graph, features, node_labels = load_data(args)
+	if args.profile_path is not None:
+		print ("writing profile to {}".format(args.profile_path))
+		profiling.enable_profiling(args.profile_path)
+
+	with profiling.stage("load_data") as info:
+		graph, features, node_labels = load_data(args)
+		info["items"] = len(graph)
 	print ("Loaded dataset")
 
+	if args.replica_seeds is not None:
+		print ("Training {} stacked replicas".format(len(args.replica_seeds)))
+		with profiling.stage("training"):
+			train_stacked(graph, features, args)
+		print ("Training complete")
+		write_profile_summary()
+		return
+
 	configure_paths(args)
 	print ("Configured paths")
 
+	if args.num_partitions > 0:
+		print ("Training out-of-core using {} partitions".format(
+			args.num_partitions))
+		with profiling.stage("training"):
+			train_partitioned(graph, features, args)
+		print ("Training complete")
+		write_profile_summary()
+		return
+
+	if args.num_workers > 0:
+		print ("Training with {} workers on a shared embedding".format(
+			args.num_workers))
+		args.use_generator = True # workers select their own negative samples
+		positive_samples, _, _, counts = \
+			determine_positive_and_negative_samples(graph, 
+			features, args, return_counts=True, compute_probs=False)
+		sampler = NegativeSampler(counts, positive_samples, 
+			all_negs=args.all_negs)
+		embedding = None
+		initial_epoch, model_file = latest_checkpoint(args.embedding_path)
+		if model_file is not None:
+			print ("resuming from {}".format(model_file))
+			embedding = np.array(load_checkpoint(model_file))
+		with profiling.stage("training"):
+			train_distributed(len(graph), positive_samples, sampler, args,
+				embedding=embedding, initial_epoch=initial_epoch)
+		print ("Training complete")
+		write_profile_summary()
+		return
+
+	model = train(graph, features, args)
+
+	print ("Training complete")
+	write_profile_summary()
+
+	if args.visualise:
+		from heat.visualise import draw_graph
+		embedding = model.get_weights()[0]
+		if embedding.shape[1] == 3:
+			print ("projecting to poincare ball")
+			embedding = hyperboloid_to_poincare_ball(embedding)
+		draw_graph(graph, 
+			embedding, 
+			node_labels, 
+			path="2d-poincare-disk-visualisation.png")
+
+def replica_args(args, seed):
+	'''
+	the arguments of the replica trained with seed
+	'''
+	replica_args = argparse.Namespace(**vars(args))
+	replica_args.seed = seed
+	replica_args.replica_seeds = None
+	replica_args.embedding_path = args.embedding_path.format(seed=seed)
+	if args.walk_path is not None:
+		replica_args.walk_path = args.walk_path.format(seed=seed)
+	if args.samples_path is not None:
+		replica_args.samples_path = args.samples_path.format(seed=seed)
+	configure_paths(replica_args)
+	return replica_args
+
+def train_stacked(graph, features, args):
+	'''
+	train an independent embedding for every seed in args.replica_seeds
+	as one (S * N, d + 1) embedding, replica r is rows r * N to (r + 1) * N
+	with its own walks, positive samples, negative samples and checkpoints
+	'''
+	assert "{seed" in args.embedding_path, "embedding path must contain {seed}"
+	assert args.use_generator, "stacked training requires --use-generator"
+	assert args.delta_steps == 0, "delta checkpoints are not supported for stacked training"
+	configure_keras(args.seed)
+	import tensorflow as tf
+	from keras.callbacks import TerminateOnNaN
+	from heat.losses import hyperbolic_softmax_loss
+	from heat.generators import TrainingDataGenerator, StackedTrainingDataGenerator
+	from heat.callbacks import StackedCheckpointer, ThroughputLogger
+	from heat.models import build_model
+	from heat.optimizers import RiemannianOptimizer
+
+	num_nodes = len(graph)
+	replicas = [replica_args(args, seed) for seed in args.replica_seeds]
+	assert len(set(replica.embedding_path for replica in replicas)) == \
+		len(replicas), "replicas must have distinct embedding paths"
+	num_replicas = len(replicas)
+
+	# resume from the last epoch all replicas have completed
+	checkpoints = [dict(list_checkpoints(replica.embedding_path)) 
+		for replica in replicas]
+	initial_epoch = min(max(checkpoint) if len(checkpoint) > 0 else 0
+		for checkpoint in checkpoints)
+
+	model = build_model(num_replicas * num_nodes, args)
+	if initial_epoch > 0:
+		print ("resuming {} replicas from epoch {}".format(num_replicas, 
+			initial_epoch))
+		assert all(initial_epoch in checkpoint for checkpoint in checkpoints), \
+			"a replica no longer has the checkpoint of epoch {}".format(initial_epoch)
+		model.layers[1].set_weights([np.concatenate([load_checkpoint(
+			checkpoint[initial_epoch]) for checkpoint in checkpoints])])
+	else:
+		# build_model draws one initial embedding from args.seed, every
+		# replica is initialised from its own seed instead
+		initial_embeddings = []
+		for replica in replicas:
+			np.random.seed(replica.seed)
+			initial_embeddings.append(initialise_embedding(num_nodes, 
+				args.embedding_dim))
+		model.layers[1].set_weights([np.concatenate(initial_embeddings)])
+	optimizer = RiemannianOptimizer(lr=args.lr)
+	loss = hyperbolic_softmax_loss(sigma=args.sigma, 
+		num_replicas=num_replicas)
+	model.compile(optimizer=optimizer, 
+		loss=loss, 
+		target_tensors=[tf.placeholder(dtype=tf.int64)]
+		)
+	model.summary()
+
+	generators = []
+	for replica in replicas:
+		np.random.seed(replica.seed)
+		positive_samples, _, sampler = \
+			stored_positive_and_negative_samples(graph, 
+			features, replica, replica.samples_path)
+		generators.append(TrainingDataGenerator(
+			positive_samples,  
+			sampler,
+			model,
+			graph,
+			replica,
+			epoch=initial_epoch))
+	training_generator = StackedTrainingDataGenerator(generators, num_nodes)
+
+	callbacks = [
+		TerminateOnNaN(),
+		StackedCheckpointer(epoch=initial_epoch, 
+			nodes=sorted(graph.nodes()), 
+			embedding_directories=[replica.embedding_path 
+				for replica in replicas],
+			export_csv=args.export_csv)
+	]
+	if args.profile_path is not None:
+		callbacks.insert(-1, ThroughputLogger(training_generator))
+
+	print ("Training using data generator with {} worker threads".format(args.workers))
+	model.fit_generator(
+		training_generator, 
+		workers=args.workers,
+		use_multiprocessing=False,
+		shuffle=False, # the generators shuffle deterministically
+		epochs=args.num_epochs, 
+		steps_per_epoch=len(training_generator),
+		initial_epoch=initial_epoch, 
+		verbose=args.verbose,
+		callbacks=callbacks
+	)
+
+	return model
+
+def train(graph, features, args):
+	'''
+	train the keras model on graph, resuming from args.embedding_path
+	returns the trained model
+	'''
+	configure_keras(args.seed)
+	import tensorflow as tf
+	from keras.callbacks import TerminateOnNaN, EarlyStopping
+	from heat.losses import hyperbolic_softmax_loss
+	from heat.generators import TrainingDataGenerator
+	from heat.callbacks import Checkpointer, ThroughputLogger
+	from heat.models import build_model, load_weights
+	from heat.optimizers import RiemannianOptimizer
+
 	# build model
 	num_nodes = len(graph)
 	
 	model = build_model(num_nodes, args)
-	model, initial_epoch = load_weights(model, args)
+	model, initial_epoch, initial_step = load_weights(model, args)
 	optimizer = RiemannianOptimizer(lr=args.lr)
 	loss = hyperbolic_softmax_loss(sigma=args.sigma)
 	model.compile(optimizer=optimizer, 
@@ -153,6 +395,37 @@ def main():
 		)
 	model.summary()
 
+	positive_samples, negative_samples, sampler = \
+		stored_positive_and_negative_samples(graph, 
+		features, args, args.samples_path)
+
+	# batches are only reproducible mid-epoch with the same samples and
+	# batch size, the optimizer has no state besides the embedding
+	training_state = {"seed": args.seed,
+		"samples_key": samples_key(args),
+		"batch_size": args.batch_size,
+		"lr": args.lr,
+		"use_generator": args.use_generator}
+	if initial_step > 0 and (not args.use_generator or 
+		load_training_state(args.embedding_path) != training_state):
+		print ("cannot resume epoch {} at step {} -- training it again from the restored weights".format(
+			initial_epoch + 1, initial_step))
+		resume_step = 0
+	else:
+		resume_step = initial_step
+	save_training_state(args.embedding_path, training_state)
+
+	training_generator = None
+	if args.use_generator:
+		training_generator = TrainingDataGenerator(
+			positive_samples,  
+			sampler,
+			model,
+			graph,
+			args,
+			epoch=initial_epoch,
+			step=resume_step)
+
 	callbacks = [
 		TerminateOnNaN(),
 		EarlyStopping(monitor="loss", 
@@ -160,37 +433,50 @@ def main():
 			verbose=True),
 		Checkpointer(epoch=initial_epoch, 
 			nodes=sorted(graph.nodes()), 
-			embedding_directory=args.embedding_path)
+			embedding_directory=args.embedding_path,
+			export_csv=args.export_csv,
+			delta_steps=args.delta_steps,
+			deltas_per_snapshot=args.deltas_per_snapshot,
+			# step numbering carries on if the epoch is trained again
+			step=initial_step,
+			# deltas only read the rows of the batches trained since the last
+			generator=training_generator)
 	]		
 
-	positive_samples, negative_samples, probs = \
-		determine_positive_and_negative_samples(graph, 
-		features, args)
-
 	# del features # remove features reference to free up memory
 	# if not args.visualise:
 	# 	del graph
 
 	if args.use_generator:
 		print ("Training using data generator with {} worker threads".format(args.workers))
-		training_generator = TrainingDataGenerator(
-			positive_samples,  
-			probs,
-			model,
-			graph,
-			args)
-
-		model.fit_generator(
-			training_generator, 
-			workers=args.workers,
-			# max_queue_size=50, 
-			use_multiprocessing=False,
-			epochs=args.num_epochs, 
-			steps_per_epoch=len(training_generator),
-			initial_epoch=initial_epoch, 
-			verbose=args.verbose,
-			callbacks=callbacks
-		)
+		if args.profile_path is not None:
+			callbacks.insert(-1, ThroughputLogger(training_generator))
+
+		# the remaining steps of a resumed epoch are trained on their own
+		if resume_step > 0:
+			print ("resuming epoch {} at step {}".format(initial_epoch + 1, 
+				resume_step))
+			epochs = [initial_epoch + 1, args.num_epochs]
+		else:
+			epochs = [args.num_epochs]
+
+		for num_epochs in epochs:
+			if initial_epoch >= num_epochs:
+				break
+			model.fit_generator(
+				training_generator, 
+				workers=args.workers,
+				# max_queue_size=50, 
+				use_multiprocessing=False,
+				shuffle=False, # the generator shuffles deterministically
+				epochs=num_epochs, 
+				steps_per_epoch=len(training_generator),
+				initial_epoch=initial_epoch, 
+				verbose=args.verbose,
+				callbacks=callbacks
+			)
+			initial_epoch = num_epochs
+			training_generator.set_position(initial_epoch)
 
 	else:
 		print ("Training without data generator")
@@ -198,6 +484,8 @@ def main():
 		train_x = np.append(positive_samples, 
 			negative_samples, axis=-1)
 		train_y = np.zeros([len(train_x), 1, 1], dtype=np.int64 )
+		if args.profile_path is not None:
+			callbacks.insert(-1, ThroughputLogger())
 
 		model.fit(train_x, train_y,
 			shuffle=True,
@@ -208,17 +496,7 @@ def main():
 			callbacks=callbacks
 		)
 
-	print ("Training complete")
-
-	if args.visualise:
-		embedding = model.get_weights()[0]
-		if embedding.shape[1] == 3:
-			print ("projecting to poincare ball")
-			embedding = hyperboloid_to_poincare_ball(embedding)
-		draw_graph(graph, 
-			embedding, 
-			node_labels, 
-			path="2d-poincare-disk-visualisation.png")
+	return model
 
 if __name__ == "__main__":
 	main()
\ No newline at end of file
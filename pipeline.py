@@ -0,0 +1,190 @@
+'''
+Run the whole study as one DAG: edge removal, embedding, evaluation and
+collation, replacing the bash/ SLURM array scripts. The grid is the JSON
+spec of sweep.py, with the optional keys
+
+	"evaluate": true to evaluate every embedding (default is true),
+	"collate": true to run collate_results.py for every experiment,
+	"resources": {"remove": [cores, memory GB], "embed": [...],
+		"evaluate": [...], "collate": [...]}
+
+Tasks are skipped while their inputs, command and outputs are unchanged,
+see heat.pipeline.
+'''
+
+from __future__ import print_function
+
+import os
+import sys
+import json
+import argparse
+
+from sweep import expand_grid, configuration_argv, format_alpha
+from heat.pipeline import Task, LocalBackend, SlurmBackend, run_pipeline
+
+RESOURCES = {"remove": (1, 20),
+	"embed": (2, 10),
+	"evaluate": (1, 5),
+	"collate": (1, 2)}
+
+def parse_args():
+	parser = argparse.ArgumentParser(description="Run the HEAT experiment pipeline")
+
+	parser.add_argument("--spec", dest="spec", type=str, required=True,
+		help="JSON file describing the grid (see sweep.py).")
+	parser.add_argument("--backend", dest="backend", default="local",
+		choices=["local", "slurm"],
+		help="Run tasks on this machine or submit them with sbatch (default is local).")
+	parser.add_argument("--cores", dest="cores", type=int, default=None,
+		help="Number of cores the local backend may use (default is all).")
+	parser.add_argument("--memory", dest="memory", type=float, default=None,
+		help="Memory in GB the local backend may use (default is 90%% of available memory).")
+	parser.add_argument("--retries", dest="retries", type=int, default=1,
+		help="Number of times a failed task is retried (default is 1).")
+	parser.add_argument("--state", dest="state_directory", default=".pipeline",
+		help="path to store stamps, logs and timings (default is .pipeline).")
+	parser.add_argument("--sbatch-args", dest="sbatch_args", default="",
+		help="extra arguments passed to sbatch.")
+	parser.add_argument("--force", action="store_true",
+		help="flag to run every task even if it is up to date.")
+	parser.add_argument("--dry-run", action="store_true",
+		help="flag to list the tasks that would run and exit.")
+
+	return parser.parse_args()
+
+def option(argv, flag):
+	return argv[len(argv) - 1 - argv[::-1].index(flag) + 1]
+
+def build_tasks(spec, retries=1):
+	'''
+	returns the list of tasks of the study described by spec
+	'''
+	python = sys.executable
+	resources = dict(RESOURCES)
+	resources.update({stage: tuple(r)
+		for stage, r in spec.get("resources", {}).items()})
+	edgelist_dir = spec.get("edgelist_dir", "edgelists")
+	data_dir = spec.get("data_dir", "datasets")
+	num_epochs = spec.get("num_epochs", 5)
+
+	def task(stage, name, command, **kwargs):
+		cores, memory_gb = resources[stage]
+		return Task(name, command, cores=cores, memory_gb=memory_gb,
+			retries=retries, **kwargs)
+
+	tasks = {}
+	evaluations = {}
+
+	for config in expand_grid(spec):
+		dataset, exp, seed = config["dataset"], config["exp"], config["seed"]
+		edgelist = os.path.join(data_dir, dataset, "edgelist.tsv.gz")
+		argv = configuration_argv(config, spec)
+		embedding_dir = option(argv, "--embedding")
+		dependencies = []
+
+		if exp == "lp_experiment":
+			output = os.path.join(edgelist_dir, dataset)
+			seed_dir = os.path.join(output, "seed={:03d}".format(seed))
+			name = "remove/{}/seed={:03d}".format(dataset, seed)
+			if name not in tasks:
+				tasks[name] = task("remove", name,
+					[python, "remove_edges.py", "--edgelist", edgelist,
+						"--output", output, "--seed", str(seed)],
+					inputs=[edgelist],
+					outputs=[os.path.join(seed_dir, "training_edges",
+						"edgelist.tsv")] +
+						[os.path.join(seed_dir, "removed_edges", filename)
+						for filename in ("val_edges.tsv", "val_non_edges.tsv",
+							"test_edges.tsv", "test_non_edges.tsv")])
+			dependencies.append(name)
+
+		name = "embed/" + embedding_dir
+		tasks[name] = task("embed", name,
+			[python, "main.py"] + argv,
+			inputs=tasks[dependencies[0]].outputs[:1] if dependencies
+				else [option(argv, "--edgelist")],
+			outputs=[os.path.join(embedding_dir,
+				"{:05d}_embedding.json".format(num_epochs))],
+			dependencies=dependencies)
+		embed_name = name
+
+		if not spec.get("evaluate", True):
+			continue
+
+		evaluations_of_config = []
+		if exp == "lp_experiment":
+			removed_edges_dir = os.path.join(edgelist_dir, dataset,
+				"seed={:03d}".format(seed), "removed_edges")
+			evaluations_of_config.append(("lp", "evaluate_lp.py", exp,
+				["--edgelist", edgelist, "--removed_edges_dir", removed_edges_dir],
+				dependencies))
+		else:
+			labels = os.path.join(data_dir, dataset, "labels.csv.gz")
+			evaluations_of_config.append(("nc", "evaluate_nc.py", exp,
+				["--edgelist", edgelist, "--labels", labels], []))
+			evaluations_of_config.append(("reconstruction",
+				"evaluate_reconstruction.py", "reconstruction_experiment",
+				["--edgelist", edgelist], []))
+
+		for evaluation, script, results_exp, evaluation_args, \
+			evaluation_dependencies in evaluations_of_config:
+			test_results_dir = os.path.join("test_results", dataset,
+				results_exp, "alpha=" + format_alpha(config["alpha"]),
+				"dim={:03d}".format(config["dim"]))
+			name = "evaluate/{}/{}".format(evaluation, embedding_dir)
+			tasks[name] = task("evaluate", name,
+				[python, script] + evaluation_args +
+					["--dist_fn", "hyperboloid",
+					"--embedding", embedding_dir,
+					"--seed", str(seed),
+					"--test-results-dir", test_results_dir],
+				inputs=tasks[embed_name].outputs,
+				outputs=[os.path.join(test_results_dir,
+					"{}.pkl".format(seed))],
+				dependencies=[embed_name] + evaluation_dependencies)
+			evaluations.setdefault(evaluation, []).append(name)
+
+	if spec.get("collate", False):
+		for evaluation, names in evaluations.items():
+			name = "collate/" + evaluation
+			tasks[name] = task("collate", name,
+				[python, "collate_results.py", "--exp", evaluation],
+				inputs=[output for n in names for output in tasks[n].outputs],
+				outputs=[os.path.join("collated_results",
+					"{}_experiment".format(evaluation))],
+				dependencies=names)
+
+	return list(tasks.values())
+
+def main():
+
+	args = parse_args()
+
+	with open(args.spec, "r") as f:
+		spec = json.load(f)
+
+	tasks = build_tasks(spec, retries=args.retries)
+
+	if args.backend == "local":
+		backend = LocalBackend(max_cores=args.cores,
+			max_memory_gb=args.memory,
+			state_directory=args.state_directory)
+	else:
+		backend = SlurmBackend(state_directory=args.state_directory,
+			sbatch_args=args.sbatch_args.split())
+
+	if args.dry_run:
+		from heat.pipeline import stale_tasks
+		stale = stale_tasks(dict((task.name, task) for task in tasks),
+			args.state_directory)
+		for task in tasks:
+			if args.force or task.name in stale:
+				print (task.name)
+		return
+
+	results = run_pipeline(tasks, backend, force=args.force)
+	if any(status == "failed" for status, _, _ in results.values()):
+		sys.exit(1)
+
+if __name__ == "__main__":
+	main()
@@ -1,81 +1,77 @@
 import os
 os.environ["PYTHON_EGG_CACHE"] = "/rds/projects/2018/hesz01/poincare-embeddings/python-eggs"
 
-import random
 import numpy as np
-import networkx as nx
 
 import argparse
 
-from heat.utils import load_data
-from remove_utils import sample_non_edges, write_edgelist_to_file
+from remove_utils import (sample_non_edges, write_edgelist_to_file,
+	read_weighted_edgelist)
 
-def split_edges(graph, 
-	edges, 
+def node_cover(edges, num_nodes):
+	'''
+	positions of the edges that first cover every node when edges are
+	taken in order, which are the edges chosen by adding every edge with
+	an endpoint that is not covered yet
+	'''
+	first = np.full(num_nodes, len(edges), dtype=np.int64)
+	positions = np.arange(len(edges))
+	np.minimum.at(first, edges[:,0], positions)
+	np.minimum.at(first, edges[:,1], positions)
+	return np.unique(first[first < len(edges)])
+
+def split_edges(edges,
 	seed,
-	val_split=0.05, 
-	test_split=0.10, 
+	val_split=0.05,
+	test_split=0.10,
 	neg_mul=1,
-	cover=True):
-	
-	assert isinstance(graph, nx.DiGraph)
-	assert isinstance(edges, list)
-
-	num_nodes = len(graph)
+	cover=True,
+	degree_matched=False):
+	'''
+	split an (M, 2) array of edges into positions of training edges and
+	arrays of (val_edges, val_non_edges) and (test_edges, test_non_edges)
+	'''
+	num_nodes = int(edges.max()) + 1
 	num_edges = len(edges)
 
-	edge_set = set(edges)
-
 	num_val_edges = int(np.ceil(num_edges * val_split))
 	num_test_edges = int(np.ceil(num_edges * test_split))
 
-	random.seed(seed)
-	random.shuffle(edges)
+	order = np.random.RandomState(seed).permutation(num_edges)
 
 	# ensure every node appears in edgelist
-	nodes = set(graph)
-
-	cover_edges  = []
-
 	if cover:
-		for u, v in edges:
-			if u in nodes or v in nodes:
-				nodes -= {u, v}
-				cover_edges.append((u, v))
-			if len(nodes) == 0:
-				break
-		
+		cover_positions = node_cover(edges[order], num_nodes)
 		print ("determined cover")
-
-		edges = filter(lambda edge: 
-			edge not in cover_edges, edges)
+		in_cover = np.zeros(num_edges, dtype=bool)
+		in_cover[cover_positions] = True
+		cover_edges = order[in_cover]
+		order = order[~in_cover]
 		print ("filtered cover out of edges")
+	else:
+		cover_edges = np.zeros(0, dtype=np.int64)
 
-	val_edges = []
-	test_edges = []
-	train_edges = []
-	for edge in edges:
-		if len(val_edges) < num_val_edges:
-			val_edges.append(edge)
-		elif len(test_edges) < num_test_edges:
-			test_edges.append(edge)
-		else:
-			train_edges.append(edge)
-
-	train_edges += cover_edges
+	val_edges = order[:num_val_edges]
+	test_edges = order[num_val_edges:num_val_edges + num_test_edges]
+	train_edges = np.concatenate([order[num_val_edges + num_test_edges:],
+		cover_edges])
 	print ("determined edge split")
 
-	val_non_edges = sample_non_edges(graph, 
-		edge_set, 
-		num_val_edges*neg_mul)
+	val_non_edges = sample_non_edges(np.arange(num_nodes),
+		edges,
+		num_val_edges*neg_mul,
+		seed=seed,
+		degree_matched=degree_matched)
 	print ("determined val non edges")
-	test_non_edges = sample_non_edges(graph,
-		edge_set.union(val_non_edges),
-		num_test_edges*neg_mul)
+	test_non_edges = sample_non_edges(np.arange(num_nodes),
+		np.concatenate([edges, val_non_edges]),
+		num_test_edges*neg_mul,
+		seed=seed + 1,
+		degree_matched=degree_matched)
 	print ("determined test non edges")
 
-	return (train_edges, (val_edges, val_non_edges), 
-		(test_edges, test_non_edges))
+	return (train_edges, (edges[val_edges], val_non_edges),
+		(edges[test_edges], test_non_edges))
 
 def parse_args():
 	'''
@@ -83,19 +79,24 @@ def parse_args():
 	'''
 	parser = argparse.ArgumentParser(description="Script to remove edges for link prediction experiments")
 
-	parser.add_argument("--edgelist", dest="edgelist", type=str, 
+	parser.add_argument("--edgelist", dest="edgelist", type=str,
 		help="edgelist to load.")
-	parser.add_argument("--features", dest="features", type=str, 
+	parser.add_argument("--features", dest="features", type=str,
 		help="features to load.")
-	parser.add_argument("--labels", dest="labels", type=str, 
+	parser.add_argument("--labels", dest="labels", type=str,
 		help="path to labels")
-	parser.add_argument("--output", dest="output", type=str, 
+	parser.add_argument("--output", dest="output", type=str,
 		help="path to save training and removed edges")
 
-	parser.add_argument('--directed', 
+	parser.add_argument('--directed',
 		action="store_true", help='flag to train on directed graph')
 
-	parser.add_argument("--seed", type=int, default=0)
+	parser.add_argument("--seed", dest="seeds", type=int, nargs="+", default=[0],
+		help="seeds to split edges with, one split is written for each (default is 0).")
+	parser.add_argument("--val-split", dest="val_split", type=float, default=0.,
+		help="fraction of edges removed as validation edges, used by sweep.py to score link prediction (default is 0).")
+	parser.add_argument("--degree-matched", dest="degree_matched", action="store_true",
+		help="flag to sample non edges with the degree distribution of edges instead of uniformly.")
 
 	args = parser.parse_args()
 	return args
@@ -103,61 +104,56 @@ def parse_args():
 def main():
 
 	args = parse_args()
-	args.directed = True
-
-	seed= args.seed
-	training_edgelist_dir = os.path.join(args.output, "seed={:03d}".format(seed), "training_edges")
-	removed_edges_dir = os.path.join(args.output, "seed={:03d}".format(seed), "removed_edges")
-
-	if not os.path.exists(training_edgelist_dir):
-		os.makedirs(training_edgelist_dir, exist_ok=True)
-	if not os.path.exists(removed_edges_dir):
-		os.makedirs(removed_edges_dir, exist_ok=True)
-
-	training_edgelist_fn = os.path.join(training_edgelist_dir, "edgelist.tsv")
-	val_edgelist_fn = os.path.join(removed_edges_dir, "val_edges.tsv")
-	val_non_edgelist_fn = os.path.join(removed_edges_dir, "val_non_edges.tsv")
-	test_edgelist_fn = os.path.join(removed_edges_dir, "test_edges.tsv")
-	test_non_edgelist_fn = os.path.join(removed_edges_dir, "test_non_edges.tsv")
-	
-	graph, _, _ = load_data(args)
-	print("loaded dataset")
-	assert nx.is_directed(graph)
-	N = len(graph)
-
-	for u in range(N):
-		assert u in graph
-
-	edges = list(graph.edges())
-	print ("enumerated edges")
-
-	(training_edges, (val_edges, val_non_edges), 
-		(test_edges, test_non_edges)) = split_edges(graph, 
-			edges, 
-			seed, 
-			val_split=0)
-
-	assert len(nx.DiGraph(training_edges)) == N
 
-	print ("number of val edges", len(val_edges), 
-		"number of val non edges", len(val_edges))
-	print ("number of test edges", len(test_edges), 
-		"number of test non edges", len(test_edges))
-
-	# remove val and test edges
-	graph.remove_edges_from(val_edges + test_edges) 
-
-	print ("removed edges")
-
-	nx.write_edgelist(graph, training_edgelist_fn, 
-		delimiter="\t",
-		data=["weight"])
-	write_edgelist_to_file(val_edges, val_edgelist_fn)
-	write_edgelist_to_file(val_non_edges, val_non_edgelist_fn)
-	write_edgelist_to_file(test_edges, test_edgelist_fn)
-	write_edgelist_to_file(test_non_edges, test_non_edgelist_fn)
+	edges, weights = read_weighted_edgelist(args.edgelist)
+	print("loaded dataset")
+	N = int(edges.max()) + 1
+	assert np.all(np.bincount(edges.ravel(), minlength=N) > 0)
+	print ("number of nodes: {}".format(N))
+	print ("number of edges: {}".format(len(edges)))
+
+	for seed in args.seeds:
+
+		print ("splitting edges with seed", seed)
+
+		training_edgelist_dir = os.path.join(args.output, "seed={:03d}".format(seed), "training_edges")
+		removed_edges_dir = os.path.join(args.output, "seed={:03d}".format(seed), "removed_edges")
+
+		if not os.path.exists(training_edgelist_dir):
+			os.makedirs(training_edgelist_dir, exist_ok=True)
+		if not os.path.exists(removed_edges_dir):
+			os.makedirs(removed_edges_dir, exist_ok=True)
+
+		training_edgelist_fn = os.path.join(training_edgelist_dir, "edgelist.tsv")
+		val_edgelist_fn = os.path.join(removed_edges_dir, "val_edges.tsv")
+		val_non_edgelist_fn = os.path.join(removed_edges_dir, "val_non_edges.tsv")
+		test_edgelist_fn = os.path.join(removed_edges_dir, "test_edges.tsv")
+		test_non_edgelist_fn = os.path.join(removed_edges_dir, "test_non_edges.tsv")
+
+		(training_edges, (val_edges, val_non_edges),
+			(test_edges, test_non_edges)) = split_edges(edges,
+				seed,
+				val_split=args.val_split,
+				degree_matched=args.degree_matched)
+
+		assert len(np.unique(edges[training_edges])) == N
+
+		print ("number of val edges", len(val_edges),
+			"number of val non edges", len(val_non_edges))
+		print ("number of test edges", len(test_edges),
+			"number of test non edges", len(test_non_edges))
+
+		write_edgelist_to_file(val_edges, val_edgelist_fn)
+		write_edgelist_to_file(val_non_edges, val_non_edgelist_fn)
+		write_edgelist_to_file(test_edges, test_edgelist_fn)
+		write_edgelist_to_file(test_non_edges, test_non_edgelist_fn)
+		# written last, its existence marks a complete split.
+		# training edges are kept in the order of the input edgelist
+		training_edges = np.sort(training_edges)
+		write_edgelist_to_file(edges[training_edges], training_edgelist_fn,
+			weights=weights[training_edges])
 
 	print ("done")
-	
+
 if __name__ == "__main__":
 	main()
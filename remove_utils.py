@@ -1,18 +1,103 @@
+import os
 import random
 
-def write_edgelist_to_file(edgelist, filename, delimiter="\t"):
-	with open(filename, "w") as f:
-		for u, v in edgelist:
-			f.write("{}{}{}\n".format(u, delimiter, v))
+import numpy as np
+
+def read_weighted_edgelist(filename):
+	'''
+	(M, 2) int64 edges and their weights, read as load_data does for a
+	directed graph: the last copy of a repeated edge is kept, edges of
+	zero weight are removed and weights are made positive
+	'''
+	import pandas as pd
+
+	print ("reading edgelist from", filename)
+	df = pd.read_csv(filename, sep="\t", header=None, comment="#")
+	if df.shape[1] < 3:
+		df[2] = 1.
+	df = df.iloc[:,:3]
+	df.columns = ["u", "v", "weight"]
+	df = df.drop_duplicates(subset=["u", "v"], keep="last")
+	df = df[df["weight"] != 0]
+	edges = df[["u", "v"]].values.astype(np.int64)
+	weights = np.abs(df["weight"].values.astype(np.float64))
+	return edges, weights
+
+def write_edgelist_to_file(edgelist, filename, delimiter="\t", weights=None):
+	'''
+	write edges as text and, next to it, as a .npy array (and the
+	weights as _weights.npy)
+	'''
+	import pandas as pd
+
+	edgelist = edge_array(edgelist)
+	df = pd.DataFrame(edgelist)
+	if weights is not None:
+		df[2] = weights
+	df.to_csv(filename, sep=delimiter, header=False, index=False)
+
+	prefix = os.path.splitext(filename)[0]
+	np.save(prefix + ".npy", edgelist)
+	if weights is not None:
+		np.save(prefix + "_weights.npy", weights)
+
+def edge_array(edges):
+	'''
+	(M, 2) int64 array of a set, list or array of edges
+	'''
+	if isinstance(edges, np.ndarray):
+		return edges.astype(np.int64, copy=False).reshape(-1, 2)
+	return np.array(list(edges), dtype=np.int64).reshape(-1, 2)
+
+def edge_keys(edges, num_ids):
+	'''
+	edges (u, v) encoded as u * num_ids + v
+	'''
+	return edges[:,0] * num_ids + edges[:,1]
+
+def sample_non_edges(nodes, edges, sample_size, seed=None,
+	degree_matched=False):
+	'''
+	sample_size distinct ordered pairs (u, v) of different nodes that are
+	not in edges, as a (sample_size, 2) array. nodes are integer ids (or a
+	graph of them) and edges a set, list or array of pairs. with
+	degree_matched, u and v are drawn in proportion to their out and in
+	degree in edges, like the endpoints of an edge, instead of uniformly.
+	the sample is a function of seed, which is drawn from random if None
+	'''
+	nodes = np.sort(np.asarray(nodes if isinstance(nodes, np.ndarray) 
+		else list(nodes), dtype=np.int64))
+	edges = edge_array(edges)
+	num_ids = int(nodes[-1]) + 1
+	existing = np.unique(edge_keys(edges, num_ids))
+	if seed is None:
+		seed = random.getrandbits(32)
+	rng = np.random.RandomState(seed)
+
+	if degree_matched:
+		# an endpoint of a uniformly drawn edge is drawn in proportion to
+		# its degree
+		sources = edges[:,0]
+		targets = edges[:,1]
+	else:
+		sources = targets = nodes
 
-def sample_non_edges(nodes, edges, sample_size):
-	assert isinstance(edges, set)
-	nodes = list(nodes)
 	print ("sampling", sample_size, "non edges")
-	non_edges = set()
+	non_edges = np.zeros(0, dtype=np.int64)
 	while len(non_edges) < sample_size:
-		non_edges_= {tuple(random.sample(nodes, k=2))
-			for _ in range(sample_size - len(non_edges))}
-		non_edges_ -= edges 
-		non_edges = non_edges.union(non_edges_)
-	return list(non_edges)
\ No newline at end of file
+		# draw more than needed to make up for rejected pairs
+		num_candidates = int(1.1 * (sample_size - len(non_edges))) + 16
+		u = sources[rng.randint(len(sources), size=num_candidates)]
+		v = targets[rng.randint(len(targets), size=num_candidates)]
+		candidates = edge_keys(np.stack([u, v], axis=-1), num_ids)
+		candidates = candidates[u != v]
+		position = np.minimum(np.searchsorted(existing, candidates),
+			len(existing) - 1)
+		candidates = candidates[existing[position] != candidates] \
+			if len(existing) > 0 else candidates
+		non_edges = np.concatenate([non_edges, candidates])
+		# keep the first copy of every pair, in order of drawing
+		_, first = np.unique(non_edges, return_index=True)
+		non_edges = non_edges[np.sort(first)]
+	non_edges = non_edges[:sample_size]
+	return np.stack([non_edges // num_ids, non_edges % num_ids], axis=-1)
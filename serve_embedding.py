@@ -0,0 +1,271 @@
+'''
+Serve link scores and nearest neighbours of the latest embedding.
+
+The server loads the embedding with load_embedding (binary checkpoints
+are memory mapped) and answers requests from local clients over
+multiprocessing.connection, so the address is a unix socket path (the
+default, server.sock in the embedding directory) or a host:port pair, which
+requires HEAT_SERVE_AUTHKEY. Requests are batched:
+
+	("score", u, v)  ->  compute_scores of the embeddings of u[i] and v[i]
+	("topk", u, k)   ->  (indices, scores) of the k highest scoring nodes
+	                     of every u[i], excluding u[i] itself
+	("stats", )      ->  latency percentiles of every request type
+
+The embedding directory is polled for new checkpoints (for example
+published by the Checkpointer callback) and the embedding is swapped
+atomically, requests in flight finish on the embedding they started with.
+'''
+
+from __future__ import print_function
+
+import os
+import glob
+import time
+import argparse
+import threading
+import collections
+
+import numpy as np
+
+from multiprocessing.connection import Listener, Client
+
+from evaluation_utils import (load_embedding, embedding_filename,
+	get_scores, pairwise_scores, top_k)
+
+# latencies kept per request type for the percentiles
+LATENCY_HISTORY = 100000
+
+def parse_address(address):
+	'''
+	host:port for AF_INET, anything else is treated as a unix socket path
+	'''
+	if ":" in address:
+		host, port = address.rsplit(":", 1)
+		return (host, int(port))
+	return address
+
+def get_authkey(address):
+	'''
+	HEAT_SERVE_AUTHKEY if it is set, otherwise a fixed key for a unix socket,
+	which is only reachable through its path on this machine. A host:port
+	address without HEAT_SERVE_AUTHKEY is refused.
+	'''
+	authkey = os.environ.get("HEAT_SERVE_AUTHKEY")
+	if authkey:
+		return authkey.encode()
+	if isinstance(address, tuple):
+		raise ValueError("set HEAT_SERVE_AUTHKEY to the same secret on the "
+			"server and its clients to use {}:{}".format(*address))
+	return b"heat"
+
+def embedding_version(dist_fn, embedding_directory):
+	'''
+	files the embedding is loaded from and their modification times
+	'''
+	if dist_fn in ("hyperboloid", "poincare", "euclidean"):
+		filenames = [embedding_filename(dist_fn, embedding_directory)]
+	else:
+		filenames = sorted(glob.iglob(os.path.join(embedding_directory,
+			"*.csv.gz")))
+	return tuple((filename, os.stat(filename).st_mtime_ns)
+		for filename in filenames)
+
+def latency_percentiles(latencies, percentiles=(50, 90, 99)):
+	'''
+	count, percentiles and maximum of latencies in milliseconds
+	'''
+	latencies = 1000 * np.array(latencies)
+	stats = {"count": len(latencies)}
+	if len(latencies) > 0:
+		stats.update({"p{}".format(p): value for p, value in
+			zip(percentiles, np.percentile(latencies, percentiles))})
+		stats["max"] = latencies.max()
+	return stats
+
+class EmbeddingServer(object):
+
+	def __init__(self,
+		embedding_directory,
+		dist_fn,
+		address,
+		poll_interval=5.):
+		self.embedding_directory = embedding_directory
+		self.dist_fn = dist_fn
+		self.address = address
+		self.poll_interval = poll_interval
+		self.latencies = collections.defaultdict(
+			lambda: collections.deque(maxlen=LATENCY_HISTORY))
+		self.lock = threading.Lock()
+		self.closed = threading.Event()
+		self.version = None
+		self.reload()
+
+	def reload(self):
+		'''
+		load the embedding if a newer one has been published, returns
+		True if it was reloaded
+		'''
+		try:
+			version = embedding_version(self.dist_fn,
+				self.embedding_directory)
+		except (AssertionError, OSError):
+			# nothing published yet or a checkpoint was removed while
+			# listing
+			return False
+		if version == self.version:
+			return False
+		embedding = load_embedding(self.dist_fn, self.embedding_directory)
+		# one assignment, so requests see either embedding
+		self.embedding = embedding
+		self.version = version
+		print ("serving embedding from {}".format(
+			", ".join(filename for filename, _ in version)))
+		return True
+
+	def watch(self):
+		while not self.closed.wait(self.poll_interval):
+			try:
+				self.reload()
+			except Exception as e:
+				# keep serving the current embedding and retry
+				print ("could not reload embedding: {!r}".format(e))
+
+	def score(self, embedding, u, v):
+		edges = np.stack([np.asarray(u, dtype=np.int64),
+			np.asarray(v, dtype=np.int64)], axis=-1)
+		return get_scores(embedding, edges, self.dist_fn)
+
+	def topk(self, embedding, u, k):
+		u = np.asarray(u, dtype=np.int64)
+		scores = pairwise_scores(embedding, u, self.dist_fn)
+		scores[np.arange(len(u)), u] = -np.inf
+		return top_k(scores, min(k, scores.shape[1] - 1))
+
+	def handle(self, message):
+		command = message[0]
+		embedding = self.embedding
+		if command == "score":
+			return self.score(embedding, message[1], message[2])
+		elif command == "topk":
+			return self.topk(embedding, message[1], message[2])
+		elif command == "stats":
+			with self.lock:
+				return {command: latency_percentiles(latencies)
+					for command, latencies in self.latencies.items()}
+		else:
+			raise Exception("unknown command {}".format(command))
+
+	def serve_connection(self, connection):
+		while True:
+			try:
+				message = connection.recv()
+			except EOFError:
+				break
+			if message[0] == "close":
+				break
+			start_time = time.time()
+			try:
+				response = ("ok", self.handle(message))
+			except Exception as e:
+				response = ("error", repr(e))
+			connection.send(response)
+			with self.lock:
+				self.latencies[message[0]].append(time.time() - start_time)
+		connection.close()
+
+	def serve(self):
+		self.listener = Listener(self.address,
+			authkey=get_authkey(self.address))
+		print ("embedding server listening on {}".format(self.address))
+		watcher = threading.Thread(target=self.watch)
+		watcher.daemon = True
+		watcher.start()
+		while True:
+			connection = self.listener.accept()
+			if self.closed.is_set():
+				connection.close()
+				break
+			thread = threading.Thread(target=self.serve_connection,
+				args=(connection, ))
+			thread.daemon = True
+			thread.start()
+
+		self.listener.close()
+
+	def close(self):
+		self.closed.set()
+		# closing the listener does not interrupt accept, connect to wake it
+		Client(self.address, authkey=get_authkey(self.address)).close()
+
+class EmbeddingClient(object):
+
+	def __init__(self, address):
+		self.connection = None
+		for _ in range(100): # server may not be listening yet
+			try:
+				self.connection = Client(address,
+					authkey=get_authkey(address))
+				break
+			except (FileNotFoundError, ConnectionRefusedError):
+				time.sleep(0.1)
+		assert self.connection is not None, \
+			"could not connect to embedding server at {}".format(address)
+
+	def request(self, *message):
+		self.connection.send(message)
+		status, response = self.connection.recv()
+		if status == "error":
+			raise Exception("embedding server error: {}".format(response))
+		return response
+
+	def score(self, u, v):
+		return self.request("score", u, v)
+
+	def topk(self, u, k=10):
+		return self.request("topk", u, k)
+
+	def stats(self):
+		return self.request("stats")
+
+	def close(self):
+		self.connection.send(("close", ))
+		self.connection.close()
+
+def parse_args():
+
+	parser = argparse.ArgumentParser(description='Serve link scores and nearest neighbours of an embedding')
+
+	parser.add_argument("--embedding", dest="embedding_directory",
+		help="directory of embedding to serve.")
+
+	parser.add_argument("--dist_fn", dest="dist_fn", type=str,
+		choices=["poincare", "hyperboloid", "euclidean",
+			"kle", "klh", "st"])
+
+	parser.add_argument("--address", dest="address", type=str,
+		default=None,
+		help="unix socket path or host:port to listen on, host:port requires "
+		"HEAT_SERVE_AUTHKEY to be set (default is server.sock in the embedding directory).")
+	parser.add_argument("--poll-interval", dest="poll_interval", type=float,
+		default=5.,
+		help="seconds between checks for a new checkpoint (default is 5).")
+
+	args = parser.parse_args()
+	if args.address is None:
+		args.address = os.path.join(args.embedding_directory, "server.sock")
+	return args
+
+def main():
+
+	args = parse_args()
+
+	server = EmbeddingServer(args.embedding_directory,
+		args.dist_fn,
+		parse_address(args.address),
+		poll_interval=args.poll_interval)
+	server.serve()
+
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,451 @@
+'''
+Hyperparameter sweep in a single process pool.
+
+The grid is a JSON spec, for example
+
+	{"datasets": ["cora_ml"],
+	"exps": ["nc_experiment", "lp_experiment"],
+	"seeds": [0, 1, 2],
+	"alphas": [0.0, 0.2],
+	"dims": [5, 10, 25, 50],
+	"num_epochs": 5,
+	"args": ["--num-walks", "10", "--walk-length", "80",
+		"--use-generator", "--workers", "1", "--context-size", "10"]}
+
+Optional keys are "context_sizes" (a list overriding --context-size) and
+"data_dir", "edgelist_dir", "embedding_dir" and "walk_dir".
+
+Every dataset edgelist is loaded and its feature similarity computed once,
+in the parent, and stored in --cache. The positive samples and node counts
+are built once for every distinct (edgelist, seed, alpha, context size)
+and stored there too, see heat.sample_store. The processes that build
+samples and train memory map the stored dataset, and trainings that only
+differ in dimension memory map the same stored samples. Embeddings are written to
+the same layout as bash/perform_embeddings so the evaluate_* scripts work
+unchanged, and configurations whose final checkpoint exists are skipped.
+
+With --successive-halving every configuration is trained for --min-epochs
+and scored by AUROC, on the validation edges for lp_experiment if there are
+any and on sampled edges and non edges of the training graph otherwise.
+Only the best 1 / eta of each (dataset, exp) are trained eta times longer,
+resuming from their checkpoints, until num_epochs. Configurations that
+cannot be scored are reported as failed.
+'''
+
+from __future__ import print_function
+
+import os
+import json
+import time
+import random
+import argparse
+import itertools
+import traceback
+import multiprocessing
+
+import numpy as np
+
+def parse_args():
+	parser = argparse.ArgumentParser(description="Train a grid of HEAT embeddings sharing preprocessed data")
+
+	parser.add_argument("--spec", dest="spec", type=str, required=True,
+		help="JSON file describing the grid.")
+	parser.add_argument("--processes", dest="processes", type=int,
+		default=None,
+		help="Number of training processes (default is the number of cpus).")
+	parser.add_argument("--threads-per-job", dest="threads_per_job", type=int,
+		default=2,
+		help="Number of tensorflow threads in each training process (default is 2).")
+	parser.add_argument("--cache", dest="cache_path", type=str,
+		default="sweep_cache",
+		help="path to store shared positive and negative samples (default is sweep_cache).")
+	parser.add_argument("--dry-run", action="store_true",
+		help="flag to list the configurations that would be trained and exit.")
+
+	parser.add_argument("--successive-halving", action="store_true",
+		help="flag to train all configurations for --min-epochs and only continue the best 1 / eta "
+		"of them, repeatedly, up to num_epochs.")
+	parser.add_argument("--min-epochs", dest="min_epochs", type=int, default=1,
+		help="Epochs every configuration is trained for in the first rung (default is 1).")
+	parser.add_argument("--eta", dest="eta", type=int, default=3,
+		help="Fraction 1 / eta of configurations kept, and factor the budget grows by, "
+		"at every rung (default is 3).")
+	parser.add_argument("--score-edges", dest="score_edges", type=int, default=10000,
+		help="Number of sampled edges used to score node classification experiments (default is 10000).")
+
+	return parser.parse_args()
+
+def format_alpha(alpha):
+	return "{:.2f}".format(alpha)
+
+def expand_grid(spec):
+	'''
+	yields one dict per configuration in the order of the bash scripts
+	'''
+	context_sizes = spec.get("context_sizes", [None])
+	for dataset, dim, seed, alpha, exp, context_size in itertools.product(
+		spec["datasets"], spec["dims"], spec["seeds"], spec["alphas"],
+		spec["exps"], context_sizes):
+		yield {"dataset": dataset,
+			"dim": dim,
+			"seed": seed,
+			"alpha": alpha,
+			"exp": exp,
+			"context_size": context_size}
+
+def configuration_argv(config, spec):
+	'''
+	the command line of main.py for one configuration
+	'''
+	dataset = config["dataset"]
+	data_dir = os.path.join(spec.get("data_dir", "datasets"), dataset)
+	features = os.path.join(data_dir, "feats.csv.gz")
+
+	if config["exp"] == "lp_experiment":
+		edgelist = os.path.join(spec.get("edgelist_dir", "edgelists"),
+			dataset, "seed={:03d}".format(config["seed"]),
+			"training_edges", "edgelist.tsv")
+	else:
+		edgelist = os.path.join(data_dir, "edgelist.tsv.gz")
+
+	directory = os.path.join(dataset, config["exp"],
+		"alpha=" + format_alpha(config["alpha"]),
+		"seed={:03d}".format(config["seed"]))
+	embedding_dir = os.path.join(spec.get("embedding_dir", "embeddings"),
+		directory, "dim={:03d}".format(config["dim"]))
+	walk_dir = os.path.join(spec.get("walk_dir", "walks"), directory)
+
+	argv = ["--edgelist", edgelist,
+		"--features", features,
+		"--embedding", embedding_dir,
+		"--walks", walk_dir,
+		"--seed", str(config["seed"]),
+		"--dim", str(config["dim"]),
+		"--alpha", format_alpha(config["alpha"]),
+		"-e", str(spec.get("num_epochs", 5))]
+	argv += spec.get("args", [])
+	if config["context_size"] is not None:
+		argv += ["--context-size", str(config["context_size"])]
+	return argv
+
+def make_args(argv, cache_path, configure=True):
+	'''
+	configure creates the walk and embedding directories
+	'''
+	from main import parse_args as parse_main_args, configure_paths
+
+	args = parse_main_args(argv)
+	args.samples_path = cache_path
+	if configure:
+		configure_paths(args)
+	return args
+
+def is_complete(args):
+	from heat.checkpoint import checkpoint_filenames
+	_, metadata_filename, _ = checkpoint_filenames(args.embedding_path,
+		args.num_epochs)
+	return os.path.exists(metadata_filename)
+
+def seed_everything(seed):
+	random.seed(seed)
+	np.random.seed(seed)
+
+def prepare_samples(job):
+	'''
+	build the samples of every configuration sharing one edgelist and seed
+	'''
+	from heat.sample_store import (stored_dataset, 
+		stored_positive_and_negative_samples, samples_key)
+
+	argvs, cache_path = job
+	args_list = [make_args(argv, cache_path) for argv in argvs]
+	graph, features, feature_sim = stored_dataset(args_list[0], cache_path,
+		feature_sim=any(not args.no_walks for args in args_list))
+
+	done = set()
+	for args in args_list:
+		key = samples_key(args)
+		if key in done:
+			continue
+		done.add(key)
+		seed_everything(args.seed)
+		stored_positive_and_negative_samples(graph, features, args,
+			args.samples_path, feature_sim=feature_sim)
+	return len(done)
+
+_graphs = {}
+
+def load_graph(args):
+	'''
+	datasets are memory mapped once per training process
+	'''
+	from heat.sample_store import stored_dataset
+
+	key = (args.edgelist, args.features, args.directed)
+	if key not in _graphs:
+		_graphs.clear()
+		graph, features, _ = stored_dataset(args, args.samples_path,
+			feature_sim=False)
+		_graphs[key] = graph, features
+	return _graphs[key]
+
+def train_configuration(job):
+	argv, cache_path, threads = job
+	try:
+		import tensorflow as tf
+		from keras import backend as K
+		from main import train
+
+		args = make_args(argv, cache_path)
+		start_time = time.time()
+		graph, features = load_graph(args)
+
+		K.clear_session()
+		K.set_session(tf.Session(config=tf.ConfigProto(
+			intra_op_parallelism_threads=threads,
+			inter_op_parallelism_threads=threads)))
+		seed_everything(args.seed)
+		tf.set_random_seed(args.seed)
+
+		train(graph, features, args)
+		return args.embedding_path, time.time() - start_time, None
+	except Exception:
+		return argv, None, traceback.format_exc()
+
+def train_all(pool, argvs, args):
+	'''
+	prepare the samples of and train every configuration in argvs
+	returns the argvs that failed
+	'''
+	from heat.sample_store import stored_dataset, dataset_key
+
+	# group by the data the samples are built from, seeds are prepared
+	# in parallel from the dataset stored once by the parent
+	groups = {}
+	datasets = {}
+	for argv in argvs:
+		sweep_args = make_args(argv, args.cache_path, configure=False)
+		key = (sweep_args.edgelist, sweep_args.features, sweep_args.directed,
+			sweep_args.seed)
+		groups.setdefault(key, []).append(argv)
+		datasets.setdefault(dataset_key(sweep_args), []).append(sweep_args)
+
+	start_time = time.time()
+	for dataset_args in datasets.values():
+		stored_dataset(dataset_args[0], args.cache_path,
+			feature_sim=any(not sweep_args.no_walks 
+				for sweep_args in dataset_args))
+	print ("stored {} datasets ({:.2f}s)".format(len(datasets),
+		time.time() - start_time))
+
+	start_time = time.time()
+	num_samples = sum(pool.map(prepare_samples,
+		[(group, args.cache_path) for group in groups.values()]))
+	print ("prepared {} distinct sample sets in {} groups ({:.2f}s)".format(
+		num_samples, len(groups), time.time() - start_time))
+
+	failed = []
+	for embedding_path, seconds, error in pool.imap_unordered(
+		train_configuration,
+		[(argv, args.cache_path, args.threads_per_job)
+			for argv in argvs]):
+		if error is None:
+			print ("trained {} ({:.2f}s)".format(embedding_path, seconds))
+		else:
+			print ("FAILED {}\n{}".format(" ".join(embedding_path), error))
+			failed.append(embedding_path)
+	return failed
+
+def scoring_edges(config, args, spec, num_edges):
+	'''
+	the validation edges of a link prediction experiment if remove_edges
+	wrote any, otherwise a sample of the training edges and as many
+	sampled non edges
+	'''
+	import pandas as pd
+
+	if config["exp"] == "lp_experiment":
+		removed_edges_dir = os.path.join(spec.get("edgelist_dir", "edgelists"),
+			config["dataset"], "seed={:03d}".format(config["seed"]),
+			"removed_edges")
+		filenames = [os.path.join(removed_edges_dir, filename)
+			for filename in ("val_edges.tsv", "val_non_edges.tsv")]
+		# remove_edges splits with val_split=0, so they are usually empty
+		if all(os.path.exists(filename) and os.path.getsize(filename) > 0
+			for filename in filenames):
+			return tuple(pd.read_csv(filename, sep="\t", 
+				header=None).values[:,:2].astype(np.int64)
+				for filename in filenames)
+
+	# for link prediction this ranks configurations by how well they
+	# reconstruct the training graph, the test edges are never scored
+	edges = pd.read_csv(args.edgelist, sep="\t", header=None,
+		comment="#").values[:,:2].astype(np.int64)
+	num_nodes = int(edges.max()) + 1
+	edge_keys = np.append(edges[:,0] * num_nodes + edges[:,1],
+		edges[:,1] * num_nodes + edges[:,0])
+	random_state = np.random.RandomState(config["seed"])
+	edges = edges[random_state.choice(len(edges), 
+		min(num_edges, len(edges)), replace=False)]
+
+	non_edges = random_state.randint(num_nodes, size=(2 * len(edges), 2))
+	non_edges = non_edges[non_edges[:,0] != non_edges[:,1]]
+	non_edges = non_edges[~np.isin(non_edges[:,0] * num_nodes + 
+		non_edges[:,1], edge_keys)][:len(edges)]
+	return edges, non_edges
+
+def score_configuration(job):
+	'''
+	AUROC of the latest checkpoint on a cheap set of edges
+	'''
+	config, argv, cache_path, spec, num_edges = job
+	try:
+		from sklearn.metrics import roc_auc_score
+		from evaluation_utils import load_embedding, get_scores
+
+		args = make_args(argv, cache_path, configure=False)
+		embedding = load_embedding("hyperboloid", args.embedding_path)
+		edges, non_edges = scoring_edges(config, args, spec, num_edges)
+		scores = np.append(get_scores(embedding, edges, "hyperboloid"),
+			get_scores(embedding, non_edges, "hyperboloid"))
+		labels = np.append(np.ones(len(edges)), np.zeros(len(non_edges)))
+		return roc_auc_score(labels, scores), None
+	except Exception:
+		return None, traceback.format_exc()
+
+def rung_budgets(min_epochs, num_epochs, eta):
+	budgets = []
+	budget = min_epochs
+	while budget < num_epochs:
+		budgets.append(budget)
+		budget *= eta
+	budgets.append(num_epochs)
+	return budgets
+
+def successive_halving(pool, configs, spec, args):
+	'''
+	train every configuration for min_epochs, then repeatedly keep the best
+	1 / eta of each (dataset, exp) bracket and train them eta times longer,
+	resuming from their checkpoints, until num_epochs is reached. scores
+	are averaged over seeds
+	'''
+	def bracket(config):
+		return config["dataset"], config["exp"]
+
+	def arm(config):
+		return config["alpha"], config["dim"], config["context_size"]
+
+	budgets = rung_budgets(args.min_epochs, spec.get("num_epochs", 5), 
+		args.eta)
+	print ("rung budgets: {} epochs".format(budgets))
+
+	history = []
+	failed = []
+	survivors = list(configs)
+	for rung, budget in enumerate(budgets):
+		argvs = [configuration_argv(config, spec) + ["-e", str(budget)]
+			for config in survivors]
+		print ("rung {}: training {} configurations for {} epochs".format(
+			rung, len(survivors), budget))
+		to_train = [argv for argv in argvs if not is_complete(
+			make_args(argv, args.cache_path, configure=False))]
+		failed += train_all(pool, to_train, args)
+
+		if rung == len(budgets) - 1:
+			break
+
+		results = pool.map(score_configuration,
+			[(config, argv, args.cache_path, spec, args.score_edges)
+				for config, argv in zip(survivors, argvs)])
+
+		scores = {}
+		unscored = []
+		for config, argv, (score, error) in zip(survivors, argvs, results):
+			if error is not None:
+				print ("FAILED to score {}\n{}".format(config, error))
+				failed.append(argv)
+				unscored.append(config)
+				continue
+			scores.setdefault((bracket(config), arm(config)), []).append(score)
+		if len(unscored) > 0:
+			history.append({"rung": rung, "budget": budget,
+				"failed_to_score": unscored})
+		mean_scores = {key: np.mean(s) for key, s in scores.items()}
+
+		keep = set()
+		for b in set(key[0] for key in mean_scores):
+			arms = sorted((key for key in mean_scores if key[0] == b),
+				key=lambda key: -mean_scores[key])
+			num_keep = int(np.ceil(len(arms) / float(args.eta)))
+			print ("\nrung {} {}".format(rung, " ".join(b)))
+			print ("{:>6s} {:>5s} {:>12s} {:>8s}".format("alpha", "dim",
+				"context size", "AUROC"))
+			for i, key in enumerate(arms):
+				alpha, dim, context_size = key[1]
+				print ("{:>6s} {:>5d} {:>12s} {:>8.4f}{}".format(
+					format_alpha(alpha), dim, str(context_size), 
+					mean_scores[key], " *" if i < num_keep else ""))
+			keep.update(arms[:num_keep])
+			history.append({"rung": rung, "budget": budget, 
+				"bracket": list(b),
+				"scores": [[list(key[1]), mean_scores[key]] for key in arms],
+				"kept": [list(key[1]) for key in arms[:num_keep]]})
+
+		survivors = [config for config in survivors
+			if (bracket(config), arm(config)) in keep]
+
+		if not os.path.exists(args.cache_path):
+			os.makedirs(args.cache_path, exist_ok=True)
+		with open(os.path.join(args.cache_path, 
+			"successive_halving.json"), "w") as f:
+			json.dump(history, f, indent=1)
+
+	return failed, survivors
+
+def main():
+
+	args = parse_args()
+
+	with open(args.spec, "r") as f:
+		spec = json.load(f)
+
+	configs = list(expand_grid(spec))
+	print ("{} configurations in the grid".format(len(configs)))
+
+	if args.successive_halving:
+		if args.dry_run:
+			print ("rung budgets: {} epochs".format(rung_budgets(
+				args.min_epochs, spec.get("num_epochs", 5), args.eta)))
+			return
+		start_time = time.time()
+		context = multiprocessing.get_context("spawn")
+		with context.Pool(processes=args.processes) as pool:
+			failed, survivors = successive_halving(pool, configs, spec, args)
+		print ("sweep complete: {} configurations trained to {} epochs, {} failed ({:.2f}s)".format(
+			len(survivors), spec.get("num_epochs", 5), len(failed), 
+			time.time() - start_time))
+		return
+
+	argvs = [configuration_argv(config, spec) for config in configs]
+	argvs = [argv for argv in argvs
+		if not is_complete(make_args(argv, args.cache_path, configure=False))]
+	print ("{} configurations to train".format(len(argvs)))
+
+	if args.dry_run:
+		for argv in argvs:
+			print ("python main.py " + " ".join(argv))
+		return
+	if len(argvs) == 0:
+		return
+
+	start_time = time.time()
+	# tensorflow is not fork safe
+	context = multiprocessing.get_context("spawn")
+	with context.Pool(processes=args.processes) as pool:
+		failed = train_all(pool, argvs, args)
+
+	print ("sweep complete: {} trained, {} failed ({:.2f}s)".format(
+		len(argvs) - len(failed), len(failed), time.time() - start_time))
+
+if __name__ == "__main__":
+	main()